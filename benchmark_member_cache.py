@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Member Cache Memory Benchmark
+
+Usage:
+  python benchmark_member_cache.py [member_count]
+
+Compares the memory used by a synthetic guild (50,000 members by default)
+under the old gateway setup (Intents.all() with every member and presence
+cached) and the configurable setup from gateway_config (default intents,
+no member cache). Both runs are fed the same GUILD_MEMBERS_CHUNK payloads
+that Discord sends when a guild is chunked, so the difference comes only
+from the intents and member cache policy. No Discord connection is needed.
+"""
+
+import asyncio
+import gc
+import sys
+import tracemalloc
+
+import discord
+from discord.state import ChunkRequest, ConnectionState
+
+from gateway_config import DEFAULT_GATEWAY_SETTINGS, build_intents, build_member_cache_flags
+
+GUILD_ID = 100000000000000000
+CHUNK_SIZE = 1000  # Discord sends at most 1000 members per chunk
+
+
+def make_guild_payload(member_count):
+    """Build a GUILD_CREATE style payload with a handful of roles"""
+    roles = [{"id": str(GUILD_ID), "name": "@everyone", "permissions": "104324673", "position": 0, "color": 0}]
+    for i in range(1, 21):
+        roles.append({"id": str(GUILD_ID + i), "name": f"Crew {i}", "permissions": "0", "position": i, "color": 0})
+
+    return {
+        "id": str(GUILD_ID),
+        "name": "Synthetic Guild",
+        "owner_id": str(GUILD_ID + 1000),
+        "roles": roles,
+        "emojis": [],
+        "stickers": [],
+        "features": [],
+        "member_count": member_count,
+        "large": True
+    }
+
+
+def make_member_chunks(member_count):
+    """Yield GUILD_MEMBERS_CHUNK payloads (members and presences) for the synthetic guild"""
+    chunk_count = (member_count + CHUNK_SIZE - 1) // CHUNK_SIZE
+
+    for chunk_index in range(chunk_count):
+        members = []
+        presences = []
+        start = chunk_index * CHUNK_SIZE
+
+        for n in range(start, min(start + CHUNK_SIZE, member_count)):
+            user_id = str(GUILD_ID + 10000 + n)
+            members.append({
+                "user": {
+                    "id": user_id,
+                    "username": f"pirate{n}",
+                    "discriminator": "0",
+                    "global_name": f"Pirate {n}",
+                    "avatar": None
+                },
+                "roles": [str(GUILD_ID + 1 + (n % 20))],
+                "joined_at": "2024-01-01T00:00:00+00:00",
+                "deaf": False,
+                "mute": False,
+                "flags": 0
+            })
+            presences.append({
+                "user": {"id": user_id},
+                "status": "online",
+                "activities": [{"name": "One Piece Odyssey", "type": 0}],
+                "client_status": {"desktop": "online"}
+            })
+
+        yield {
+            "guild_id": str(GUILD_ID),
+            "members": members,
+            "presences": presences,
+            "chunk_index": chunk_index,
+            "chunk_count": chunk_count
+        }
+
+
+def measure(label, intents, member_cache_flags, member_count):
+    """
+    Feed the synthetic guild through a connection state and measure retained memory
+    :return: Tuple of (bytes retained, members cached)
+    """
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+
+    state = ConnectionState(
+        dispatch=lambda *args, **kwargs: None,
+        handlers={},
+        hooks={},
+        http=None,
+        intents=intents,
+        member_cache_flags=member_cache_flags,
+        chunk_guilds_at_startup=False
+    )
+    guild = state._add_guild_from_data(make_guild_payload(member_count))
+
+    # Register the chunk request the same way ConnectionState.chunk_guild does,
+    # members are only kept if the member cache policy caches joined members
+    loop = asyncio.new_event_loop()
+    request = ChunkRequest(guild.id, guild.shard_id, loop, state._get_guild, cache=member_cache_flags.joined)
+    state._chunk_requests[guild.id] = request
+
+    # Presences are only sent when the presences intent is enabled
+    for chunk in make_member_chunks(member_count):
+        chunk["nonce"] = request.nonce
+        if not intents.presences:
+            chunk.pop("presences")
+        state.parse_guild_members_chunk(chunk)
+
+    loop.close()
+    del request
+
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    cached_members = len(guild.members)
+    print(f"{label:<32} {retained / (1024 * 1024):>10.1f} MiB {cached_members:>12,} members cached")
+
+    # Keep the state alive until after the measurement
+    del guild, state
+    return retained, cached_members
+
+
+def main():
+    member_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    print(f"\n===== Member Cache Benchmark ({member_count:,} members) =====")
+    print(f"{'Configuration':<32} {'Memory':>14} {'Cache':>20}")
+
+    legacy_intents = discord.Intents.all()
+    legacy_retained, _ = measure(
+        "Intents.all() (old)",
+        legacy_intents,
+        discord.MemberCacheFlags.from_intents(legacy_intents),
+        member_count
+    )
+
+    intents = build_intents(DEFAULT_GATEWAY_SETTINGS)
+    configured_retained, _ = measure(
+        "gateway_config defaults (new)",
+        intents,
+        build_member_cache_flags(intents, DEFAULT_GATEWAY_SETTINGS),
+        member_count
+    )
+
+    saved = legacy_retained - configured_retained
+    print(f"\nSaved {saved / (1024 * 1024):.1f} MiB "
+          f"({saved / legacy_retained * 100 if legacy_retained else 0:.1f}% of the old footprint)")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ import sys
 import json
 import asyncio
 import datetime
+import time
 import logging
 import traceback
 
@@ -53,6 +54,50 @@ except ModuleNotFoundError:
         }
     }
     config.SERVER_SETTINGS = {}
+    config.GATEWAY = {
+        "MEMBERS_INTENT": os.environ.get("GATEWAY_MEMBERS_INTENT", "false").lower() == "true",
+        "PRESENCES_INTENT": False,
+        "MESSAGE_CONTENT_INTENT": False,
+        "MEMBER_CACHE": os.environ.get("GATEWAY_MEMBER_CACHE", "none"),
+        "CHUNK_GUILDS_AT_STARTUP": False
+    }
+    config.COMMAND_QUEUE = {
+        "WORKERS": int(os.environ.get("COMMAND_QUEUE_WORKERS", 4)),
+        "MAX_SIZE": int(os.environ.get("COMMAND_QUEUE_MAX_SIZE", 100))
+    }
+    config.MULTIPROCESS = {
+        "STORE_PATH": os.environ.get("SHARED_STORE_PATH", ""),
+        "WORKERS": int(os.environ.get("MULTIPROCESS_WORKERS", 2)),
+        "SHARD_COUNT": int(os.environ.get("MULTIPROCESS_SHARD_COUNT", 2)),
+        "LOCK_TIMEOUT": 30,
+        "LOCK_TTL": 120
+    }
+    config.REMINDERS = {
+        "ENABLED": os.environ.get("REMINDERS_ENABLED", "true").lower() == "true",
+        "OFFSETS_HOURS": [24, 1],
+        "DM_BORROWERS": True,
+        "ADMIN_DIGEST": True,
+        "GLOBAL_RATE": 25,
+        "ROUTE_RATE": 5,
+        "ROUTE_PERIOD": 5,
+        "WORKERS": 4
+    }
+    config.CHARTS = {
+        "WORKERS": int(os.environ.get("CHART_WORKERS", 2)),
+        "CACHE_SIZE": 128
+    }
+    config.LOOP_MONITOR = {
+        "ENABLED": os.environ.get("LOOP_MONITOR_ENABLED", "true").lower() == "true",
+        "INTERVAL": 0.25,
+        "SLOW_THRESHOLD": 0.5,
+        "HISTORY": 20
+    }
+    config.SHARDING = {
+        "ENABLED": os.environ.get("SHARDING_ENABLED", "false").lower() == "true",
+        "SHARD_COUNT": int(os.environ["SHARD_COUNT"]) if os.environ.get("SHARD_COUNT") else None,
+        "SHARD_IDS": [int(i) for i in os.environ.get("SHARD_IDS", "").split(",") if i.strip()] or None,
+        "BACKUP_MINUTES": 5
+    }
     sys.modules['config'] = config
     logger.info("Created config module from environment variables")
 
@@ -82,17 +127,66 @@ except ModuleNotFoundError:
     
     server_settings.load_settings = load_settings
     server_settings.save_settings = lambda: None
+    server_settings.schedule_save = lambda: None
+    server_settings.flush_settings = lambda: asyncio.sleep(0)
+    server_settings.reload_if_changed = lambda: asyncio.sleep(0, 0)
     server_settings.get_guild_settings = lambda guild_id: config.SERVER_SETTINGS.get(str(guild_id), {})
     server_settings.get_captain_role = lambda guild_id: server_settings.get_guild_settings(guild_id).get("captain_role_id", None)
     server_settings.check_is_captain = lambda guild_id, member: True  # Default allow everyone
+    server_settings.get_approval_roles = lambda guild_id: server_settings.get_guild_settings(guild_id).get("approval_roles", [])
+    server_settings.get_approval_role_ids = lambda guild_id: frozenset(int(role_id) for role_id in server_settings.get_approval_roles(guild_id))
+    server_settings.add_settings_listener = lambda callback: None
     sys.modules['server_settings'] = server_settings
     logger.info("Created fallback server_settings module")
 
-# Initialize bot with proper intents
-intents = discord.Intents.all()  # Enable all intents for better functionality
+# Initialize bot with the configured intents and member cache policy
+from gateway_config import get_bot_options
+bot_options = get_bot_options()
+intents = bot_options["intents"]
+
+logger.info(
+    f"Gateway intents: members={intents.members}, presences={intents.presences}, "
+    f"message_content={intents.message_content}; member cache: {bot_options['member_cache_flags']}"
+)
+
+# Create bot instance (sharded if enabled in config.SHARDING), timing slash commands for /metrics
+import sharding
+import metrics
+from metrics import CommandTimingTree
+sharding_settings = sharding.get_sharding_settings()
+
+if sharding_settings["ENABLED"]:
+    shard_options = sharding.get_shard_options(sharding_settings)
+    logger.info(f"Sharding enabled: {shard_options or 'automatic shard count'}")
+    bot = commands.AutoShardedBot(command_prefix="/", tree_cls=CommandTimingTree, **bot_options, **shard_options)
+else:
+    bot = commands.Bot(command_prefix="/", tree_cls=CommandTimingTree, **bot_options)
 
-# Create bot instance
-bot = commands.Bot(command_prefix="/", intents=intents)
+# Per-shard command counters for /botstats
+bot.shard_stats = sharding.ShardStats()
+
+# Bounded worker pool for slow commands (acknowledged first, answered via followup)
+from command_queue import CommandQueue
+queue_settings = getattr(config, "COMMAND_QUEUE", {})
+bot.command_queue = CommandQueue(
+    workers=queue_settings.get("WORKERS", 4),
+    max_size=queue_settings.get("MAX_SIZE", 100)
+)
+
+# Shared SQLite store for multi-process deployments (None unless configured)
+import shared_store
+store = shared_store.open_shared_store()
+
+# Per-guild admin and approver cache, rebuilt when approval roles change
+from guild_admin_cache import admin_cache
+server_settings.add_settings_listener(admin_cache.invalidate)
+
+# Captain and approver checks for the loan commands, cached only when every
+# member's role changes reach on_member_update
+from permissions import permission_service
+permission_service.cache_enabled = (
+    intents.members and bot_options["member_cache_flags"].joined and bot_options["chunk_guilds_at_startup"]
+)
 
 # Initialize database (in-memory)
 bot.loan_database = {
@@ -102,6 +196,43 @@ bot.loan_database = {
     "loan_requests": []  # Array to store pending loan requests
 }
 
+# Database sizes for /metrics, read only when metrics are scraped
+metrics.registry.gauge(
+    "loanbot_database_records",
+    "Records in the in-memory loan database by collection",
+    labels=("collection",),
+    callback=lambda: {(name, ): len(records) for name, records in bot.loan_database.items() if isinstance(records, (list, dict))}
+)
+
+# Lookup tables over the loan database for loan_id lookups and autocomplete
+from loan_index import LoanIndex
+bot.loan_index = LoanIndex()
+
+# Running per-user and per-guild loan statistics for /credit and /loanstats
+from loan_stats import LoanStats
+bot.loan_stats = LoanStats()
+
+# Event loop lag and slow callback monitor for /metrics and /looplag
+from loop_monitor import LoopMonitor
+bot.loop_monitor = LoopMonitor()
+
+# Process pool and cache for /loanchart images
+from loan_charts import ChartRenderer
+bot.chart_renderer = ChartRenderer()
+
+# Background tasks driven by loan due dates: late fees and credit penalties
+# when loans become overdue, and due-date reminders (if enabled)
+from overdue_scheduler import OverdueScheduler
+from reminders import ReminderDispatcher, ReminderScheduler, get_reminder_settings
+bot.overdue_scheduler = OverdueScheduler(bot)
+bot.loan_schedulers = [bot.overdue_scheduler]
+
+reminder_settings = get_reminder_settings()
+bot.reminder_scheduler = None
+if reminder_settings["ENABLED"]:
+    bot.reminder_scheduler = ReminderScheduler(bot, ReminderDispatcher(bot, reminder_settings), reminder_settings)
+    bot.loan_schedulers.append(bot.reminder_scheduler)
+
 
 @bot.event
 async def on_ready():
@@ -113,8 +244,16 @@ async def on_ready():
     for guild in bot.guilds:
         logger.info(f"Connected to guild: {guild.name} (ID: {guild.id})")
     
-    # Start tasks
-    backup_database.start()
+    # Start tasks (sharded bots start a backup task per shard in on_shard_ready,
+    # and nothing needs backing up when changes are written to the shared store)
+    if not sharding_settings["ENABLED"] and store is None and not backup_database.is_running():
+        backup_database.start()
+    
+    if not reconcile_loan_stats.is_running():
+        reconcile_loan_stats.start()
+    
+    if not watch_server_settings.is_running():
+        watch_server_settings.start()
     
     # No need to register commands on startup if they were already registered by deploy_commands.py
     # If you want to update commands, run deploy_commands.py manually
@@ -127,26 +266,93 @@ async def on_interaction(interaction):
     """Event triggered when an interaction is received"""
     # The commands framework handles most interactions, but we can log them here
     if interaction.type == discord.InteractionType.application_command:
-        logger.info(f"Command used: {interaction.command.name} by {interaction.user}")
+        logger.info(f"Command used: {interaction.command.name if interaction.command else interaction.data.get('name')} by {interaction.user}")
+        
+        # Count the command for the shard handling its guild
+        shard_id = sharding.shard_id_for_guild(interaction.guild_id, sharding.get_shard_count(bot)) if interaction.guild_id else 0
+        bot.shard_stats.record_command(shard_id)
     
-    # Handle button interactions
+    # Log button interactions (the cogs' on_interaction listeners handle them)
     elif interaction.type == discord.InteractionType.component:
         custom_id = interaction.data.get("custom_id", "")
         logger.info(f"Button clicked: {custom_id} by {interaction.user}")
-        
-        # Let the loan command cog handle loan approval/denial buttons
-        if custom_id.startswith("approve_loan_") or custom_id.startswith("deny_loan_"):
-            loan_command = bot.get_cog("LoanCommand")
-            if loan_command:
-                await loan_command.on_interaction(interaction)
-            else:
-                logger.error("LoanCommand cog not found for button interaction")
+
+
+@bot.event
+async def on_app_command_completion(interaction, command):
+    """Event triggered when a slash command finished without an error"""
+    metrics.record_command(interaction, "ok")
+
+
+@bot.event
+async def on_member_update(before, after):
+    """Event triggered when a cached member is updated"""
+    # Keep the admin/approver cache and permission checks current when a member's roles change
+    if before.roles != after.roles:
+        admin_cache.update_member(after)
+        permission_service.invalidate_member(after)
+
+
+@bot.event
+async def on_guild_role_update(before, after):
+    """Event triggered when a role is updated"""
+    # Role permission changes can add or remove administrators
+    if before.permissions != after.permissions:
+        admin_cache.invalidate(after.guild.id)
+        permission_service.invalidate_roles(after.guild.id)
+
+
+@bot.event
+async def on_guild_role_delete(role):
+    """Event triggered when a role is deleted"""
+    admin_cache.invalidate(role.guild.id)
+    permission_service.invalidate_roles(role.guild.id)
+
+
+@bot.event
+async def on_shard_ready(shard_id):
+    """Event triggered when a shard is ready (sharded mode only)"""
+    shard_guilds = sum(1 for guild in bot.guilds if guild.shard_id == shard_id)
+    logger.info(f"Shard {shard_id} is ready with {shard_guilds} guilds")
+    
+    if sharding_settings["ENABLED"] and store is None:
+        start_shard_backup(shard_id)
+
+
+# Backup tasks of the shards run by this process
+shard_backups = {}
+
+
+def start_shard_backup(shard_id):
+    """Start the backup task of a shard, which only writes that shard's guilds"""
+    if shard_id in shard_backups:
+        return
+    
+    @tasks.loop(minutes=sharding_settings["BACKUP_MINUTES"])
+    async def backup_shard():
+        try:
+            started_at = time.perf_counter()
+            owned_shards = sharding.get_owned_shards(bot)
+            sharding.save_shard_backup(
+                bot.loan_database,
+                shard_id,
+                sharding.get_shard_count(bot),
+                include_global=shard_id == owned_shards[0]
+            )
+            metrics.BACKUP_SECONDS.observe(time.perf_counter() - started_at, "shard")
+        except Exception as e:
+            logger.error(f"Error backing up shard {shard_id}: {e}")
+    
+    shard_backups[shard_id] = backup_shard
+    backup_shard.start()
 
 
 @tasks.loop(minutes=5)
 async def backup_database():
     """Task to backup the database every 5 minutes"""
     try:
+        started_at = time.perf_counter()
+        
         # Ensure data directory exists
         os.makedirs("data", exist_ok=True)
         
@@ -156,12 +362,50 @@ async def backup_database():
         # Save to file
         with open("data/database.json", "w") as f:
             json.dump(database_copy, f, indent=2)
-            
+        
+        metrics.BACKUP_SECONDS.observe(time.perf_counter() - started_at, "full")
         logger.info("Database backed up to file")
     except Exception as e:
         logger.error(f"Error saving database to backup: {e}")
 
 
+@tasks.loop(hours=6)
+async def reconcile_loan_stats():
+    """Task to check the loan statistics against the loan records (at startup and every 6 hours)"""
+    try:
+        # Recompute from a snapshot in a worker thread, so the full scan never blocks the event loop
+        stats = bot.loan_stats
+        snapshot = stats.snapshot(bot.loan_database)
+        expected = await asyncio.to_thread(stats.compute_expected, snapshot)
+        
+        # Guilds whose loans changed meanwhile are checked again next time
+        changed = stats.changed_since(snapshot)
+        if changed is None:
+            logger.info("Loan statistics were reloaded during verification, skipping this run")
+            return
+        fixed_users, fixed_days = stats.reconcile(bot.loan_database, expected=expected, skip_guilds=changed)
+        
+        # Write the corrected statistics through to the shared store
+        if store is not None:
+            if fixed_users:
+                await asyncio.to_thread(store.set_user_stats, fixed_users)
+            if fixed_days:
+                await asyncio.to_thread(store.set_daily_stats, fixed_days)
+        
+        logger.info(f"Loan statistics verified ({len(fixed_users) + len(fixed_days)} corrected)")
+    except Exception as e:
+        logger.error(f"Error reconciling loan statistics: {e}")
+
+
+@tasks.loop(seconds=5)
+async def watch_server_settings():
+    """Task to reload the server settings when the file is changed by hand or by another process"""
+    try:
+        await server_settings.reload_if_changed()
+    except Exception as e:
+        logger.error(f"Error reloading server settings: {e}")
+
+
 async def load_commands():
     """Load all command cogs from the commands directory"""
     for filename in os.listdir("commands"):
@@ -175,53 +419,95 @@ async def load_commands():
                 traceback.print_exc()
 
 
+def import_backup_into_store():
+    """Import the JSON backup into the shared store (runs in a worker thread)"""
+    with open("data/database.json", "r") as f:
+        store.import_database(json.load(f))
+
+
 async def load_database():
     """Load database from backup file if available"""
     try:
-        if os.path.exists("data/database.json"):
+        data = None
+        
+        # Worker processes load their shards' loans from the shared store
+        if store is not None:
+            # The first worker to start moves the JSON backup into an empty store.
+            # Waiting for the lock and the SQLite work stay off the event loop
+            async with store.locked("import"):
+                if await asyncio.to_thread(store.is_empty) and os.path.exists("data/database.json"):
+                    await asyncio.to_thread(import_backup_into_store)
+            
+            data = await asyncio.to_thread(
+                store.load_database,
+                shard_ids=sharding_settings["SHARD_IDS"] if sharding_settings["ENABLED"] else None,
+                shard_count=sharding_settings["SHARD_COUNT"]
+            )
+        
+        # Sharded bots load the shard backups (only this process's shards if known)
+        elif sharding_settings["ENABLED"]:
+            data = sharding.load_shard_backups(
+                shard_ids=sharding_settings["SHARD_IDS"],
+                shard_count=sharding_settings["SHARD_COUNT"]
+            )
+        
+        if data is None and os.path.exists("data/database.json"):
             with open("data/database.json", "r") as f:
                 data = json.load(f)
-                
-                # Convert string dates back to datetime objects
-                if "loans" in data:
-                    for loan in data["loans"]:
-                        if "request_date" in loan:
-                            loan["request_date"] = datetime.datetime.fromisoformat(loan["request_date"])
-                        if "due_date" in loan:
-                            loan["due_date"] = datetime.datetime.fromisoformat(loan["due_date"])
-                
-                if "history" in data:
-                    for loan in data["history"]:
-                        if "request_date" in loan:
-                            loan["request_date"] = datetime.datetime.fromisoformat(loan["request_date"])
-                        if "due_date" in loan:
-                            loan["due_date"] = datetime.datetime.fromisoformat(loan["due_date"])
-                        if "repaid_date" in loan:
-                            loan["repaid_date"] = datetime.datetime.fromisoformat(loan["repaid_date"])
-                
-                # Convert string dates in loan requests
-                if "loan_requests" in data:
-                    for request in data["loan_requests"]:
-                        if "request_date" in request:
-                            request["request_date"] = datetime.datetime.fromisoformat(request["request_date"])
-                        if "due_date" in request:
-                            request["due_date"] = datetime.datetime.fromisoformat(request["due_date"])
-                        if "approved_date" in request:
-                            request["approved_date"] = datetime.datetime.fromisoformat(request["approved_date"])
-                        if "denied_date" in request:
-                            request["denied_date"] = datetime.datetime.fromisoformat(request["denied_date"])
-                
-                # Update the bot's database
-                if "loans" in data:
-                    bot.loan_database["loans"] = data["loans"]
-                if "history" in data:
-                    bot.loan_database["history"] = data["history"]
-                if "credit_scores" in data:
-                    bot.loan_database["credit_scores"] = data["credit_scores"]
-                if "loan_requests" in data:
-                    bot.loan_database["loan_requests"] = data["loan_requests"]
-                
-                logger.info("Database loaded from backup file")
+        
+        if data is not None:
+            # Convert string dates back to datetime objects
+            if "loans" in data:
+                for loan in data["loans"]:
+                    if "request_date" in loan:
+                        loan["request_date"] = datetime.datetime.fromisoformat(loan["request_date"])
+                    if "due_date" in loan:
+                        loan["due_date"] = datetime.datetime.fromisoformat(loan["due_date"])
+            
+            if "history" in data:
+                for loan in data["history"]:
+                    if "request_date" in loan:
+                        loan["request_date"] = datetime.datetime.fromisoformat(loan["request_date"])
+                    if "due_date" in loan:
+                        loan["due_date"] = datetime.datetime.fromisoformat(loan["due_date"])
+                    if "repaid_date" in loan:
+                        loan["repaid_date"] = datetime.datetime.fromisoformat(loan["repaid_date"])
+            
+            # Convert string dates in loan requests
+            if "loan_requests" in data:
+                for request in data["loan_requests"]:
+                    if "request_date" in request:
+                        request["request_date"] = datetime.datetime.fromisoformat(request["request_date"])
+                    if "due_date" in request:
+                        request["due_date"] = datetime.datetime.fromisoformat(request["due_date"])
+                    if "approved_date" in request:
+                        request["approved_date"] = datetime.datetime.fromisoformat(request["approved_date"])
+                    if "denied_date" in request:
+                        request["denied_date"] = datetime.datetime.fromisoformat(request["denied_date"])
+            
+            # Update the bot's database
+            if "loans" in data:
+                bot.loan_database["loans"] = data["loans"]
+            if "history" in data:
+                bot.loan_database["history"] = data["history"]
+            if "credit_scores" in data:
+                bot.loan_database["credit_scores"] = data["credit_scores"]
+            if "loan_requests" in data:
+                bot.loan_database["loan_requests"] = data["loan_requests"]
+            if "credit_adjustments" in data:
+                bot.loan_database["credit_adjustments"] = data["credit_adjustments"]
+            if "user_stats" in data:
+                bot.loan_database["user_stats"] = data["user_stats"]
+            if "daily_stats" in data:
+                bot.loan_database["daily_stats"] = data["daily_stats"]
+            
+            logger.info("Database loaded from backup file")
+        
+        # Index the loaded loans and requests, and schedule their due dates
+        bot.loan_index.rebuild(bot.loan_database)
+        bot.loan_stats.load(bot.loan_database)
+        for scheduler in bot.loan_schedulers:
+            scheduler.rebuild(bot.loan_database)
     except Exception as e:
         logger.error(f"Error loading database from backup: {e}")
         traceback.print_exc()
@@ -237,6 +523,19 @@ async def main():
         # Load server settings
         server_settings.load_settings()
         
+        # Start the chart processes first, so they are forked before any threads exist
+        bot.chart_renderer.start()
+        
+        # Start the command worker pool and the due date schedulers
+        bot.command_queue.start()
+        if bot.reminder_scheduler is not None:
+            bot.reminder_scheduler.dispatcher.start()
+        for scheduler in bot.loan_schedulers:
+            scheduler.start()
+        
+        # Watch the event loop for lag and blocking callbacks
+        bot.loop_monitor.start()
+        
         # Try to connect to Discord
         logger.info("Attempting to connect to Discord with token...")
         
@@ -257,11 +556,21 @@ async def main():
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
         traceback.print_exc()
+    finally:
+        # discord.py has no close event, so clean up here however the bot stopped
+        if not bot.is_closed():
+            await bot.close()
+        await cleanup_resources()
+        
+        # Write any server settings changes still waiting for the debounced writer
+        try:
+            await server_settings.flush_settings()
+        except Exception as e:
+            logger.error(f"Error saving pending server settings: {e}")
 
 
-@bot.event
-async def on_close():
-    """Event triggered when the bot is closing"""
+async def cleanup_resources():
+    """Release the bot's sessions, workers and processes after it stopped"""
     logger.info("Bot is shutting down, cleaning up resources...")
     
     # Close the UnbelievaBoat API session if it exists
@@ -274,6 +583,17 @@ async def on_close():
     except Exception as e:
         logger.error(f"Error closing UnbelievaBoat API session: {e}")
     
+    # Stop the due date schedulers, the command worker pool and the chart processes
+    for scheduler in bot.loan_schedulers:
+        scheduler.stop()
+    if bot.reminder_scheduler is not None:
+        bot.reminder_scheduler.dispatcher.stop()
+    await bot.command_queue.stop()
+    bot.chart_renderer.stop()
+    
+    # Stop the event loop monitor
+    bot.loop_monitor.stop()
+    
     logger.info("Cleanup complete, bot shutting down.")
 
 
@@ -0,0 +1,177 @@
+"""
+Command Work Queue
+
+This module provides an acknowledge-first execution layer for slow commands.
+Interactions are deferred straight away so Discord's 3-second deadline is
+always met, and the actual work (database scans, UnbelievaBoat calls, user
+fetches) runs on a bounded pool of asyncio workers that deliver their results
+through interaction followups.
+"""
+
+import asyncio
+import logging
+import time
+
+import discord
+
+import metrics
+
+logger = logging.getLogger("command_queue")
+
+
+class CommandQueue:
+    def __init__(self, workers=4, max_size=100):
+        """
+        Initialize the queue
+        :param workers: Number of worker tasks processing queued commands
+        :param max_size: Maximum number of commands waiting in the queue
+        """
+        self.worker_count = max(1, int(workers))
+        self.max_size = max(1, int(max_size))
+        self.queue = None
+        self.workers = []
+        self.stats = {}
+
+    def start(self):
+        """Start the worker tasks (must be called from a running event loop)"""
+        if self.workers:
+            return
+
+        if self.queue is None:
+            self.queue = asyncio.Queue(maxsize=self.max_size)
+
+        for number in range(self.worker_count):
+            self.workers.append(asyncio.create_task(self._worker(number)))
+
+        logger.info(f"Command queue started with {self.worker_count} workers (max {self.max_size} queued)")
+
+    async def stop(self):
+        """Cancel the worker tasks"""
+        for worker in self.workers:
+            worker.cancel()
+
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        logger.info("Command queue stopped")
+
+    def submit(self, name, handler, *args):
+        """
+        Queue a coroutine function for execution on the worker pool
+        :param name: Command name used for timing statistics
+        :param handler: Coroutine function to run
+        :param args: Arguments passed to the handler
+        :return: True if queued, False if the queue is full
+        """
+        self.start()
+
+        try:
+            self.queue.put_nowait((name, handler, args, time.monotonic()))
+        except asyncio.QueueFull:
+            logger.warning(f"Command queue full, rejecting {name}")
+            self._get_command_stats(name)["rejected"] += 1
+            return False
+
+        return True
+
+    async def _worker(self, number):
+        """Process queued commands until cancelled"""
+        while True:
+            name, handler, args, enqueued_at = await self.queue.get()
+            started_at = time.monotonic()
+            metrics.label_current_task(f"queued {name}")
+
+            try:
+                await handler(*args)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error running queued command {name} on worker {number}: {e}")
+                import traceback
+                logger.error(traceback.format_exc())
+            finally:
+                finished_at = time.monotonic()
+                self._record(name, started_at - enqueued_at, finished_at - started_at)
+                self.queue.task_done()
+
+    def _get_command_stats(self, name):
+        """Get (or create) the statistics entry for a command"""
+        if name not in self.stats:
+            self.stats[name] = {
+                "count": 0,
+                "rejected": 0,
+                "wait_total": 0.0,
+                "wait_max": 0.0,
+                "run_total": 0.0,
+                "run_max": 0.0
+            }
+        return self.stats[name]
+
+    def _record(self, name, wait_time, run_time):
+        """Record queue wait and execution time for a finished command"""
+        stats = self._get_command_stats(name)
+        stats["count"] += 1
+        stats["wait_total"] += wait_time
+        stats["wait_max"] = max(stats["wait_max"], wait_time)
+        stats["run_total"] += run_time
+        stats["run_max"] = max(stats["run_max"], run_time)
+        metrics.QUEUE_WAIT_SECONDS.observe(wait_time, name)
+        metrics.QUEUE_RUN_SECONDS.observe(run_time, name)
+
+        logger.info(f"Command {name} finished (queued {wait_time * 1000:.1f}ms, ran {run_time * 1000:.1f}ms)")
+
+    def get_stats(self):
+        """
+        Get per-command timing statistics
+        :return: Dict of command name to count, rejected and avg/max wait and run times in seconds
+        """
+        result = {}
+        for name, stats in self.stats.items():
+            count = stats["count"]
+            result[name] = {
+                "count": count,
+                "rejected": stats["rejected"],
+                "wait_avg": stats["wait_total"] / count if count else 0.0,
+                "wait_max": stats["wait_max"],
+                "run_avg": stats["run_total"] / count if count else 0.0,
+                "run_max": stats["run_max"]
+            }
+        return result
+
+    def pending(self):
+        """Number of commands currently waiting in the queue"""
+        return self.queue.qsize() if self.queue is not None else 0
+
+
+async def defer_and_enqueue(bot, interaction, name, handler, *args, ephemeral=False):
+    """
+    Acknowledge an interaction immediately and queue the work behind it
+    :param bot: The bot instance (uses bot.command_queue if available)
+    :param interaction: The Discord interaction to acknowledge
+    :param name: Command name used for timing statistics
+    :param handler: Coroutine function that does the work and replies via followup
+    :param args: Arguments passed to the handler
+    :param ephemeral: Whether the deferred response should be ephemeral
+    """
+    try:
+        if not interaction.response.is_done():
+            await interaction.response.defer(ephemeral=ephemeral)
+    except discord.errors.HTTPException as e:
+        if e.code != 40060:  # Not "interaction already acknowledged"
+            logger.error(f"Error deferring {name}: {e}")
+            return
+
+    command_queue = getattr(bot, "command_queue", None)
+
+    # Without a queue (e.g. standalone scripts) just run the work inline
+    if command_queue is None:
+        await handler(*args)
+        return
+
+    if not command_queue.submit(name, handler, *args):
+        try:
+            await interaction.followup.send(
+                "The bot is busy right now. Please try again in a moment.",
+                ephemeral=True
+            )
+        except Exception as e:
+            logger.error(f"Error sending busy message for {name}: {e}")
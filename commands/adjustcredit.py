@@ -8,6 +8,8 @@ import os
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from shared_store import persist
+
 
 class AdjustCreditCommand(commands.Cog):
     def __init__(self, bot):
@@ -63,6 +65,10 @@ class AdjustCreditCommand(commands.Cog):
         
         loan_database["credit_adjustments"].append(adjustment)
         
+        # Write through to the shared store in multi-process mode
+        new_scores = await persist(credit_deltas={user_id: amount}, adjustments=[adjustment], loan_database=loan_database)
+        new_score = new_scores.get(user_id, new_score)
+        
         # Create embed for response
         embed = discord.Embed(
             title="📊 Credit Score Adjusted",
@@ -0,0 +1,121 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+import math
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sharding
+from loan_locks import loan_locks
+from permissions import permission_service
+
+
+class BotStatsCommand(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    def _get_latencies(self):
+        """Get (shard_id, latency) pairs for every shard run by this process"""
+        if isinstance(self.bot, commands.AutoShardedBot):
+            return self.bot.latencies
+        return [(0, self.bot.latency)]
+
+    @app_commands.command(name="botstats", description="View per-shard latency, guild count and command throughput (Admin only)")
+    async def botstats(self, interaction: discord.Interaction):
+        # Check if the user has admin permissions
+        if not interaction.user.guild_permissions.administrator:
+            return await interaction.response.send_message(
+                "You need Administrator permissions to use this command.",
+                ephemeral=True
+            )
+
+        # Count guilds per shard
+        guild_counts = {}
+        for guild in self.bot.guilds:
+            guild_counts[guild.shard_id] = guild_counts.get(guild.shard_id, 0) + 1
+
+        shard_stats = getattr(self.bot, "shard_stats", None)
+        shard_count = sharding.get_shard_count(self.bot)
+        current_shard = interaction.guild.shard_id if interaction.guild else 0
+
+        embed = discord.Embed(
+            title="🤖 Bot Statistics",
+            description=f"{len(self.bot.guilds)} servers across {shard_count} shard{'s' if shard_count != 1 else ''}. "
+                        f"This server is on shard {current_shard}.",
+            color=0x0099FF
+        )
+
+        # Discord allows at most 25 fields per embed (five are used below)
+        for shard_id, latency in self._get_latencies()[:20]:
+            latency_text = "connecting" if latency is None or math.isinf(latency) or math.isnan(latency) else f"{latency * 1000:.0f}ms"
+
+            commands_handled = shard_stats.get_command_count(shard_id) if shard_stats else 0
+            command_rate = shard_stats.get_command_rate(shard_id) if shard_stats else 0.0
+
+            embed.add_field(
+                name=f"Shard {shard_id}",
+                value=f"Latency: {latency_text}\n"
+                      f"Guilds: {guild_counts.get(shard_id, 0)}\n"
+                      f"Commands: {commands_handled} ({command_rate:.2f}/min)",
+                inline=True
+            )
+
+        # Add loan lock contention
+        lock_stats = loan_locks.get_stats()
+        embed.add_field(
+            name="Loan Locks",
+            value=f"{lock_stats['contended']} of {lock_stats['acquired']} acquisitions waited "
+                  f"(avg {lock_stats['wait_avg'] * 1000:.0f}ms, max {lock_stats['wait_max'] * 1000:.0f}ms)",
+            inline=False
+        )
+
+        # Add permission check cache hit rate
+        permission_stats = permission_service.get_stats()
+        embed.add_field(
+            name="Permission Checks",
+            value=f"{permission_stats['hits']} cached, {permission_stats['misses']} evaluated "
+                  f"(hit rate {permission_stats['hit_rate'] * 100:.0f}%, {permission_stats['entries']} entries)",
+            inline=False
+        )
+
+        # Add command queue load if available
+        command_queue = getattr(self.bot, "command_queue", None)
+        if command_queue is not None:
+            embed.add_field(
+                name="Command Queue",
+                value=f"{command_queue.pending()} waiting, {command_queue.worker_count} workers",
+                inline=False
+            )
+
+        # Add due date reminder throughput if reminders are enabled
+        reminder_scheduler = getattr(self.bot, "reminder_scheduler", None)
+        if reminder_scheduler is not None:
+            reminder_stats = reminder_scheduler.dispatcher.get_stats()
+            embed.add_field(
+                name="Reminders",
+                value=f"{reminder_stats['sends_per_minute']} sends in the last minute, "
+                      f"{reminder_stats['pending']} waiting (queue lag {reminder_stats['queue_lag']:.1f}s, "
+                      f"last {reminder_stats['last_lag']:.1f}s)",
+                inline=False
+            )
+
+        # Add /loanchart rendering times and cache hit rate
+        chart_renderer = getattr(self.bot, "chart_renderer", None)
+        if chart_renderer is not None:
+            chart_stats = chart_renderer.get_stats()
+            embed.add_field(
+                name="Charts",
+                value=f"{chart_stats['renders']} rendered (avg {chart_stats['average_render'] * 1000:.0f}ms, "
+                      f"last {chart_stats['last_render'] * 1000:.0f}ms), "
+                      f"cache hit rate {chart_stats['hit_rate'] * 100:.0f}% ({chart_stats['cached']} cached)",
+                inline=False
+            )
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+async def setup(bot):
+    await bot.add_cog(BotStatsCommand(bot))
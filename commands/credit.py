@@ -8,6 +8,8 @@ import os
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from loan_stats import get_loan_stats
+
 
 class CreditCommand(commands.Cog):
     def __init__(self, bot):
@@ -29,30 +31,17 @@ class CreditCommand(commands.Cog):
         # Get credit score or default to 100
         credit_score = loan_database["credit_scores"].get(user_id, 100)
         
-        # Get completed loans
-        if "history" not in loan_database:
-            loan_database["history"] = []
-            
-        completed_loans = [loan for loan in loan_database["history"] 
-                          if loan.get("user_id") == user_id and loan.get("status") == "repaid"]
-        
-        # Get active loans
-        if "loans" not in loan_database:
-            loan_database["loans"] = []
-            
-        active_loans = [loan for loan in loan_database["loans"] 
-                        if loan.get("user_id") == user_id and loan.get("status") == "active"]
-        
-        # Calculate statistics
-        total_loans = len(completed_loans) + len(active_loans)
-        on_time_payments = sum(1 for loan in completed_loans 
-                              if loan.get("repaid_date") and loan.get("due_date") 
-                              and loan["repaid_date"] <= loan["due_date"])
+        # Get the user's running loan statistics for this server
+        stats = get_loan_stats(self.bot).get_user(interaction.guild_id, user_id)
         
-        late_payments = len(completed_loans) - on_time_payments
+        total_loans = stats["loans_taken"]
+        active_loans = stats["active_loans"]
+        repaid_loans = stats["loans_repaid"]
+        on_time_payments = stats["on_time"]
+        late_payments = stats["late"]
         
         # Calculate repayment rate
-        repayment_rate = 0 if total_loans == 0 else (len(completed_loans) / total_loans) * 100
+        repayment_rate = 0 if total_loans == 0 else (repaid_loans / total_loans) * 100
         
         # Determine credit rating and interest rate
         if credit_score >= 150:
@@ -85,8 +74,8 @@ class CreditCommand(commands.Cog):
         embed.add_field(
             name="Loan History",
             value=f"Total Loans: {total_loans}\n"
-                  f"Active Loans: {len(active_loans)}\n"
-                  f"Repaid Loans: {len(completed_loans)}\n"
+                  f"Active Loans: {active_loans}\n"
+                  f"Repaid Loans: {repaid_loans}\n"
                   f"Repayment Rate: {repayment_rate:.1f}%",
             inline=True
         )
@@ -112,7 +101,7 @@ class CreditCommand(commands.Cog):
             tips.append("• Make payments on time to avoid late fees")
         if credit_score < 100:
             tips.append("• Pay back several loans on time to improve your score")
-        if len(active_loans) > 3:
+        if active_loans > 3:
             tips.append("• Reduce your number of active loans")
         
         if tips:
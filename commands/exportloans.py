@@ -0,0 +1,108 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+import datetime
+import logging
+import tempfile
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loan_export import iter_records, write_export
+
+logger = logging.getLogger("discord")
+
+
+class ExportLoansCommand(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        
+    def _parse_date(self, value, end_of_day=False):
+        """Parse a YYYY-MM-DD date into a Unix timestamp (start or end of the day)"""
+        date = datetime.datetime.strptime(value, "%Y-%m-%d")
+        if end_of_day:
+            date += datetime.timedelta(days=1, microseconds=-1)
+        return date.timestamp()
+        
+    @app_commands.command(name="exportloans", description="Export the server's loans, history and requests as a compressed file (Admin only)")
+    @app_commands.describe(
+        format="File format (defaults to CSV)",
+        status="Only export records with this status",
+        since="Only export records requested on or after this date (YYYY-MM-DD)",
+        until="Only export records requested on or before this date (YYYY-MM-DD)"
+    )
+    @app_commands.choices(
+        format=[
+            app_commands.Choice(name="CSV", value="csv"),
+            app_commands.Choice(name="JSON Lines", value="jsonl")
+        ],
+        status=[
+            app_commands.Choice(name="Pending requests", value="pending"),
+            app_commands.Choice(name="Approved requests", value="approved"),
+            app_commands.Choice(name="Denied requests", value="denied"),
+            app_commands.Choice(name="Active loans", value="active"),
+            app_commands.Choice(name="Repaid loans", value="repaid")
+        ]
+    )
+    async def exportloans(self, interaction: discord.Interaction, format: str = "csv", status: str = None,
+                          since: str = None, until: str = None):
+        # Check if the user has admin permissions
+        if not interaction.user.guild_permissions.administrator:
+            return await interaction.response.send_message(
+                "You need Administrator permissions to use this command.",
+                ephemeral=True
+            )
+        
+        try:
+            since_timestamp = self._parse_date(since) if since else None
+            until_timestamp = self._parse_date(until, end_of_day=True) if until else None
+        except ValueError:
+            return await interaction.response.send_message(
+                "Dates must be in the format YYYY-MM-DD, e.g. 2024-01-31.",
+                ephemeral=True
+            )
+        
+        await interaction.response.defer(ephemeral=True)
+        
+        # Active loans can also be partially repaid
+        statuses = None
+        if status:
+            statuses = {"active", "active_partial"} if status == "active" else {status}
+        
+        records = iter_records(self.bot.loan_database, interaction.guild_id, statuses, since_timestamp, until_timestamp)
+        
+        # Write to a temporary file so the export never has to fit in memory
+        handle, path = tempfile.mkstemp(suffix=f".{format}.gz")
+        os.close(handle)
+        
+        try:
+            count = await write_export(path, records, format)
+            
+            if count == 0:
+                return await interaction.followup.send("No loan records match those filters.", ephemeral=True)
+            
+            size = os.path.getsize(path)
+            if size > interaction.guild.filesize_limit:
+                return await interaction.followup.send(
+                    f"The export is {size / 1024 / 1024:.1f} MB, more than this server's upload limit. "
+                    f"Try a shorter date range or a status filter.",
+                    ephemeral=True
+                )
+            
+            filename = f"loans-{interaction.guild_id}-{datetime.datetime.now().strftime('%Y%m%d')}.{format}.gz"
+            await interaction.followup.send(
+                f"Exported {count} loan records.",
+                file=discord.File(path, filename=filename),
+                ephemeral=True
+            )
+        except Exception as e:
+            logger.error(f"Error exporting loans for guild {interaction.guild_id}: {e}")
+            await interaction.followup.send("Sorry, the export failed. Please try again later.", ephemeral=True)
+        finally:
+            os.remove(path)
+
+
+async def setup(bot):
+    await bot.add_cog(ExportLoansCommand(bot))
@@ -62,7 +62,11 @@ class HelpCommand(commands.Cog):
                     ("/setup_loans <channel>", "Configure loan request settings"),
                     ("/allloans", "View all active loans"),
                     ("/view_settings", "View server settings"),
-                    ("/loanstats", "View statistics on loans")
+                    ("/loanstats", "View statistics on loans"),
+                    ("/loanchart", "Chart outstanding debt and repayments"),
+                    ("/exportloans", "Export loans, history and requests as a compressed file"),
+                    ("/botstats", "View per-shard latency and command throughput"),
+                    ("/looplag", "View event loop lag and slow callbacks")
                 ]
                 
                 admin_text = "\n".join([f"**{cmd}** - {desc}" for cmd, desc in admin_commands])
@@ -10,6 +10,8 @@ import logging
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from metrics import track_buttons
+
 # Initialize logger
 logger = logging.getLogger("installment")
 
@@ -40,6 +42,12 @@ else:
 # Always import manual integration as fallback
 import manual_unbelievaboat as manual_integration
 
+from command_queue import defer_and_enqueue
+from loan_index import get_loan_index, build_choices
+from shared_store import abort_loan_transaction, run_in_loan_transaction
+from unit_of_work import UnitOfWork
+from overdue_scheduler import repayment_credit_change
+
 
 class InstallmentCommand(commands.Cog):
     def __init__(self, bot):
@@ -75,16 +83,63 @@ class InstallmentCommand(commands.Cog):
     )
     async def pay_installment(self, interaction: discord.Interaction, loan_id: str, amount: int):
         """Command to make an installment payment toward a loan"""
+        await self._queue_installment(interaction, loan_id, amount)
+        
+    @pay_installment.autocomplete("loan_id")
+    async def pay_installment_loan_id_autocomplete(self, interaction: discord.Interaction, current: str):
+        """Suggest the user's active loans in this server"""
+        if not interaction.guild:
+            return []
+        
+        loans = get_loan_index(self.bot).get_user_loans(interaction.guild.id, interaction.user.id, current.strip().lstrip("#"))
+        return build_choices(loans, config.UNBELIEVABOAT["CURRENCY_NAME"])
+        
+    async def _queue_installment(self, interaction, loan_id, amount):
+        """Acknowledge the interaction and queue the installment payment on the worker pool"""
+        await defer_and_enqueue(
+            self.bot, interaction, "pay_installment",
+            run_in_loan_transaction, self.bot, interaction, str(interaction.guild_id), loan_id,
+            self._process_installment, interaction, loan_id, amount
+        )
+        
+    def _stage_payment(self, uow, loan, payment_amount, full_repayment, on_time):
+        """
+        Stage the loan and credit score changes of an installment payment
+        :return: The credit score change
+        """
+        now = datetime.datetime.now().isoformat()
+        
+        # Track repayment in the loan, and log the payment for the daily statistics
+        fields = {
+            "amount_repaid": loan.get("amount_repaid", 0) + payment_amount,
+            "payments": loan.get("payments", []) + [{"date": now, "amount": payment_amount}]
+        }
+        
+        # Check if the loan is now fully repaid
+        if full_repayment:
+            fields["status"] = "repaid"
+            fields["repayment_date"] = now
+        else:
+            # Update status to show partial payment
+            fields["status"] = "active_partial"
+            fields["last_payment_date"] = now
+        
+        uow.update("loans", loan, fields)
+        
+        # Move to history if fully repaid
+        if full_repayment:
+            uow.append("history", uow.staged(loan))
+            uow.remove("loans", loan)
+        
+        # Update credit score
+        credit_change = repayment_credit_change(loan, on_time)
+        uow.adjust_credit(loan["user_id"], credit_change)
+        return credit_change
+        
+    async def _process_installment(self, interaction, loan_id, amount):
+        """Process an installment payment (runs on the command queue, replies via followup)"""
+        send_message = interaction.followup.send
         try:
-            # Check if interaction is already responded to
-            if interaction.response.is_done():
-                logger.warning("Interaction already acknowledged, using followup instead")
-                send_message = interaction.followup.send
-            else:
-                # Defer the reply first to prevent interaction timeout
-                await interaction.response.defer()
-                send_message = interaction.followup.send
-            
             if not loan_id:
                 return await send_message(
                     "Please provide a valid loan ID."
@@ -104,25 +159,21 @@ class InstallmentCommand(commands.Cog):
                 loan_database["loans"] = []
                 logger.warning(f"Loans array did not exist in database, initialized empty array")
             
-            # Find loan index
-            loan_index = -1
-            for i, loan in enumerate(loan_database["loans"]):
-                if loan and loan.get("id") == loan_id:
-                    # First check if this user is the borrower
-                    if loan.get("user_id") == user_id:
-                        loan_index = i
-                        logger.info(f"Loan found: ID={loan_id}, Index={i}, Status={loan.get('status')}")
-                        break
-                    else:
-                        logger.warning(f"User {user_id} attempted to pay installment for loan {loan_id} belonging to user {loan.get('user_id')}")
+            # Look up the loan in the index
+            loan_index = get_loan_index(self.bot)
+            loan = loan_index.get_loan(loan_id)
+            
+            if loan is not None and loan.get("user_id") != user_id:
+                logger.warning(f"User {user_id} attempted to pay installment for loan {loan_id} belonging to user {loan.get('user_id')}")
+                loan = None
             
-            if loan_index == -1:
+            if loan is None:
                 logger.warning(f"Loan not found. ID: {loan_id}, User ID: {user_id}")
                 return await send_message(
                     f"Loan #{loan_id} not found or you are not the borrower of this loan. Please check the loan ID and try again."
                 )
             
-            loan = loan_database["loans"][loan_index]
+            logger.info(f"Loan found: ID={loan_id}, Status={loan.get('status')}")
             
             # Check if loan is already repaid
             if loan.get("status") not in ["active", "active_partial"]:
@@ -146,20 +197,23 @@ class InstallmentCommand(commands.Cog):
             on_time = current_date <= due_date
             late_fee = 0
             
+            # Changes are staged and only committed once the payment went through
+            uow = UnitOfWork(self.bot)
+            
             if not on_time and not loan.get("late_fee_applied", False):
                 # Apply 5% late fee
                 late_fee = round(loan["amount"] * 0.05)
-                loan["late_fee"] = late_fee
-                loan["total_repayment"] += late_fee
-                loan["late_fee_applied"] = True
-                logger.info(f"Late fee applied: {late_fee}, new total: {loan['total_repayment']}")
-            
-            # Initialize amount_repaid if not present
-            if "amount_repaid" not in loan:
-                loan["amount_repaid"] = 0
+                uow.update("loans", loan, {
+                    "late_fee": late_fee,
+                    "total_repayment": loan["total_repayment"] + late_fee,
+                    "late_fee_applied": True,
+                    "late_fee_date": current_date.isoformat()
+                })
+                logger.info(f"Late fee staged: {late_fee}, new total: {loan['total_repayment'] + late_fee}")
             
             # Calculate remaining balance
-            remaining_balance = loan["total_repayment"] - loan["amount_repaid"]
+            staged_loan = uow.staged(loan)
+            remaining_balance = staged_loan["total_repayment"] - staged_loan.get("amount_repaid", 0)
             
             # Check if amount is too small (minimum installment)
             min_installment = loan.get("min_installment_amount", 1000)
@@ -226,12 +280,6 @@ class InstallmentCommand(commands.Cog):
                             "There was an error processing your payment with UnbelievaBoat. Please try again or contact an admin."
                         )
                     
-                    # Add UnbelievaBoat transaction info to the loan
-                    loan["unbelievaboat"] = loan.get("unbelievaboat", {})
-                    
-                    if "transactions" not in loan["unbelievaboat"]:
-                        loan["unbelievaboat"]["transactions"] = []
-                        
                     # Record this transaction
                     transaction = {
                         "type": "installment" if not full_repayment else "final_installment",
@@ -240,38 +288,35 @@ class InstallmentCommand(commands.Cog):
                         "remaining_balance": user_balance.get("cash", 0)
                     }
                     
-                    loan["unbelievaboat"]["transactions"].append(transaction)
+                    # Add UnbelievaBoat transaction info to the loan
+                    unbelievaboat_info = dict(loan.get("unbelievaboat", {}))
+                    unbelievaboat_info["transactions"] = unbelievaboat_info.get("transactions", []) + [transaction]
+                    uow.update("loans", loan, {"unbelievaboat": unbelievaboat_info})
                     
-                    # Track repayment in the loan
-                    loan["amount_repaid"] = loan.get("amount_repaid", 0) + payment_amount
+                    credit_change = self._stage_payment(uow, loan, payment_amount, full_repayment, on_time)
                     
-                    # Check if the loan is now fully repaid
-                    if full_repayment:
-                        loan["status"] = "repaid"
-                        loan["repayment_date"] = datetime.datetime.now().isoformat()
-                        
-                        # Move to history if fully repaid
-                        if "history" not in loan_database:
-                            loan_database["history"] = []
+                    try:
+                        await uow.commit()
+                    except Exception as e:
+                        logger.error(f"Payment for loan #{loan_id} was taken but could not be recorded: {e}")
                         
-                        # Add to history but keep it in loans array for now
-                        # The repay.py command will clean it up if needed
-                        loan_database["history"].append(loan.copy())
-                    else:
-                        # Update status to show partial payment
-                        loan["status"] = "active_partial"
-                        loan["last_payment_date"] = datetime.datetime.now().isoformat()
+                        # Give the money back, so the user is not charged for a loan that stays unpaid
+                        refund = await unbelievaboat.add_currency(
+                            guild_id,
+                            user_id,
+                            payment_amount,
+                            f"Refund for loan #{loan_id}: payment could not be recorded"
+                        )
+                        if not refund:
+                            logger.error(f"Refund of {payment_amount} to user {user_id} for loan #{loan_id} failed")
+                            return await send_message(
+                                f"Your payment for loan #{loan_id} was taken but could not be recorded, and the refund failed. "
+                                f"Please contact an admin with this loan ID."
+                            )
                         
-                    # Update credit score
-                    credit_change = 10 if on_time else -5
-                    
-                    if "credit_scores" not in loan_database:
-                        loan_database["credit_scores"] = {}
-                    
-                    if user_id not in loan_database["credit_scores"]:
-                        loan_database["credit_scores"][user_id] = 100  # Default score
-                    
-                    loan_database["credit_scores"][user_id] += credit_change
+                        return await send_message(
+                            f"Your payment for loan #{loan_id} could not be recorded, so it was refunded. Please try again."
+                        )
                     logger.info(f"Updated credit score for user {user_id}: {loan_database['credit_scores'][user_id]} (change: {credit_change})")
                     
                     # Create embed for payment details
@@ -317,6 +362,7 @@ class InstallmentCommand(commands.Cog):
                     logger.error(f"Error in installment payment: {str(error)}")
                     import traceback
                     logger.error(traceback.format_exc())
+                    abort_loan_transaction()
                     
                     try:
                         await send_message(
@@ -327,35 +373,8 @@ class InstallmentCommand(commands.Cog):
             else:
                 # Manual mode without UnbelievaBoat API
                 # Just update the loan status
-                # Track repayment in the loan
-                loan["amount_repaid"] = loan.get("amount_repaid", 0) + payment_amount
-                
-                # Check if the loan is now fully repaid
-                if full_repayment:
-                    loan["status"] = "repaid"
-                    loan["repayment_date"] = datetime.datetime.now().isoformat()
-                    
-                    # Move to history if fully repaid
-                    if "history" not in loan_database:
-                        loan_database["history"] = []
-                    
-                    # Add to history but keep it in loans array for now
-                    loan_database["history"].append(loan.copy())
-                else:
-                    # Update status to show partial payment
-                    loan["status"] = "active_partial"
-                    loan["last_payment_date"] = datetime.datetime.now().isoformat()
-                
-                # Update credit score
-                credit_change = 10 if on_time else -5
-                
-                if "credit_scores" not in loan_database:
-                    loan_database["credit_scores"] = {}
-                
-                if user_id not in loan_database["credit_scores"]:
-                    loan_database["credit_scores"][user_id] = 100  # Default score
-                
-                loan_database["credit_scores"][user_id] += credit_change
+                credit_change = self._stage_payment(uow, loan, payment_amount, full_repayment, on_time)
+                await uow.commit()
                 
                 # Create embed for manual payment details
                 embed = discord.Embed(
@@ -410,6 +429,7 @@ class InstallmentCommand(commands.Cog):
             logger.error(f"Error in pay_installment command: {e}")
             import traceback
             logger.error(traceback.format_exc())
+            abort_loan_transaction()
             await send_message(
                 "There was an error processing your installment payment. Please try again or contact an admin."
             )
@@ -532,6 +552,7 @@ class InstallmentCommand(commands.Cog):
             
     # Button handler for installment payments
     @commands.Cog.listener()
+    @track_buttons("installment_")
     async def on_interaction(self, interaction: discord.Interaction):
         """Handle button interactions for installment payments"""
         try:
@@ -556,15 +577,10 @@ class InstallmentCommand(commands.Cog):
                         ephemeral=True
                     )
                 
-                # Get the loan details
-                loan_database = self.bot.loan_database
-                
                 # Find the loan
-                loan = None
-                for l in loan_database.get("loans", []):
-                    if l and l.get("id") == loan_id and l.get("user_id") == intended_user_id:
-                        loan = l
-                        break
+                loan = get_loan_index(self.bot).get_loan(loan_id)
+                if loan and loan.get("user_id") != intended_user_id:
+                    loan = None
                 
                 if not loan:
                     return await interaction.response.send_message(
@@ -595,8 +611,8 @@ class InstallmentCommand(commands.Cog):
                             amount_value = amount_input.value.strip()
                             amount = int(amount_value)
                             
-                            # Execute the pay_installment command
-                            await self.pay_installment(modal_interaction, loan_id, amount)
+                            # Queue the installment payment
+                            await self._queue_installment(modal_interaction, loan_id, amount)
                         except ValueError:
                             if modal_interaction.response.is_done():
                                 await modal_interaction.followup.send(
@@ -1,6 +1,7 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
+import asyncio
 import datetime
 import random
 import config
@@ -13,6 +14,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Import server settings for captain role check
 import server_settings
+from permissions import permission_service
+from metrics import track_buttons
 
 # Initialize UnbelievaBoat integration
 unbelievaboat = None
@@ -69,6 +72,12 @@ except ImportError as e:
     logger.error(f"Failed to import manual integration module: {e}")
     manual_integration = None
 
+from command_queue import defer_and_enqueue
+from loan_index import get_loan_index, build_choices, MAX_CHOICES
+from shared_store import abort_loan_transaction, get_shared_store, run_in_loan_transaction
+from scheduling import schedule_loan
+from unit_of_work import UnitOfWork
+
 
 def generate_loan_id(existing_loans):
     """
@@ -100,29 +109,12 @@ class LoanCommand(commands.Cog):
         
     async def _check_can_request_loan(self, interaction):
         """Check if a user can request a loan"""
-        guild_id = str(interaction.guild.id)
-        user_id = str(interaction.user.id)
-        
-        # Get captain role ID
-        captain_role_id = server_settings.get_captain_role(guild_id)
-        
-        # If no captain role is set, anyone can request loans
-        if not captain_role_id:
-            return True
-            
-        # Check if user has admin permissions (can always request)
-        if interaction.user.guild_permissions.administrator:
-            return True
-            
-        # Check if user has the captain role
-        has_role = False
-        for role in interaction.user.roles:
-            if str(role.id) == captain_role_id:
-                has_role = True
-                break
+        # Admins and captains can request loans (anyone if no captain role is set)
+        has_role = permission_service.can_request_loan(interaction.guild.id, interaction.user)
                 
         if not has_role:
             # Get the role object
+            captain_role_id = server_settings.get_captain_role(interaction.guild.id)
             captain_role = interaction.guild.get_role(int(captain_role_id))
             role_name = captain_role.name if captain_role else "Captain role"
             
@@ -145,29 +137,95 @@ class LoanCommand(commands.Cog):
             
         return True
         
+    def _can_review_requests(self, interaction):
+        """Check if a user is an admin or has an approval role (no messages sent)"""
+        if not interaction.guild or not isinstance(interaction.user, discord.Member):
+            return False
+            
+        return permission_service.can_review_requests(interaction.guild.id, interaction.user)
+        
+    async def _pending_request_choices(self, interaction, current):
+        """Autocomplete choices for the guild's pending loan requests (reviewers only)"""
+        if not self._can_review_requests(interaction):
+            return []
+            
+        requests = get_loan_index(self.bot).get_guild_requests(
+            interaction.guild.id,
+            prefix=current.strip().lstrip("#"),
+            limit=MAX_CHOICES
+        )
+        return build_choices(requests, config.UNBELIEVABOAT["CURRENCY_NAME"])
+        
     def _has_outstanding_loan(self, user_id, guild_id):
         """Check if a user has any outstanding loans"""
-        loan_database = self.bot.loan_database
+        # Active loans and pending requests are both looked up in the loan index
+        return get_loan_index(self.bot).get_outstanding(guild_id, user_id)
         
-        # Check both active loans and pending requests
-        if "loans" in loan_database and loan_database["loans"]:
-            for loan in loan_database["loans"]:
-                if (loan and loan.get("user_id") == user_id and 
-                    loan.get("guild_id") == guild_id and
-                    loan.get("status") == "active"):
-                    return loan
-                    
-        if "loan_requests" in loan_database and loan_database["loan_requests"]:
-            for request in loan_database["loan_requests"]:
-                if (request and request.get("user_id") == user_id and 
-                    request.get("guild_id") == guild_id and
-                    request.get("status") == "pending"):
-                    return request
-                    
-        return None
+    async def _send_outstanding_loan(self, send_message, outstanding_loan):
+        """Tell a user they must repay their outstanding loan first"""
+        loan_id = outstanding_loan.get("id", "unknown")
+        loan_amount = outstanding_loan.get("amount", 0)
+        
+        # Create embed for outstanding loan error
+        embed = discord.Embed(
+            title="❌ Outstanding Loan",
+            description="You already have an outstanding loan that needs to be repaid first.",
+            color=0xFF0000
+        )
+        
+        embed.add_field(
+            name="Loan ID",
+            value=loan_id,
+            inline=True
+        )
+        
+        embed.add_field(
+            name="Amount",
+            value=f"{loan_amount:,} {config.UNBELIEVABOAT['CURRENCY_NAME']}",
+            inline=True
+        )
+        
+        embed.add_field(
+            name="How to repay",
+            value=f"Use `/repay {loan_id}` to repay your existing loan first.",
+            inline=False
+        )
+        
+        return await send_message(
+            embed=embed,
+            ephemeral=True
+        )
+        
+    async def _submit_request(self, loan_request):
+        """
+        Add a loan request unless the user already has an outstanding loan or request
+        :return: Tuple of (inserted, existing loan/request or None)
+        """
+        loan_index = get_loan_index(self.bot)
+        
+        # Concurrent /loan calls from the same user can all pass the early check,
+        # so the check is repeated atomically with the insert
+        inserted, existing = loan_index.try_add_request(self.bot.loan_database, loan_request)
+        if not inserted:
+            return False, existing
+        
+        # Other worker processes may have a request for this user in the shared store
+        store = get_shared_store()
+        if store is not None:
+            existing = await asyncio.to_thread(store.try_insert_request, loan_request)
+            if existing is not None:
+                loan_index.discard_request(self.bot.loan_database, loan_request)
+                return False, existing
+        
+        return True, None
         
     async def _generate_loan_id(self):
         """Generate a unique 4-digit loan ID"""
+        # Worker processes reserve IDs in the shared store so they never collide
+        store = get_shared_store()
+        if store is not None:
+            return await asyncio.to_thread(store.reserve_loan_id)
+        
         loan_database = self.bot.loan_database
         existing_loans = []
         
@@ -291,38 +349,7 @@ class LoanCommand(commands.Cog):
             outstanding_loan = self._has_outstanding_loan(user_id, guild_id)
             
             if outstanding_loan:
-                loan_id = outstanding_loan.get("id", "unknown")
-                loan_amount = outstanding_loan.get("amount", 0)
-                
-                # Create embed for outstanding loan error
-                embed = discord.Embed(
-                    title="❌ Outstanding Loan",
-                    description="You already have an outstanding loan that needs to be repaid first.",
-                    color=0xFF0000
-                )
-                
-                embed.add_field(
-                    name="Loan ID",
-                    value=loan_id,
-                    inline=True
-                )
-                
-                embed.add_field(
-                    name="Amount",
-                    value=f"{loan_amount:,} {config.UNBELIEVABOAT['CURRENCY_NAME']}",
-                    inline=True
-                )
-                
-                embed.add_field(
-                    name="How to repay",
-                    value=f"Use `/repay {loan_id}` to repay your existing loan first.",
-                    inline=False
-                )
-                
-                return await send_message(
-                    embed=embed,
-                    ephemeral=True
-                )
+                return await self._send_outstanding_loan(send_message, outstanding_loan)
             
             # Generate a unique loan ID (4-digit number)
             loan_id = await self._generate_loan_id()
@@ -351,7 +378,15 @@ class LoanCommand(commands.Cog):
                 "due_date": due_date
             }
             
-            self.bot.loan_database.setdefault("loan_requests", []).append(loan_request)
+            inserted, existing = await self._submit_request(loan_request)
+            
+            if not inserted:
+                if existing:
+                    return await self._send_outstanding_loan(send_message, existing)
+                return await send_message(
+                    "You just submitted a loan request. Please wait a few seconds before trying again.",
+                    ephemeral=True
+                )
             
             # Get admin channel where to send the loan request
             admin_channel_id = server_settings.get_admin_channel(guild_id)
@@ -540,18 +575,8 @@ class LoanCommand(commands.Cog):
         
         await interaction.response.defer()
         
-        # Get loan database
-        loan_database = self.bot.loan_database
-        
-        # Get pending requests
-        pending_requests = []
-        if "loan_requests" in loan_database and loan_database["loan_requests"]:
-            # Only include requests for the current guild
-            guild_id = str(interaction.guild.id)
-            pending_requests = [
-                loan for loan in loan_database["loan_requests"] 
-                if loan.get("status") == "pending" and loan.get("guild_id") == guild_id
-            ]
+        # Get pending requests for the current guild
+        pending_requests = get_loan_index(self.bot).get_guild_requests(interaction.guild.id)
         
         if not pending_requests:
             return await interaction.followup.send(
@@ -649,16 +674,7 @@ class LoanCommand(commands.Cog):
         try:
             # Check if the user has admin permissions or the approval role
             guild_id = str(interaction.guild.id)
-            approval_roles = server_settings.get_approval_roles(guild_id)
-            
-            # Check if user has admin permissions or is in approval roles
-            has_permission = interaction.user.guild_permissions.administrator
-            
-            if not has_permission and approval_roles:
-                for role in interaction.user.roles:
-                    if str(role.id) in approval_roles:
-                        has_permission = True
-                        break
+            has_permission = permission_service.can_review_requests(interaction.guild.id, interaction.user)
             
             if not has_permission:
                 # Check if we can respond to the interaction
@@ -677,59 +693,70 @@ class LoanCommand(commands.Cog):
                     logger.error(f"Error sending permission message: {e}")
                 return
                 
-            # Check if interaction is already acknowledged
+            # Acknowledge immediately and queue the approval work
+            await defer_and_enqueue(
+                self.bot, interaction, "approveloan",
+                run_in_loan_transaction, self.bot, interaction, guild_id, loan_id,
+                self._process_approval, interaction, loan_id, guild_id
+            )
+        except Exception as e:
+            logger.error(f"Error in approveloan command: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
             try:
-                if not interaction.response.is_done():
-                    await interaction.response.defer(ephemeral=False)
-            except discord.errors.HTTPException as e:
-                if e.code != 40060:  # Not "interaction already acknowledged"
-                    logger.error(f"Error deferring response: {e}")
-                    return
-            
+                if interaction.response.is_done():
+                    await interaction.followup.send(
+                        f"There was an error processing the loan approval: {str(e)}",
+                        ephemeral=True
+                    )
+                else:
+                    await interaction.response.send_message(
+                        f"There was an error processing the loan approval: {str(e)}",
+                        ephemeral=True
+                    )
+            except Exception as e2:
+                logger.error(f"Error sending error message: {e2}")
+
+    @approveloan.autocomplete("loan_id")
+    async def approveloan_loan_id_autocomplete(self, interaction: discord.Interaction, current: str):
+        """Suggest the server's pending loan requests"""
+        return await self._pending_request_choices(interaction, current)
+
+    async def _process_approval(self, interaction, loan_id, guild_id):
+        """Approve a loan request (runs on the command queue, replies via followup)"""
+        try:
             # Initialize manual_needed variable
             manual_needed = False
             
             # Get loan database
             loan_database = self.bot.loan_database
             
-            # Find the loan request
-            if "loan_requests" not in loan_database or not loan_database["loan_requests"]:
-                return await interaction.followup.send(
-                    f"Loan request #{loan_id} not found.",
-                    ephemeral=True
-                )
-            
-            # Find loan request index
-            request_index = -1
+            # Find the pending loan request
+            loan_index = get_loan_index(self.bot)
+            loan_request = loan_index.get_request(guild_id, loan_id)
             
-            for i, request in enumerate(loan_database["loan_requests"]):
-                if (request and request.get("id") == loan_id and 
-                    request.get("status") == "pending" and
-                    request.get("guild_id") == guild_id):
-                    request_index = i
-                    break
-            
-            if request_index == -1:
+            if loan_request is None:
                 return await interaction.followup.send(
                     f"Loan request #{loan_id} not found or already processed.",
                     ephemeral=True
                 )
             
-            # Get the request and update status
-            loan_request = loan_database["loan_requests"][request_index]
-            loan_request["status"] = "approved"
-            loan_request["approved_by"] = str(interaction.user.id)
-            loan_request["approved_date"] = datetime.datetime.now()
+            # Update the request status
+            uow = UnitOfWork(self.bot)
+            uow.update("loan_requests", loan_request, {
+                "status": "approved",
+                "approved_by": str(interaction.user.id),
+                "approved_date": datetime.datetime.now()
+            })
             
             # Create a loan based on the request
-            loan = loan_request.copy()
+            loan = uow.staged(loan_request)
             loan["status"] = "active"
             
             # Save the loan
-            if "loans" not in loan_database:
-                loan_database["loans"] = []
-                
-            loan_database["loans"].append(loan)
+            uow.append("loans", loan)
+            await uow.commit()
+            schedule_loan(self.bot, loan)
             
             # Log successful loan creation
             logger.info(f"Created active loan #{loan_id} for user {loan_request['user_id']} with amount {loan_request['amount']}")
@@ -887,10 +914,12 @@ class LoanCommand(commands.Cog):
                 # If manual mode is needed, provide instructions
                 if manual_needed and manual_integration and user_notified:
                     try:
+                        admin_id = await manual_integration.find_server_admin_id(interaction.guild)
                         instructions_embed = manual_integration.format_receive_loan_instructions(
                             loan,
                             user_obj if 'user_obj' in locals() else None,
-                            interaction.guild
+                            interaction.guild,
+                            admin_id=admin_id
                         )
                         
                         try:
@@ -924,6 +953,7 @@ class LoanCommand(commands.Cog):
             logger.error(f"Error in approveloan command: {e}")
             import traceback
             logger.error(traceback.format_exc())
+            abort_loan_transaction()
             try:
                 if interaction.response.is_done():
                     await interaction.followup.send(
@@ -946,16 +976,7 @@ class LoanCommand(commands.Cog):
     async def denyloan(self, interaction: discord.Interaction, loan_id: str, reason: str = None):
         # Check if the user has admin permissions or the approval role
         guild_id = str(interaction.guild.id)
-        approval_roles = server_settings.get_approval_roles(guild_id)
-        
-        # Check if user has admin permissions or is in approval roles
-        has_permission = interaction.user.guild_permissions.administrator
-        
-        if not has_permission and approval_roles:
-            for role in interaction.user.roles:
-                if str(role.id) in approval_roles:
-                    has_permission = True
-                    break
+        has_permission = permission_service.can_review_requests(interaction.guild.id, interaction.user)
         
         if not has_permission:
             return await interaction.response.send_message(
@@ -965,35 +986,22 @@ class LoanCommand(commands.Cog):
             
         await interaction.response.defer()
         
-        # Get loan database
-        loan_database = self.bot.loan_database
+        await run_in_loan_transaction(self.bot, interaction, guild_id, loan_id, self._deny_request, interaction, loan_id, guild_id, reason)
         
-        # Find the loan request
-        if "loan_requests" not in loan_database or not loan_database["loan_requests"]:
-            return await interaction.followup.send(
-                f"Loan request #{loan_id} not found.",
-                ephemeral=True
-            )
+    async def _deny_request(self, interaction, loan_id, guild_id, reason=None):
+        """Deny a pending loan request (replies via followup)"""
+        # Find the pending loan request
+        loan_index = get_loan_index(self.bot)
+        loan_request = loan_index.get_request(guild_id, loan_id)
         
-        # Find loan request index
-        request_index = -1
-        guild_id = str(interaction.guild.id)
-        
-        for i, request in enumerate(loan_database["loan_requests"]):
-            if (request and request.get("id") == loan_id and 
-                request.get("status") == "pending" and
-                request.get("guild_id") == guild_id):
-                request_index = i
-                break
-        
-        if request_index == -1:
+        if loan_request is None:
             return await interaction.followup.send(
                 f"Loan request #{loan_id} not found or already processed.",
                 ephemeral=True
             )
         
-        # Get the request and update status
-        loan_request = loan_database["loan_requests"][request_index]
+        # Update the request status
+        loan_index.remove_request(loan_request)
         loan_request["status"] = "denied"
         loan_request["denied_by"] = str(interaction.user.id)
         loan_request["denied_date"] = datetime.datetime.now()
@@ -1057,8 +1065,174 @@ class LoanCommand(commands.Cog):
                 ephemeral=True
             )
             
+    @denyloan.autocomplete("loan_id")
+    async def denyloan_loan_id_autocomplete(self, interaction: discord.Interaction, current: str):
+        """Suggest the server's pending loan requests"""
+        return await self._pending_request_choices(interaction, current)
+
+    async def _process_button_approval(self, interaction, loan_id):
+        """Approve a loan request from the approve button (runs on the command queue, replies via followup)"""
+        try:
+            # Process the loan approval
+            logger.info(f"Processing loan approval for loan_id: {loan_id}")
+            
+            # Get loan database
+            loan_database = self.bot.loan_database
+            
+            # Find the pending loan request
+            guild_id = str(interaction.guild.id)
+            loan_index = get_loan_index(self.bot)
+            loan_request = loan_index.get_request(guild_id, loan_id)
+            
+            if loan_request is None:
+                await interaction.followup.send(
+                    f"Loan request #{loan_id} not found or already processed.",
+                    ephemeral=True
+                )
+                return
+            
+            # Update the request status
+            uow = UnitOfWork(self.bot)
+            uow.update("loan_requests", loan_request, {
+                "status": "approved",
+                "approved_by": str(interaction.user.id),
+                "approved_date": datetime.datetime.now()
+            })
+            
+            # Create a loan based on the request
+            loan = uow.staged(loan_request)
+            loan["status"] = "active"
+            
+            # Save the loan
+            uow.append("loans", loan)
+            await uow.commit()
+            schedule_loan(self.bot, loan)
+            
+            # Log successful loan creation
+            logger.info(f"Created active loan #{loan_id} for user {loan_request['user_id']} with amount {loan_request['amount']}")
+            
+            # Get user information
+            user_id = loan_request["user_id"]
+            try:
+                user = await self.bot.fetch_user(int(user_id))
+                user_name = user.name
+            except:
+                user_name = f"User {user_id}"
+            
+            # Create admin response embed
+            admin_embed = discord.Embed(
+                title="✅ Loan Request Approved",
+                description=f"You have approved the loan request #{loan_id} for {user_name}.",
+                color=0x00FF00
+            )
+            
+            admin_embed.add_field(name="Loan ID", value=loan_id, inline=True)
+            admin_embed.add_field(name="Amount", value=f"{loan_request['amount']} {config.UNBELIEVABOAT['CURRENCY_NAME']}", inline=True)
+            admin_embed.add_field(name="Duration", value=f"{loan_request['days']} days", inline=True)
+            
+            # Send admin confirmation
+            await interaction.followup.send(embed=admin_embed)
+            
+            # Try to notify the user
+            try:
+                # Create user notification embed
+                user_embed = self._create_loan_embed(
+                    interaction, 
+                    loan, 
+                    loan_id, 
+                    loan_request["amount"], 
+                    0.1,  # interest rate 
+                    loan_request["interest"], 
+                    loan_request["total_repayment"], 
+                    loan_request["due_date"],
+                    loan_database.get("credit_scores", {}).get(user_id, 100)
+                )
+                
+                # Create repayment button
+                view = self._create_repay_button_view(user_id, loan_id)
+                
+                # Try to DM the user
+                try:
+                    user_obj = await self.bot.fetch_user(int(user_id))
+                    await user_obj.send(
+                        content=f"Your loan request #{loan_id} has been approved by an administrator!",
+                        embed=user_embed,
+                        view=view
+                    )
+                except:
+                    # If DM fails, try to find a channel to send it in
+                    channel = interaction.channel
+                    await channel.send(
+                        content=f"<@{user_id}>, your loan request #{loan_id} has been approved!",
+                        embed=user_embed,
+                        view=view
+                    )
+                
+                # Process currency through UnbelievaBoat if enabled
+                if config.UNBELIEVABOAT["ENABLED"] and unbelievaboat:
+                    try:
+                        guild_id_str = str(guild_id)
+                        user_id_str = str(user_id)
+                        
+                        result = await unbelievaboat.add_currency(
+                            guild_id_str,
+                            user_id_str,
+                            loan_request["amount"],
+                            f"Loan #{loan_id} - {loan_request['amount']} {config.UNBELIEVABOAT['CURRENCY_NAME']}"
+                        )
+                        
+                        if result:
+                            # Update loan with transaction info
+                            loan["unbelievaboat"] = {
+                                "transaction_processed": True,
+                                "balance": result["cash"],
+                                "transaction_time": datetime.datetime.now().isoformat()
+                            }
+                            
+                            # Notify admin of success
+                            await interaction.followup.send(
+                                f"✅ API Success: Added {loan_request['amount']} {config.UNBELIEVABOAT['CURRENCY_NAME']} to {user_name}'s account.",
+                                ephemeral=True
+                            )
+                        else:
+                            # Fall back to manual mode with instructions
+                            await interaction.followup.send(
+                                f"⚠️ API Error: Failed to add currency automatically. Please use manual command: `{config.UNBELIEVABOAT['COMMANDS']['PAY']} {user_id} {loan_request['amount']} Loan #{loan_id}`",
+                                ephemeral=True
+                            )
+                    except Exception as e:
+                        logger.error(f"UnbelievaBoat API error: {e}")
+                        
+                        # Provide manual instructions
+                        await interaction.followup.send(
+                            f"⚠️ API Error: {str(e)}. Please add currency manually using: `{config.UNBELIEVABOAT['COMMANDS']['PAY']} {user_id} {loan_request['amount']} Loan #{loan_id}`",
+                            ephemeral=True
+                        )
+                
+            except Exception as e:
+                logger.error(f"Error notifying user: {e}")
+                await interaction.followup.send(
+                    f"Loan approved, but there was an error notifying the user: {str(e)}",
+                    ephemeral=True
+                )
+                
+        except Exception as e:
+            logger.error(f"Error processing loan approval: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            abort_loan_transaction()
+            
+            try:
+                await interaction.followup.send(
+                    f"Error approving loan: {str(e)}",
+                    ephemeral=True
+                )
+            except Exception as e2:
+                logger.error(f"Failed to send error message: {e2}")
+
     # Handle loan approval/denial buttons
     @commands.Cog.listener()
+    @track_buttons("approve_loan_", "deny_loan_")
     async def on_interaction(self, interaction: discord.Interaction):
         try:
             # Skip if not a component interaction
@@ -1078,241 +1252,47 @@ class LoanCommand(commands.Cog):
             if custom_id.startswith("approve_loan_"):
                 loan_id = custom_id.replace("approve_loan_", "")
                 
-                # Check permissions
-                if not interaction.user.guild_permissions.administrator:
-                    # Check if user has an approval role
-                    guild_id = str(interaction.guild.id)
-                    approval_roles = server_settings.get_approval_roles(guild_id)
-                    
-                    has_approval_role = False
-                    for role in interaction.user.roles:
-                        if str(role.id) in approval_roles:
-                            has_approval_role = True
-                            break
-            
-                    if not has_approval_role:
-                        try:
-                            await interaction.response.send_message(
-                                "You don't have permission to approve loan requests. Only admins or users with an approval role can do this.",
-                                ephemeral=True
-                            )
-                        except Exception as e:
-                            logger.error(f"Error sending permission message: {e}")
-                            if hasattr(interaction, 'followup'):
-                                try:
-                                    await interaction.followup.send(
-                                        "You don't have permission to approve loan requests. Only admins or users with an approval role can do this.",
-                                        ephemeral=True
-                                    )
-                                except Exception as e2:
-                                    logger.error(f"Error sending followup message: {e2}")
-                        return
-                
-                # Try to handle with approveloan method
-                try:
-                    # Only try to acknowledge the interaction if it hasn't been done already
+                # Check permissions (admins or users with an approval role)
+                if not permission_service.can_review_requests(interaction.guild.id, interaction.user):
                     try:
-                        if not interaction.response.is_done():
-                            await interaction.response.defer(ephemeral=True)
-                            logger.info(f"Successfully deferred interaction for approve_loan_{loan_id}")
-                    except Exception as defer_error:
-                        logger.warning(f"Could not defer interaction: {defer_error}")
-                        # Continue processing anyway - it's probably already acknowledged
-                    
-                    # Process the loan approval
-                    logger.info(f"Processing loan approval for loan_id: {loan_id}")
-                    
-                    # Get loan database
-                    loan_database = self.bot.loan_database
-                    
-                    # Find the loan request
-                    if "loan_requests" not in loan_database or not loan_database["loan_requests"]:
-                        await interaction.followup.send(
-                            f"Loan request #{loan_id} not found.",
-                            ephemeral=True
-                        )
-                        return
-                    
-                    # Find loan request index
-                    request_index = -1
-                    guild_id = str(interaction.guild.id)
-                    
-                    for i, request in enumerate(loan_database["loan_requests"]):
-                        if (request and request.get("id") == loan_id and 
-                            request.get("status") == "pending" and
-                            request.get("guild_id") == guild_id):
-                            request_index = i
-                            break
-                    
-                    if request_index == -1:
-                        await interaction.followup.send(
-                            f"Loan request #{loan_id} not found or already processed.",
+                        await interaction.response.send_message(
+                            "You don't have permission to approve loan requests. Only admins or users with an approval role can do this.",
                             ephemeral=True
                         )
-                        return
-                    
-                    # Get the request and update status
-                    loan_request = loan_database["loan_requests"][request_index]
-                    loan_request["status"] = "approved"
-                    loan_request["approved_by"] = str(interaction.user.id)
-                    loan_request["approved_date"] = datetime.datetime.now()
-                    
-                    # Create a loan based on the request
-                    loan = loan_request.copy()
-                    loan["status"] = "active"
-                    
-                    # Save the loan
-                    if "loans" not in loan_database:
-                        loan_database["loans"] = []
-                        
-                    loan_database["loans"].append(loan)
-                    
-                    # Log successful loan creation
-                    logger.info(f"Created active loan #{loan_id} for user {loan_request['user_id']} with amount {loan_request['amount']}")
-                    
-                    # Get user information
-                    user_id = loan_request["user_id"]
-                    try:
-                        user = await self.bot.fetch_user(int(user_id))
-                        user_name = user.name
-                    except:
-                        user_name = f"User {user_id}"
-                    
-                    # Create admin response embed
-                    admin_embed = discord.Embed(
-                        title="✅ Loan Request Approved",
-                        description=f"You have approved the loan request #{loan_id} for {user_name}.",
-                        color=0x00FF00
-                    )
-                    
-                    admin_embed.add_field(name="Loan ID", value=loan_id, inline=True)
-                    admin_embed.add_field(name="Amount", value=f"{loan_request['amount']} {config.UNBELIEVABOAT['CURRENCY_NAME']}", inline=True)
-                    admin_embed.add_field(name="Duration", value=f"{loan_request['days']} days", inline=True)
-                    
-                    # Send admin confirmation
-                    await interaction.followup.send(embed=admin_embed)
-                    
-                    # Try to notify the user
-                    try:
-                        # Create user notification embed
-                        user_embed = self._create_loan_embed(
-                            interaction, 
-                            loan, 
-                            loan_id, 
-                            loan_request["amount"], 
-                            0.1,  # interest rate 
-                            loan_request["interest"], 
-                            loan_request["total_repayment"], 
-                            loan_request["due_date"],
-                            loan_database.get("credit_scores", {}).get(user_id, 100)
-                        )
-                        
-                        # Create repayment button
-                        view = self._create_repay_button_view(user_id, loan_id)
-                        
-                        # Try to DM the user
-                        try:
-                            user_obj = await self.bot.fetch_user(int(user_id))
-                            await user_obj.send(
-                                content=f"Your loan request #{loan_id} has been approved by an administrator!",
-                                embed=user_embed,
-                                view=view
-                            )
-                        except:
-                            # If DM fails, try to find a channel to send it in
-                            channel = interaction.channel
-                            await channel.send(
-                                content=f"<@{user_id}>, your loan request #{loan_id} has been approved!",
-                                embed=user_embed,
-                                view=view
-                            )
-                        
-                        # Process currency through UnbelievaBoat if enabled
-                        if config.UNBELIEVABOAT["ENABLED"] and unbelievaboat:
+                    except Exception as e:
+                        logger.error(f"Error sending permission message: {e}")
+                        if hasattr(interaction, 'followup'):
                             try:
-                                guild_id_str = str(guild_id)
-                                user_id_str = str(user_id)
-                                
-                                result = await unbelievaboat.add_currency(
-                                    guild_id_str,
-                                    user_id_str,
-                                    loan_request["amount"],
-                                    f"Loan #{loan_id} - {loan_request['amount']} {config.UNBELIEVABOAT['CURRENCY_NAME']}"
-                                )
-                                
-                                if result:
-                                    # Update loan with transaction info
-                                    loan["unbelievaboat"] = {
-                                        "transaction_processed": True,
-                                        "balance": result["cash"],
-                                        "transaction_time": datetime.datetime.now().isoformat()
-                                    }
-                                    
-                                    # Notify admin of success
-                                    await interaction.followup.send(
-                                        f"✅ API Success: Added {loan_request['amount']} {config.UNBELIEVABOAT['CURRENCY_NAME']} to {user_name}'s account.",
-                                        ephemeral=True
-                                    )
-                                else:
-                                    # Fall back to manual mode with instructions
-                                    await interaction.followup.send(
-                                        f"⚠️ API Error: Failed to add currency automatically. Please use manual command: `{config.UNBELIEVABOAT['COMMANDS']['PAY']} {user_id} {loan_request['amount']} Loan #{loan_id}`",
-                                        ephemeral=True
-                                    )
-                            except Exception as e:
-                                logger.error(f"UnbelievaBoat API error: {e}")
-                                
-                                # Provide manual instructions
                                 await interaction.followup.send(
-                                    f"⚠️ API Error: {str(e)}. Please add currency manually using: `{config.UNBELIEVABOAT['COMMANDS']['PAY']} {user_id} {loan_request['amount']} Loan #{loan_id}`",
+                                    "You don't have permission to approve loan requests. Only admins or users with an approval role can do this.",
                                     ephemeral=True
                                 )
-                        
-                    except Exception as e:
-                        logger.error(f"Error notifying user: {e}")
-                        await interaction.followup.send(
-                            f"Loan approved, but there was an error notifying the user: {str(e)}",
-                            ephemeral=True
-                        )
-                        
-                except Exception as e:
-                    logger.error(f"Error processing loan approval: {e}")
-                    import traceback
-                    logger.error(traceback.format_exc())
-                    
-                    try:
-                        await interaction.followup.send(
-                            f"Error approving loan: {str(e)}",
-                            ephemeral=True
-                        )
-                    except Exception as e2:
-                        logger.error(f"Failed to send error message: {e2}")
+                            except Exception as e2:
+                                logger.error(f"Error sending followup message: {e2}")
+                    return
+                
+                # Acknowledge immediately and queue the approval work
+                await defer_and_enqueue(
+                    self.bot, interaction, "approve_button",
+                    run_in_loan_transaction, self.bot, interaction, str(interaction.guild_id), loan_id,
+                    self._process_button_approval, interaction, loan_id,
+                    ephemeral=True
+                )
             
             # Handle loan denial button
             elif custom_id.startswith("deny_loan_"):
                 loan_id = custom_id.replace("deny_loan_", "")
                 
-                # Check permissions
-                if not interaction.user.guild_permissions.administrator:
-                    # Check if user has an approval role
-                    guild_id = str(interaction.guild.id)
-                    approval_roles = server_settings.get_approval_roles(guild_id)
-                    
-                    has_approval_role = False
-                    for role in interaction.user.roles:
-                        if str(role.id) in approval_roles:
-                            has_approval_role = True
-                            break
-            
-                    if not has_approval_role:
-                        try:
-                            await interaction.response.send_message(
-                                "You don't have permission to deny loan requests. Only admins or users with an approval role can do this.",
-                                ephemeral=True
-                            )
-                        except Exception as e:
-                            logger.error(f"Error sending permission message: {e}")
-                        return
+                # Check permissions (admins or users with an approval role)
+                if not permission_service.can_review_requests(interaction.guild.id, interaction.user):
+                    try:
+                        await interaction.response.send_message(
+                            "You don't have permission to deny loan requests. Only admins or users with an approval role can do this.",
+                            ephemeral=True
+                        )
+                    except Exception as e:
+                        logger.error(f"Error sending permission message: {e}")
+                    return
             
                 # Create a modal for denial reason
                 modal = discord.ui.Modal(title=f"Deny Loan #{loan_id}")
@@ -1331,7 +1311,14 @@ class LoanCommand(commands.Cog):
                 async def modal_callback(modal_interaction):
                     try:
                         reason = reason_input.value
-                        await self.denyloan(modal_interaction, loan_id, reason)
+                        guild_id = str(modal_interaction.guild_id)
+                        
+                        # Permissions were checked when the button was pressed
+                        await modal_interaction.response.defer()
+                        await run_in_loan_transaction(
+                            self.bot, modal_interaction, guild_id, loan_id,
+                            self._deny_request, modal_interaction, loan_id, guild_id, reason
+                        )
                     except Exception as e:
                         logger.error(f"Error in deny loan modal: {e}")
                         try:
@@ -0,0 +1,83 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+import io
+import logging
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loan_charts import ChartRenderer
+
+logger = logging.getLogger("discord")
+
+
+class LoanChartCommand(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        
+    def _get_renderer(self):
+        """Get the bot's chart renderer, creating it if the bot did not"""
+        renderer = getattr(self.bot, "chart_renderer", None)
+        if renderer is None:
+            renderer = ChartRenderer()
+            self.bot.chart_renderer = renderer
+        return renderer
+        
+    @app_commands.command(name="loanchart", description="Chart outstanding debt and repayments in the server (Admin only)")
+    @app_commands.describe(
+        period="How far back to chart (defaults to the last 30 days)"
+    )
+    @app_commands.choices(period=[
+        app_commands.Choice(name="Last 7 days", value="7d"),
+        app_commands.Choice(name="Last 30 days", value="30d"),
+        app_commands.Choice(name="Last 90 days", value="90d")
+    ])
+    async def loanchart(self, interaction: discord.Interaction, period: str = "30d"):
+        # Check if the user has admin permissions
+        if not interaction.user.guild_permissions.administrator:
+            return await interaction.response.send_message(
+                "You need Administrator permissions to use this command.",
+                ephemeral=True
+            )
+        
+        await interaction.response.defer()
+        
+        renderer = self._get_renderer()
+        
+        try:
+            png, cached = await renderer.get_chart(self.bot, interaction.guild_id, period)
+        except ImportError:
+            return await interaction.followup.send(
+                "Charts are not available: matplotlib is not installed on the bot's host.",
+                ephemeral=True
+            )
+        except Exception as e:
+            logger.error(f"Error rendering loan chart for guild {interaction.guild_id}: {e}")
+            return await interaction.followup.send(
+                "Sorry, the chart could not be drawn. Please try again later.",
+                ephemeral=True
+            )
+        
+        # Create embed with the chart attached
+        embed = discord.Embed(
+            title="📉 Server Loan Chart",
+            description="Outstanding debt at the end of each day, and the amount repaid each day",
+            color=0x00AAFF
+        )
+        embed.set_image(url="attachment://loanchart.png")
+        
+        chart_stats = renderer.get_stats()
+        if cached:
+            embed.set_footer(text=f"Cached chart | Cache hit rate {chart_stats['hit_rate'] * 100:.0f}%")
+        else:
+            embed.set_footer(text=f"Rendered in {chart_stats['last_render'] * 1000:.0f}ms | "
+                                  f"Cache hit rate {chart_stats['hit_rate'] * 100:.0f}%")
+        
+        await interaction.followup.send(embed=embed, file=discord.File(io.BytesIO(png), filename="loanchart.png"))
+
+
+async def setup(bot):
+    await bot.add_cog(LoanChartCommand(bot))
@@ -9,6 +9,8 @@ import os
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from loan_stats import get_loan_stats, PERIOD_DAYS
+
 
 class LoanStatsCommand(commands.Cog):
     def __init__(self, bot):
@@ -16,9 +18,15 @@ class LoanStatsCommand(commands.Cog):
         
     @app_commands.command(name="loanstats", description="View loan statistics for yourself or the server")
     @app_commands.describe(
-        user="The user to view stats for (leave empty for server stats)"
+        user="The user to view stats for (leave empty for server stats)",
+        period="Show server trends over a recent period instead of all-time totals"
     )
-    async def loanstats(self, interaction: discord.Interaction, user: discord.User = None):
+    @app_commands.choices(period=[
+        app_commands.Choice(name="Last 7 days", value="7d"),
+        app_commands.Choice(name="Last 30 days", value="30d"),
+        app_commands.Choice(name="Last 90 days", value="90d")
+    ])
+    async def loanstats(self, interaction: discord.Interaction, user: discord.User = None, period: str = None):
         await interaction.response.defer()
         
         # Get loan database from bot
@@ -35,6 +43,8 @@ class LoanStatsCommand(commands.Cog):
         # If a user is specified, show personal stats
         if user:
             await self._show_user_stats(interaction, user)
+        elif period:
+            await self._show_period_stats(interaction, period)
         else:
             await self._show_server_stats(interaction)
     
@@ -42,31 +52,12 @@ class LoanStatsCommand(commands.Cog):
         user_id = str(user.id)
         loan_database = self.bot.loan_database
         
-        # Get all loans for the user
-        active_loans = [loan for loan in loan_database["loans"] 
-                        if loan.get("user_id") == user_id and loan.get("status") == "active"]
-        
-        # Get loan history for the user
-        completed_loans = [loan for loan in loan_database["history"] 
-                           if loan.get("user_id") == user_id and loan.get("status") == "repaid"]
+        # Get the user's running loan statistics for this server
+        stats = get_loan_stats(self.bot).get_user(interaction.guild_id, user_id)
         
         # Get credit score
         credit_score = loan_database["credit_scores"].get(user_id, 100)  # Default score is 100
         
-        # Calculate statistics
-        total_borrowed = sum(loan["amount"] for loan in completed_loans + active_loans)
-        total_repaid = sum(loan["total_repayment"] for loan in completed_loans)
-        total_interest_paid = sum(loan.get("interest", 0) for loan in completed_loans)
-        total_late_fees = sum(loan.get("late_fee", 0) for loan in completed_loans)
-        current_debt = sum(loan["total_repayment"] for loan in active_loans)
-        
-        # Calculate on-time vs late payments
-        on_time_payments = sum(1 for loan in completed_loans 
-                              if loan.get("repaid_date") and loan.get("due_date") 
-                              and loan["repaid_date"] <= loan["due_date"])
-        
-        late_payments = len(completed_loans) - on_time_payments
-        
         # Create embed
         embed = discord.Embed(
             title=f"📊 Loan Statistics for {user.display_name}",
@@ -76,27 +67,27 @@ class LoanStatsCommand(commands.Cog):
         # Current loans
         embed.add_field(
             name="Current Loans",
-            value=f"Active Loans: {len(active_loans)}\nCurrent Debt: {current_debt} {config.UNBELIEVABOAT['CURRENCY_NAME']}",
+            value=f"Active Loans: {stats['active_loans']}\nCurrent Debt: {stats['current_debt']} {config.UNBELIEVABOAT['CURRENCY_NAME']}",
             inline=False
         )
         
         # Loan history
         embed.add_field(
             name="Loan History",
-            value=f"Total Loans Taken: {len(completed_loans) + len(active_loans)}\n"
-                  f"Loans Repaid: {len(completed_loans)}\n"
-                  f"Total Borrowed: {total_borrowed} {config.UNBELIEVABOAT['CURRENCY_NAME']}\n"
-                  f"Total Repaid: {total_repaid} {config.UNBELIEVABOAT['CURRENCY_NAME']}",
+            value=f"Total Loans Taken: {stats['loans_taken']}\n"
+                  f"Loans Repaid: {stats['loans_repaid']}\n"
+                  f"Total Borrowed: {stats['total_borrowed']} {config.UNBELIEVABOAT['CURRENCY_NAME']}\n"
+                  f"Total Repaid: {stats['total_repaid']} {config.UNBELIEVABOAT['CURRENCY_NAME']}",
             inline=False
         )
         
         # Payment history
         embed.add_field(
             name="Payment History",
-            value=f"On-time Payments: {on_time_payments}\n"
-                  f"Late Payments: {late_payments}\n"
-                  f"Interest Paid: {total_interest_paid} {config.UNBELIEVABOAT['CURRENCY_NAME']}\n"
-                  f"Late Fees Paid: {total_late_fees} {config.UNBELIEVABOAT['CURRENCY_NAME']}",
+            value=f"On-time Payments: {stats['on_time']}\n"
+                  f"Late Payments: {stats['late']}\n"
+                  f"Interest Paid: {stats['interest_paid']} {config.UNBELIEVABOAT['CURRENCY_NAME']}\n"
+                  f"Late Fees Paid: {stats['late_fees_paid']} {config.UNBELIEVABOAT['CURRENCY_NAME']}",
             inline=False
         )
         
@@ -122,34 +113,25 @@ class LoanStatsCommand(commands.Cog):
         await interaction.followup.send(embed=embed)
     
     async def _show_server_stats(self, interaction):
-        loan_database = self.bot.loan_database
-        
-        # Total loans data
-        active_loans = loan_database["loans"]
-        completed_loans = loan_database["history"]
+        # Get the server's running loan totals
+        totals = get_loan_stats(self.bot).get_guild(interaction.guild_id)
         
-        # Calculate stats
-        total_loans_ever = len(active_loans) + len(completed_loans)
-        total_active_loans = len(active_loans)
-        total_completed_loans = len(completed_loans)
+        total_loans_ever = totals["loans_taken"]
+        total_active_loans = totals["active_loans"]
+        total_completed_loans = totals["loans_repaid"]
         
-        total_borrowed_ever = sum(loan.get("amount", 0) for loan in active_loans + completed_loans)
-        total_active_debt = sum(loan.get("total_repayment", 0) for loan in active_loans)
-        total_repaid = sum(loan.get("total_repayment", 0) for loan in completed_loans)
+        total_borrowed_ever = totals["total_borrowed"]
+        total_active_debt = totals["current_debt"]
+        total_repaid = totals["total_repaid"]
         
-        total_interest_paid = sum(loan.get("interest", 0) for loan in completed_loans)
-        total_late_fees = sum(loan.get("late_fee", 0) for loan in completed_loans)
+        total_interest_paid = totals["interest_paid"]
+        total_late_fees = totals["late_fees_paid"]
         
-        # Get number of unique borrowers
-        unique_borrowers_active = len(set(loan.get("user_id") for loan in active_loans if loan.get("user_id")))
-        unique_borrowers_ever = len(set(loan.get("user_id") for loan in active_loans + completed_loans if loan.get("user_id")))
+        unique_borrowers_active = totals["active_borrowers"]
+        unique_borrowers_ever = totals["borrowers"]
         
-        # On-time vs late payments
-        on_time_payments = sum(1 for loan in completed_loans 
-                              if loan.get("repaid_date") and loan.get("due_date") 
-                              and loan["repaid_date"] <= loan["due_date"])
-        
-        late_payments = total_completed_loans - on_time_payments
+        on_time_payments = totals["on_time"]
+        late_payments = totals["late"]
         
         # Create embed
         embed = discord.Embed(
@@ -196,6 +178,60 @@ class LoanStatsCommand(commands.Cog):
         embed.set_footer(text=f"Stats as of {current_time}")
         
         await interaction.followup.send(embed=embed)
+    
+    async def _show_period_stats(self, interaction, period):
+        days = PERIOD_DAYS[period]
+        currency = config.UNBELIEVABOAT['CURRENCY_NAME']
+        
+        # Add up the server's daily buckets for the period
+        totals = get_loan_stats(self.bot).get_period(interaction.guild_id, days)
+        
+        loans_repaid = totals["loans_repaid"]
+        on_time_percentage = 0 if loans_repaid == 0 else (totals["on_time"] / loans_repaid) * 100
+        default_rate = 0 if totals["loans_due"] == 0 else (totals["defaulted"] / totals["loans_due"]) * 100
+        average_days = 0 if loans_repaid == 0 else totals["repay_seconds"] / loans_repaid / 86400
+        
+        # Create embed
+        embed = discord.Embed(
+            title=f"📈 Server Loan Trends - Last {days} Days",
+            description="Loans approved, due and repaid in this server over the period",
+            color=0x00AAFF
+        )
+        
+        # Loan volume
+        embed.add_field(
+            name="Loan Volume",
+            value=f"Loans Approved: {totals['loans_created']}\n"
+                  f"Amount Lent: {totals['amount_lent']} {currency}",
+            inline=False
+        )
+        
+        # Repayments
+        embed.add_field(
+            name="Repayments",
+            value=f"Loans Repaid: {loans_repaid}\n"
+                  f"Amount Repaid: {totals['amount_repaid']} {currency}\n"
+                  f"Interest Collected: {totals['interest_paid']} {currency}\n"
+                  f"Late Fees Collected: {totals['late_fees_paid']} {currency}\n"
+                  f"Average Time to Repay: {average_days:.1f} days",
+            inline=False
+        )
+        
+        # On-time repayments and loans that went overdue
+        embed.add_field(
+            name="Payment Statistics",
+            value=f"On-time Repayments: {totals['on_time']} ({on_time_percentage:.1f}%)\n"
+                  f"Late Repayments: {totals['late']}\n"
+                  f"Loans Due: {totals['loans_due']}\n"
+                  f"Went Overdue: {totals['defaulted']} ({default_rate:.1f}%)",
+            inline=False
+        )
+        
+        # Current time as footer
+        current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        embed.set_footer(text=f"Stats as of {current_time}")
+        
+        await interaction.followup.send(embed=embed)
 
 
 async def setup(bot):
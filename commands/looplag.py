@@ -0,0 +1,63 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+import datetime
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Slow callbacks shown, and characters of each stack (embed fields hold 1024)
+MAX_SLOW_CALLBACKS = 5
+MAX_STACK_CHARS = 700
+
+
+class LoopLagCommand(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        
+    @app_commands.command(name="looplag", description="View event loop lag and recent slow callbacks (Admin only)")
+    async def looplag(self, interaction: discord.Interaction):
+        # Check if the user has admin permissions
+        if not interaction.user.guild_permissions.administrator:
+            return await interaction.response.send_message(
+                "You need Administrator permissions to use this command.",
+                ephemeral=True
+            )
+        
+        loop_monitor = getattr(self.bot, "loop_monitor", None)
+        if loop_monitor is None or not loop_monitor.enabled:
+            return await interaction.response.send_message(
+                "The event loop monitor is disabled (`LOOP_MONITOR` in config.py).",
+                ephemeral=True
+            )
+        
+        stats = loop_monitor.get_stats()
+        
+        embed = discord.Embed(
+            title="⏱️ Event Loop Lag",
+            description=f"Over the last {stats['window']:.0f}s: current {stats['current'] * 1000:.1f}ms, "
+                        f"average {stats['average'] * 1000:.1f}ms, max {stats['max'] * 1000:.1f}ms.\n"
+                        f"{stats['slow_count']} callbacks blocked the loop for more than "
+                        f"{stats['slow_threshold'] * 1000:.0f}ms since startup.",
+            color=0xFF9900 if stats['recent'] else 0x00FF00
+        )
+        
+        # Add the most recent slow callbacks with the end of their stack
+        for stall in stats['recent'][:MAX_SLOW_CALLBACKS]:
+            started = datetime.datetime.fromtimestamp(stall['started'], datetime.timezone.utc)
+            stack = stall['stack'][-MAX_STACK_CHARS:] or "No stack captured"
+            
+            embed.add_field(
+                name=f"{stall['duration'] * 1000:.0f}ms in {stall['command'] or 'unknown'} "
+                     f"({discord.utils.format_dt(started, 'R')})"[:256],
+                value=f"```\n{stack.replace('```', '')}\n```",
+                inline=False
+            )
+        
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+
+async def setup(bot):
+    await bot.add_cog(LoopLagCommand(bot))
@@ -10,6 +10,8 @@ import logging
 # Add parent directory to path for imports
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from metrics import track_buttons
+
 # Initialize logger
 logger = logging.getLogger("repay")
 
@@ -40,6 +42,12 @@ else:
 # Always import manual integration as fallback
 import manual_unbelievaboat as manual_integration
 
+from command_queue import defer_and_enqueue
+from loan_index import get_loan_index, build_choices
+from shared_store import abort_loan_transaction, run_in_loan_transaction
+from unit_of_work import UnitOfWork
+from overdue_scheduler import repayment_credit_change
+
 
 class RepayCommand(commands.Cog):
     def __init__(self, bot):
@@ -70,15 +78,29 @@ class RepayCommand(commands.Cog):
     )
     async def repay(self, interaction: discord.Interaction, loan_id: str):
         """Command to repay a loan"""
+        await self._queue_repay(interaction, loan_id)
+        
+    @repay.autocomplete("loan_id")
+    async def repay_loan_id_autocomplete(self, interaction: discord.Interaction, current: str):
+        """Suggest the user's active loans in this server"""
+        if not interaction.guild:
+            return []
+        
+        loans = get_loan_index(self.bot).get_user_loans(interaction.guild.id, interaction.user.id, current.strip().lstrip("#"))
+        return build_choices(loans, config.UNBELIEVABOAT["CURRENCY_NAME"])
+        
+    async def _queue_repay(self, interaction, loan_id):
+        """Acknowledge the interaction and queue the repayment on the worker pool"""
+        await defer_and_enqueue(
+            self.bot, interaction, "repay",
+            run_in_loan_transaction, self.bot, interaction, str(interaction.guild_id), loan_id,
+            self._process_repay, interaction, loan_id
+        )
+        
+    async def _process_repay(self, interaction, loan_id):
+        """Process a loan repayment (runs on the command queue, replies via followup)"""
         try:
-            # Check if interaction is already responded to
-            if interaction.response.is_done():
-                logger.warning("Interaction already acknowledged in repay command, using followup instead")
-                send_message = interaction.followup.send
-            else:
-                # Defer the reply first to prevent interaction timeout
-                await interaction.response.defer()
-                send_message = interaction.followup.send
+            send_message = interaction.followup.send
             
             if not loan_id:
                 return await send_message(
@@ -97,27 +119,22 @@ class RepayCommand(commands.Cog):
                 loan_database["loans"] = []
                 print(f"Loans array did not exist in database, initialized empty array")
             
-            # Find loan index
-            loan_index = -1
-            for i, loan in enumerate(loan_database["loans"]):
-                if loan and loan.get("id") == loan_id:
-                    # First check if this user is the borrower
-                    if loan.get("user_id") == user_id:
-                        loan_index = i
-                        break
-                    else:
-                        return await send_message(
-                            f"You cannot repay a loan that belongs to someone else.",
-                            ephemeral=True
-                        )
+            # Look up the loan in the index
+            loan_index = get_loan_index(self.bot)
+            loan = loan_index.get_loan(loan_id)
             
-            if loan_index == -1:
+            if loan is None:
                 return await send_message(
                     f"Loan #{loan_id} not found or already repaid. Please check the loan ID and try again.",
                     ephemeral=True
                 )
             
-            loan = loan_database["loans"][loan_index]
+            # Check if this user is the borrower
+            if loan.get("user_id") != user_id:
+                return await send_message(
+                    f"You cannot repay a loan that belongs to someone else.",
+                    ephemeral=True
+                )
             
             if loan.get("status") != "active" and loan.get("status") != "active_partial":
                 return await send_message(
@@ -136,15 +153,21 @@ class RepayCommand(commands.Cog):
             on_time = current_date <= due_date
             late_fee = 0
             
+            # Changes are staged and only committed once the payment went through
+            uow = UnitOfWork(self.bot)
+            
             if not on_time and not loan.get("late_fee_applied", False):
                 # Apply 5% late fee if not already applied
                 late_fee = round(loan["amount"] * 0.05)
-                loan["late_fee"] = late_fee
-                loan["total_repayment"] = loan.get("total_repayment", 0) + late_fee
-                loan["late_fee_applied"] = True
+                uow.update("loans", loan, {
+                    "late_fee": late_fee,
+                    "total_repayment": loan.get("total_repayment", 0) + late_fee,
+                    "late_fee_applied": True,
+                    "late_fee_date": current_date.isoformat()
+                })
                 
                 # Recalculate repayment amount with late fee
-                repayment_amount = loan.get("total_repayment", 0)
+                repayment_amount = uow.staged(loan).get("total_repayment", 0)
                 if "amount_repaid" in loan:
                     repayment_amount -= loan.get("amount_repaid", 0)
             
@@ -196,35 +219,49 @@ class RepayCommand(commands.Cog):
                             ephemeral=True
                         )
                     
-                    # Mark the loan as repaid
-                    loan["status"] = "repaid"
-                    loan["repayment_date"] = current_date.isoformat()
+                    # Mark the loan as repaid, with information about the repayment
+                    # and the UnbelievaBoat transaction
+                    uow.update("loans", loan, {
+                        "status": "repaid",
+                        "repayment_date": current_date.isoformat(),
+                        "repaid": True,
+                        "repayment_on_time": on_time,
+                        "repayment_late_fee": late_fee,
+                        "unbelievaboat": dict(loan.get("unbelievaboat", {}), repayment_transaction=result)
+                    })
                     
-                    # Add information about the repayment
-                    loan["repaid"] = True
-                    loan["repayment_on_time"] = on_time
-                    loan["repayment_late_fee"] = late_fee
-                    
-                    # Add UnbelievaBoat transaction info to the loan
-                    loan["unbelievaboat"] = loan.get("unbelievaboat", {})
-                    loan["unbelievaboat"]["repayment_transaction"] = result
-                    
-                    # Move the loan to history
-                    if "history" not in loan_database:
-                        loan_database["history"] = []
-                    
-                    loan_database["history"].append(loan)
+                    # Move the loan from the active loans to history
+                    uow.append("history", loan)
+                    uow.remove("loans", loan)
                     
                     # Update the user's credit score
-                    credit_change = 10 if on_time else -5  # +10 for on-time, -5 for late
-            
-                    if "credit_scores" not in loan_database:
-                        loan_database["credit_scores"] = {}
-            
-                    if user_id not in loan_database["credit_scores"]:
-                        loan_database["credit_scores"][user_id] = 100  # Default score
-            
-                    loan_database["credit_scores"][user_id] += credit_change
+                    credit_change = repayment_credit_change(loan, on_time)  # +10 for on-time, -5 for late
+                    uow.adjust_credit(user_id, credit_change)
+                    
+                    try:
+                        await uow.commit()
+                    except Exception as e:
+                        logger.error(f"Payment for loan #{loan_id} was taken but could not be recorded: {e}")
+                        
+                        # Give the money back, so the user is not charged for a loan that stays unpaid
+                        refund = await unbelievaboat.add_currency(
+                            guild_id,
+                            user_id,
+                            repayment_amount,
+                            f"Refund for loan #{loan_id}: payment could not be recorded"
+                        )
+                        if not refund:
+                            logger.error(f"Refund of {repayment_amount} to user {user_id} for loan #{loan_id} failed")
+                            return await send_message(
+                                f"Your payment for loan #{loan_id} was taken but could not be recorded, and the refund failed. "
+                                f"Please contact an admin with this loan ID.",
+                                ephemeral=True
+                            )
+                        
+                        return await send_message(
+                            f"Your payment for loan #{loan_id} could not be recorded, so it was refunded. Please try again.",
+                            ephemeral=True
+                        )
             
                     # Create a nice embed for the repayment confirmation
                     embed = discord.Embed(
@@ -270,9 +307,6 @@ class RepayCommand(commands.Cog):
                         inline=True
                     )
                     
-                    # Remove the loan from the active loans array
-                    loan_database["loans"].pop(loan_index)
-                    
                     # Send the confirmation
                     await send_message(embed=embed)
                     
@@ -283,6 +317,7 @@ class RepayCommand(commands.Cog):
                     import traceback
                     print(f"Error in loan repayment: {str(e)}")
                     print(traceback.format_exc())
+                    abort_loan_transaction()
                     return await send_message(
                         f"An error occurred while processing your repayment: {str(e)}",
                         ephemeral=True
@@ -340,12 +375,16 @@ class RepayCommand(commands.Cog):
                     await send_message(embed=embed)
                 
                 # Mark loan as manual repayment in progress
-                loan["status"] = "manual_repayment"
-                loan["manual_repayment_started"] = current_date.isoformat()
+                uow.update("loans", loan, {
+                    "status": "manual_repayment",
+                    "manual_repayment_started": current_date.isoformat()
+                })
+                await uow.commit()
         except Exception as e:
             logger.error(f"Error in repay command: {e}")
             import traceback
             logger.error(traceback.format_exc())
+            abort_loan_transaction()
             
             # Check if we can still respond
             try:
@@ -365,6 +404,7 @@ class RepayCommand(commands.Cog):
 
     # Button handler for repayment
     @commands.Cog.listener()
+    @track_buttons("repay_")
     async def on_interaction(self, interaction: discord.Interaction):
         try:
             # Skip if not a component interaction
@@ -404,8 +444,8 @@ class RepayCommand(commands.Cog):
                             )
                     return
                 
-                # Call the repay command
-                await self.repay(interaction, loan_id)
+                # Queue the repayment
+                await self._queue_repay(interaction, loan_id)
         except Exception as e:
             logger.error(f"Error in repay button handler: {e}")
             import traceback
@@ -31,4 +31,80 @@ SERVER_SETTINGS = {
     # "guild_id": {
     #     "captain_role_id": "role_id"  # Role ID that can take loans
     # }
-} 
\ No newline at end of file
+} 
+
+# Gateway intents and member cache policy
+# Interactions already include the invoking member's roles, so no privileged
+# intents are needed by default. Enable MEMBERS_INTENT to let the bot chunk a
+# guild's members on demand (e.g. to find an admin for manual payment instructions)
+GATEWAY = {
+    "MEMBERS_INTENT": os.environ.get("GATEWAY_MEMBERS_INTENT", "false").lower() == "true",
+    "PRESENCES_INTENT": False,  # Presences are never used
+    "MESSAGE_CONTENT_INTENT": False,  # Only slash commands are used
+    "MEMBER_CACHE": os.environ.get("GATEWAY_MEMBER_CACHE", "none"),  # "none", "joined", "voice", "all" or "intents"
+    "CHUNK_GUILDS_AT_STARTUP": False  # Chunk members on demand instead of for every guild at startup
+}
+
+# Acknowledge-first command execution
+# Slow commands (approveloan, repay, pay_installment) are deferred immediately
+# and processed by a bounded pool of background workers
+COMMAND_QUEUE = {
+    "WORKERS": int(os.environ.get("COMMAND_QUEUE_WORKERS", 4)),  # Number of concurrent workers
+    "MAX_SIZE": int(os.environ.get("COMMAND_QUEUE_MAX_SIZE", 100))  # Commands waiting before new ones are rejected
+}
+
+# Sharding (opt-in)
+# When enabled the bot runs as an AutoShardedBot and the database backup is
+# split per shard (data/database.shard<N>.json), each written by its own task.
+# SHARD_IDS runs only some of the shards in this process and needs SHARD_COUNT
+SHARDING = {
+    "ENABLED": os.environ.get("SHARDING_ENABLED", "false").lower() == "true",
+    "SHARD_COUNT": int(os.environ["SHARD_COUNT"]) if os.environ.get("SHARD_COUNT") else None,  # None lets Discord decide
+    "SHARD_IDS": [int(i) for i in os.environ.get("SHARD_IDS", "").split(",") if i.strip()] or None,  # e.g. "0,1"
+    "BACKUP_MINUTES": 5  # Interval of each shard's backup task
+}
+
+# Multi-process deployment (see launch_workers.py)
+# Set STORE_PATH to write every loan change through to a shared SQLite store;
+# approvals and repayments are then locked across processes. The launcher
+# splits SHARD_COUNT shards across WORKERS processes
+MULTIPROCESS = {
+    "STORE_PATH": os.environ.get("SHARED_STORE_PATH", ""),  # e.g. "data/loans.db", empty to disable
+    "WORKERS": int(os.environ.get("MULTIPROCESS_WORKERS", 2)),  # Worker processes started by the launcher
+    "SHARD_COUNT": int(os.environ.get("MULTIPROCESS_SHARD_COUNT", 2)),  # Total shards split across the workers
+    "LOCK_TIMEOUT": 30,  # Seconds to wait for a loan that another process is working on
+    "LOCK_TTL": 120  # Seconds after which a lock left by a crashed worker expires
+}
+
+# Due-date reminders
+# Borrowers get a DM and the admin channel a digest of the loans due soon,
+# OFFSETS_HOURS before each due date. Sends are merged per recipient and
+# paced to stay under Discord's global and per-channel rate limits
+REMINDERS = {
+    "ENABLED": os.environ.get("REMINDERS_ENABLED", "true").lower() == "true",
+    "OFFSETS_HOURS": [24, 1],  # Hours before the due date
+    "DM_BORROWERS": True,  # DM the borrower
+    "ADMIN_DIGEST": True,  # Post a digest in the admin channel (set with /set_admin_channel)
+    "GLOBAL_RATE": 25,  # Sends per second across all channels (Discord allows 50 requests)
+    "ROUTE_RATE": 5,  # Sends per channel or DM ...
+    "ROUTE_PERIOD": 5,  # ... per this many seconds
+    "WORKERS": 4  # Concurrent senders
+}
+
+# /loanchart images
+# Charts are drawn by matplotlib in separate processes and cached until the
+# guild's loans change
+CHARTS = {
+    "WORKERS": int(os.environ.get("CHART_WORKERS", 2)),  # Rendering processes
+    "CACHE_SIZE": 128  # Images kept in memory
+}
+
+# Event loop monitor (/looplag and /metrics)
+# Measures how late the event loop runs and records the stack and command of
+# callbacks that block it for longer than SLOW_THRESHOLD
+LOOP_MONITOR = {
+    "ENABLED": os.environ.get("LOOP_MONITOR_ENABLED", "true").lower() == "true",
+    "INTERVAL": 0.25,  # Seconds between lag samples
+    "SLOW_THRESHOLD": 0.5,  # Seconds the loop may be blocked before it is reported
+    "HISTORY": 20  # Slow callbacks kept for /looplag
+}
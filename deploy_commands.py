@@ -3,11 +3,23 @@ Deploy slash commands to Discord
 
 This script will deploy all slash commands to Discord.
 Run this script when you add new commands or modify existing ones.
+
+Usage:
+  python deploy_commands.py [--force] [--concurrency N]
+
+Every cog in the commands package is loaded and the command payload of each
+scope (global and every guild) is hashed. Scopes whose hash matches the last
+successful deploy (stored in data/command_hashes.json) are skipped, and the
+guilds that did change are synced concurrently. Use --force to sync every
+scope regardless of the stored hashes.
 """
 
 import discord
 from discord.ext import commands
+import argparse
 import asyncio
+import hashlib
+import json
 import sys
 import logging
 import config
@@ -24,56 +36,172 @@ logging.basicConfig(
 
 logger = logging.getLogger('discord')
 
-# List all command cogs to load
-COMMAND_EXTENSIONS = [
-    "commands.help",
-    "commands.loan",
-    "commands.repay",
-    "commands.setup",
-    "commands.loan_setup"
-]
-
-intents = discord.Intents.default()
-intents.message_content = True
-bot = commands.Bot(command_prefix='!', intents=intents)
-
-@bot.event
-async def on_ready():
-    logger.info(f'Logged in as {bot.user.name} ({bot.user.id})')
-    logger.info(f'Bot is in {len(bot.guilds)} servers')
-    
+# Directory containing the command cogs
+COMMANDS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "commands")
+
+# Hashes of the last successfully deployed payload per scope
+HASH_FILE = "data/command_hashes.json"
+
+# Number of guilds synced at once; discord.py retries rate limited requests
+DEFAULT_CONCURRENCY = 8
+
+# The deploy only uses REST calls, so no gateway intents are needed
+bot = commands.Bot(command_prefix='!', intents=discord.Intents.none())
+
+
+def discover_extensions():
+    """
+    Find all command cogs in the commands package
+    :return: Sorted list of extension names
+    """
+    return sorted(
+        f"commands.{filename[:-3]}"
+        for filename in os.listdir(COMMANDS_DIR)
+        if filename.endswith(".py") and not filename.startswith("_")
+    )
+
+
+def build_payload(guild=None):
+    """
+    Build the payload Discord receives when syncing a scope
+    :param guild: Guild to build the payload for, or None for global commands
+    :return: List of command dicts
+    """
+    payload = []
+    for command in bot.tree.get_commands(guild=guild):
+        try:
+            payload.append(command.to_dict(bot.tree))
+        except TypeError:
+            # discord.py before 2.4 builds the payload without the tree
+            payload.append(command.to_dict())
+    return payload
+
+
+def hash_payload(payload):
+    """
+    Hash a command payload independently of command ordering
+    :param payload: List of command dicts
+    :return: Hex digest
+    """
+    ordered = sorted(payload, key=lambda command: (command.get("type", 1), command.get("name", "")))
+    encoded = json.dumps(ordered, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def load_hashes():
+    """Load the stored scope hashes"""
     try:
+        if os.path.exists(HASH_FILE):
+            with open(HASH_FILE, "r") as f:
+                return json.load(f)
+    except Exception as e:
+        logger.warning(f"Could not read {HASH_FILE}, syncing every scope: {e}")
+    return {}
+
+
+def save_hashes(hashes):
+    """Save the scope hashes atomically"""
+    os.makedirs(os.path.dirname(HASH_FILE), exist_ok=True)
+    temp_file = f"{HASH_FILE}.tmp"
+    with open(temp_file, "w") as f:
+        json.dump(hashes, f, indent=2)
+    os.replace(temp_file, HASH_FILE)
+
+
+async def sync_guilds(guilds, stored_hashes, force, concurrency):
+    """
+    Sync every guild whose payload changed, a few at a time
+    :return: Tuple of (new guild hashes, synced count, skipped count, failed count)
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    new_hashes = {}
+    counts = {"synced": 0, "skipped": 0, "failed": 0}
+
+    async def sync_guild(guild):
+        guild_id = str(guild.id)
+        guild_hash = hash_payload(build_payload(guild))
+
+        if not force and stored_hashes.get(guild_id) == guild_hash:
+            new_hashes[guild_id] = guild_hash
+            counts["skipped"] += 1
+            return
+
+        async with semaphore:
+            try:
+                await bot.tree.sync(guild=guild)
+                new_hashes[guild_id] = guild_hash
+                counts["synced"] += 1
+                logger.info(f"Synced commands to guild: {guild.name} (ID: {guild.id})")
+            except Exception as e:
+                # Keep the old hash so the guild is retried next time
+                if guild_id in stored_hashes:
+                    new_hashes[guild_id] = stored_hashes[guild_id]
+                counts["failed"] += 1
+                logger.error(f"Error syncing commands to guild {guild.name}: {e}")
+
+    await asyncio.gather(*(sync_guild(guild) for guild in guilds))
+    return new_hashes, counts["synced"], counts["skipped"], counts["failed"]
+
+
+async def deploy(token, force=False, concurrency=DEFAULT_CONCURRENCY):
+    """Load every command cog and sync the scopes that changed"""
+    started = asyncio.get_running_loop().time()
+
+    async with bot:
         # Load all command extensions
-        for extension in COMMAND_EXTENSIONS:
+        for extension in discover_extensions():
             try:
                 await bot.load_extension(extension)
                 logger.info(f"Loaded extension: {extension}")
             except Exception as e:
                 logger.error(f"Failed to load extension {extension}: {e}")
-        
+
+        # Log in over REST only (no gateway connection needed to sync)
+        await bot.login(token)
+        logger.info(f"Logged in as {bot.user.name} ({bot.user.id})")
+
+        stored = load_hashes()
+        if stored.get("application_id") != str(bot.application_id):
+            stored = {}
+
+        hashes = {"application_id": str(bot.application_id), "global": stored.get("global"), "guilds": {}}
+
         # Sync commands globally
-        await bot.tree.sync()
-        logger.info("Synced commands globally")
-        
+        global_hash = hash_payload(build_payload())
+        if force or stored.get("global") != global_hash:
+            await bot.tree.sync()
+            hashes["global"] = global_hash
+            logger.info(f"Synced {len(bot.tree.get_commands())} commands globally")
+        else:
+            logger.info("Global commands unchanged, skipping")
+
         # Sync commands to each guild for guild-specific commands
-        for guild in bot.guilds:
-            try:
-                await bot.tree.sync(guild=guild)
-                logger.info(f"Synced commands to guild: {guild.name} (ID: {guild.id})")
-            except Exception as e:
-                logger.error(f"Error syncing commands to guild {guild.name}: {e}")
-        
-        logger.info("All commands have been deployed successfully!")
-    except Exception as e:
-        logger.error(f"Error deploying commands: {e}")
-    finally:
-        # Exit the bot
-        await bot.close()
+        guilds = [guild async for guild in bot.fetch_guilds(limit=None)]
+        logger.info(f"Bot is in {len(guilds)} servers")
+
+        guild_hashes, synced, skipped, failed = await sync_guilds(
+            guilds,
+            stored.get("guilds", {}),
+            force,
+            concurrency
+        )
+        hashes["guilds"] = guild_hashes
+        save_hashes(hashes)
+
+        elapsed = asyncio.get_running_loop().time() - started
+        logger.info(f"Guild sync finished: {synced} synced, {skipped} unchanged, {failed} failed")
+        logger.info(f"All commands have been deployed successfully in {elapsed:.1f}s!")
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deploy slash commands to Discord")
+    parser.add_argument("--force", action="store_true", help="Sync every scope even if unchanged")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Guilds synced at once")
+    args = parser.parse_args()
+
     token = config.DISCORD_TOKEN
     if not token:
         logger.error("No token found in config.py")
         sys.exit(1)
-        
-    bot.run(token) 
\ No newline at end of file
+
+    asyncio.run(deploy(token, force=args.force, concurrency=max(1, args.concurrency)))
@@ -0,0 +1,111 @@
+"""
+Gateway Configuration
+
+This module builds the gateway intents and member cache policy from the
+config.GATEWAY settings. The bot only needs the roles of the member running
+a command, and Discord includes those in every interaction payload, so by
+default no privileged intents are requested and no members are cached.
+"""
+
+import logging
+
+import discord
+
+# Scripts like benchmark_member_cache.py run without a config module
+try:
+    import config
+except ModuleNotFoundError:
+    config = None
+
+logger = logging.getLogger("discord")
+
+# Defaults used when config.GATEWAY is missing or incomplete
+DEFAULT_GATEWAY_SETTINGS = {
+    "MEMBERS_INTENT": False,            # Needed for on-demand member chunking and member update events
+    "PRESENCES_INTENT": False,          # The bot never looks at presences
+    "MESSAGE_CONTENT_INTENT": False,    # Only slash commands are used
+    "MEMBER_CACHE": "none",             # "none", "joined", "voice", "all" or "intents"
+    "CHUNK_GUILDS_AT_STARTUP": False    # Chunk members on demand instead
+}
+
+
+def get_gateway_settings():
+    """
+    Get the gateway settings merged with defaults
+    :return: Dict of gateway settings
+    """
+    settings = dict(DEFAULT_GATEWAY_SETTINGS)
+    settings.update(getattr(config, "GATEWAY", {}) or {})
+    return settings
+
+
+def build_intents(settings=None):
+    """
+    Build the gateway intents
+    :param settings: Gateway settings dict (defaults to config.GATEWAY)
+    :return: discord.Intents
+    """
+    if settings is None:
+        settings = get_gateway_settings()
+
+    intents = discord.Intents.default()
+    intents.members = bool(settings.get("MEMBERS_INTENT", False))
+    intents.presences = bool(settings.get("PRESENCES_INTENT", False))
+    intents.message_content = bool(settings.get("MESSAGE_CONTENT_INTENT", False))
+
+    return intents
+
+
+def build_member_cache_flags(intents, settings=None):
+    """
+    Build the member cache policy, falling back to no caching when the
+    requested policy needs intents that are not enabled
+    :param intents: The discord.Intents the bot is started with
+    :param settings: Gateway settings dict (defaults to config.GATEWAY)
+    :return: discord.MemberCacheFlags
+    """
+    if settings is None:
+        settings = get_gateway_settings()
+
+    policy = str(settings.get("MEMBER_CACHE", "none")).lower()
+
+    if policy == "intents":
+        return discord.MemberCacheFlags.from_intents(intents)
+
+    if policy == "all":
+        flags = discord.MemberCacheFlags.all()
+    elif policy == "joined":
+        flags = discord.MemberCacheFlags.none()
+        flags.joined = True
+    elif policy == "voice":
+        flags = discord.MemberCacheFlags.none()
+        flags.voice = True
+    else:
+        if policy != "none":
+            logger.warning(f"Unknown member cache policy '{policy}', caching no members")
+        return discord.MemberCacheFlags.none()
+
+    # joined needs the members intent, voice needs the voice_states intent
+    if (flags.joined and not intents.members) or (flags.voice and not intents.voice_states):
+        logger.warning(f"Member cache policy '{policy}' needs intents that are not enabled, caching no members")
+        return discord.MemberCacheFlags.none()
+
+    return flags
+
+
+def get_bot_options(settings=None):
+    """
+    Get the keyword arguments for creating the bot
+    :param settings: Gateway settings dict (defaults to config.GATEWAY)
+    :return: Dict with intents, member_cache_flags and chunk_guilds_at_startup
+    """
+    if settings is None:
+        settings = get_gateway_settings()
+
+    intents = build_intents(settings)
+
+    return {
+        "intents": intents,
+        "member_cache_flags": build_member_cache_flags(intents, settings),
+        "chunk_guilds_at_startup": bool(settings.get("CHUNK_GUILDS_AT_STARTUP", False)) and intents.members
+    }
@@ -0,0 +1,140 @@
+"""
+Guild Admin Cache
+
+This module keeps a per-guild cache of administrator and loan approver
+members, so manual payment instructions can mention an admin without
+scanning the whole member list on every loan approval. The cache is built
+once per guild (chunking members on demand if needed) and kept up to date
+by member and role update events and by approval role setting changes.
+"""
+
+import asyncio
+import logging
+import time
+
+import discord
+
+import server_settings
+
+logger = logging.getLogger("discord")
+
+# Member and role events are only delivered for cached members, so entries
+# are also rebuilt after this many seconds to bound staleness
+CACHE_TTL = 600
+
+
+class GuildAdminCache:
+    def __init__(self, ttl=CACHE_TTL):
+        """
+        Initialize the cache
+        :param ttl: Seconds after which a guild's entry is rebuilt
+        """
+        self.ttl = ttl
+        self.guilds = {}
+        self.pending = {}
+
+    def _is_fresh(self, entry):
+        """Check if a cache entry can still be used"""
+        return entry is not None and time.monotonic() - entry["built_at"] < self.ttl
+
+    def get_admin_id(self, guild):
+        """
+        Get a cached administrator (or approver) to mention for a guild in O(1)
+        :param guild: The Discord guild object
+        :return: Member ID of an admin or approver, or the guild owner's ID as fallback
+        """
+        entry = self.guilds.get(guild.id)
+
+        if entry:
+            if entry["admins"]:
+                return next(iter(entry["admins"]))
+            if entry["approvers"]:
+                return next(iter(entry["approvers"]))
+
+        return guild.owner_id
+
+    def get_approver_ids(self, guild_id):
+        """
+        Get the cached approver member IDs for a guild
+        :param guild_id: Discord guild ID
+        :return: List of member IDs (empty if not cached)
+        """
+        entry = self.guilds.get(int(guild_id))
+        return list(entry["approvers"]) if entry else []
+
+    async def ensure(self, guild):
+        """
+        Make sure the guild's entry is built, coalescing concurrent builds
+        :param guild: The Discord guild object
+        """
+        if self._is_fresh(self.guilds.get(guild.id)):
+            return
+
+        task = self.pending.get(guild.id)
+        if task is None:
+            task = asyncio.ensure_future(self._build(guild))
+            self.pending[guild.id] = task
+            task.add_done_callback(lambda _: self.pending.pop(guild.id, None))
+
+        await task
+
+    async def _build(self, guild):
+        """Scan the guild's members once and record admins and approvers"""
+        members = guild.members
+
+        # Without a member cache the member list has to be requested
+        if not guild.chunked:
+            try:
+                members = await guild.chunk(cache=False)
+            except discord.ClientException:
+                logger.info(f"Cannot chunk members of guild {guild.id} without the members intent, using cached members")
+            except Exception as e:
+                logger.error(f"Error chunking members of guild {guild.id}: {e}")
+
+        approval_roles = server_settings.get_approval_role_ids(guild.id)
+        entry = {"admins": {}, "approvers": {}, "built_at": time.monotonic()}
+
+        for member in members:
+            self._classify(entry, member, approval_roles)
+
+        self.guilds[guild.id] = entry
+        logger.info(f"Cached {len(entry['admins'])} admins and {len(entry['approvers'])} approvers for guild {guild.id}")
+
+    def _classify(self, entry, member, approval_roles):
+        """Add or remove a member from a guild entry based on their current roles"""
+        entry["admins"].pop(member.id, None)
+        entry["approvers"].pop(member.id, None)
+
+        if member.bot:
+            return
+
+        if member.guild_permissions.administrator:
+            entry["admins"][member.id] = True
+        if approval_roles and not approval_roles.isdisjoint(role.id for role in member.roles):
+            entry["approvers"][member.id] = True
+
+    def update_member(self, member):
+        """
+        Update a single member's entry after their roles changed
+        :param member: The updated Discord member object
+        """
+        entry = self.guilds.get(member.guild.id)
+        if entry is None:
+            return
+
+        approval_roles = server_settings.get_approval_role_ids(member.guild.id)
+        self._classify(entry, member, approval_roles)
+
+    def invalidate(self, guild_id=None):
+        """
+        Drop a guild's entry so it is rebuilt on next use
+        :param guild_id: Discord guild ID, or None to drop every guild
+        """
+        if guild_id is None:
+            self.guilds.clear()
+        else:
+            self.guilds.pop(int(guild_id), None)
+
+
+# Shared cache used by the bot and the manual integration helpers
+admin_cache = GuildAdminCache()
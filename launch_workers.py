@@ -0,0 +1,194 @@
+"""
+Multi-Process Launcher
+
+Starts several bot worker processes on this machine, each running a range of
+shards against one shared SQLite store (see shared_store.py), and restarts
+workers that crash.
+
+Usage:
+  python launch_workers.py [--workers N] [--shards M] [--store PATH]
+
+Defaults come from MULTIPROCESS in config.py. Every worker runs bot.py with
+SHARDING_ENABLED, SHARD_COUNT, SHARD_IDS and SHARED_STORE_PATH set, so
+config.py must read those from the environment like config_template.py does.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+
+from shared_store import get_multiprocess_settings
+
+# Set up logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.FileHandler("launcher.log"),
+        logging.StreamHandler()
+    ]
+)
+
+logger = logging.getLogger("launcher")
+
+# Path to the bot script
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+
+# A worker that exits this soon after starting counts as a quick crash
+QUICK_CRASH_SECONDS = 5
+MAX_QUICK_CRASHES = 10
+CRASH_TIMEOUT = 60
+
+
+def split_shards(shard_count, workers):
+    """
+    Split the shards into contiguous ranges, one per worker
+    :param shard_count: Total number of shards
+    :param workers: Number of worker processes
+    :return: List of shard ID lists
+    """
+    workers = max(1, min(workers, shard_count))
+    base, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+
+    for worker_id in range(workers):
+        size = base + (1 if worker_id < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+
+    return ranges
+
+
+class Worker:
+    def __init__(self, worker_id, shard_ids, shard_count, store_path):
+        self.worker_id = worker_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.store_path = store_path
+        self.process = None
+        self.started_at = 0
+        self.quick_crashes = 0
+        self.restart_at = 0
+        self.finished = False
+
+    def start(self):
+        """Start the worker process"""
+        env = os.environ.copy()
+        env.update({
+            "SHARDING_ENABLED": "true",
+            "SHARD_COUNT": str(self.shard_count),
+            "SHARD_IDS": ",".join(str(shard_id) for shard_id in self.shard_ids),
+            "SHARED_STORE_PATH": self.store_path,
+            "WORKER_ID": str(self.worker_id)
+        })
+
+        self.process = subprocess.Popen([sys.executable, BOT_SCRIPT], env=env)
+        self.started_at = time.time()
+        logger.info(f"Started worker {self.worker_id} (pid {self.process.pid}) for shards {self.shard_ids}")
+
+    def check(self):
+        """Restart the worker if it crashed"""
+        if self.finished:
+            return
+
+        if self.process is None:
+            if time.time() >= self.restart_at:
+                self.start()
+            return
+
+        returncode = self.process.poll()
+        if returncode is None:
+            return
+
+        self.process = None
+
+        # If the process exits with a 0 code, it was a clean shutdown
+        if returncode == 0:
+            logger.info(f"Worker {self.worker_id} shut down cleanly")
+            self.finished = True
+            return
+
+        run_time = time.time() - self.started_at
+        logger.error(f"Worker {self.worker_id} crashed with exit code {returncode} after {run_time:.1f} seconds")
+
+        if run_time < QUICK_CRASH_SECONDS:
+            self.quick_crashes += 1
+        else:
+            self.quick_crashes = 0
+
+        if self.quick_crashes >= MAX_QUICK_CRASHES:
+            logger.critical(f"Worker {self.worker_id} crashed {MAX_QUICK_CRASHES} times in a row. Waiting {CRASH_TIMEOUT} seconds before trying again.")
+            self.quick_crashes = 0
+            self.restart_at = time.time() + CRASH_TIMEOUT
+        else:
+            self.restart_at = time.time() + 2
+
+    def stop(self):
+        """Ask the worker to stop"""
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def wait(self, timeout):
+        """Wait for the worker to exit, killing it after the timeout"""
+        if self.process is None:
+            return
+
+        try:
+            self.process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Worker {self.worker_id} did not stop in time, killing it")
+            self.process.kill()
+
+
+def main():
+    settings = get_multiprocess_settings()
+
+    parser = argparse.ArgumentParser(description="Run the bot as several shard worker processes")
+    parser.add_argument("--workers", type=int, default=settings["WORKERS"], help="Number of worker processes")
+    parser.add_argument("--shards", type=int, default=settings["SHARD_COUNT"], help="Total number of shards")
+    parser.add_argument("--store", default=settings["STORE_PATH"] or "data/loans.db", help="Path of the shared SQLite store")
+    args = parser.parse_args()
+
+    shard_count = max(1, args.shards)
+    workers = [
+        Worker(worker_id, shard_ids, shard_count, args.store)
+        for worker_id, shard_ids in enumerate(split_shards(shard_count, args.workers))
+    ]
+
+    logger.info(f"===== Launching {len(workers)} workers for {shard_count} shards (store: {args.store}) =====")
+
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    # Stagger the first logins a little to spread out the gateway identifies
+    for worker in workers:
+        worker.start()
+        time.sleep(1)
+
+    while not stopping and not all(worker.finished for worker in workers):
+        for worker in workers:
+            worker.check()
+        time.sleep(1)
+
+    logger.info("Stopping workers...")
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        worker.wait(timeout=30)
+
+    logger.info("===== Launcher stopped =====")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+"""
+Loan Request Load Test
+
+Usage:
+  python loadtest_loan_requests.py [--submissions N] [--users U] [--processes P] [--store PATH]
+
+Fires N concurrent /loan submissions (1000 by default) from U users through
+the real LoanCommand.loan callback, with fake interactions that yield to the
+event loop like network calls do, and checks that no user ends up with more
+than one pending loan request. With --processes, the submissions are split
+across worker processes that share the SQLite store at --store (a temporary
+file by default), like launch_workers.py runs the bot. No Discord connection
+is needed, but config.py must exist.
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import os
+import sqlite3
+import tempfile
+import time
+
+GUILD_IDS = ("100000000000000001", "100000000000000002")
+USER_ID_BASE = 200000000000000000
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.mention = f"<@{user_id}>"
+
+    def __str__(self):
+        return f"user{self.id}"
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = int(guild_id)
+        self.name = f"Guild {guild_id}"
+
+
+class FakeResponse:
+    def __init__(self):
+        self.deferred = False
+
+    def is_done(self):
+        return self.deferred
+
+    async def defer(self, ephemeral=False):
+        # Yield like the HTTP call would, so submissions interleave
+        await asyncio.sleep(0)
+        self.deferred = True
+
+
+class FakeFollowup:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, content=None, embed=None, ephemeral=False, **kwargs):
+        await asyncio.sleep(0)
+        self.messages.append(embed.title if embed else content)
+
+
+class FakeInteraction:
+    def __init__(self, guild_id, user_id):
+        self.guild = FakeGuild(guild_id)
+        self.guild_id = self.guild.id
+        self.user = FakeUser(user_id)
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+
+class FakeBot:
+    def __init__(self):
+        self.loan_database = {"loans": [], "history": [], "credit_scores": {}, "loan_requests": []}
+
+    def get_channel(self, channel_id):
+        return None
+
+
+async def submit_all(submissions, users, offset=0):
+    """
+    Fire the submissions concurrently against one bot
+    :return: Tuple of (bot, seconds taken)
+    """
+    from commands.loan import LoanCommand
+
+    bot = FakeBot()
+    cog = LoanCommand(bot)
+
+    interactions = []
+    for n in range(offset, offset + submissions):
+        guild_id = GUILD_IDS[n % len(GUILD_IDS)]
+        user_id = USER_ID_BASE + (n // len(GUILD_IDS)) % users
+        interactions.append(FakeInteraction(guild_id, user_id))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        LoanCommand.loan.callback(cog, interaction, 1000, 7, "load test")
+        for interaction in interactions
+    ))
+    return bot, time.perf_counter() - started
+
+
+def run_worker(store_path, submissions, users, offset):
+    """Run a share of the submissions in a worker process against the shared store"""
+    import shared_store
+    shared_store.open_shared_store({"STORE_PATH": store_path})
+
+    bot, elapsed = asyncio.run(submit_all(submissions, users, offset))
+    return len(bot.loan_database["loan_requests"]), elapsed
+
+
+def count_duplicates(requests):
+    """Count users with more than one pending request in the same guild"""
+    pending = {}
+    for request in requests:
+        if request.get("status") == "pending":
+            key = (request["guild_id"], request["user_id"])
+            pending[key] = pending.get(key, 0) + 1
+    return sum(1 for count in pending.values() if count > 1), len(pending)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test concurrent loan request submissions")
+    parser.add_argument("--submissions", type=int, default=1000, help="Number of concurrent submissions")
+    parser.add_argument("--users", type=int, default=50, help="Number of distinct users per guild")
+    parser.add_argument("--processes", type=int, default=1, help="Number of worker processes sharing a store")
+    parser.add_argument("--store", default=None, help="Shared SQLite store path (for --processes)")
+    args = parser.parse_args()
+
+    print(f"\n===== Loan Request Load Test ({args.submissions:,} submissions, {args.users} users per guild) =====")
+
+    if args.processes <= 1 and not args.store:
+        bot, elapsed = asyncio.run(submit_all(args.submissions, args.users))
+        duplicates, users = count_duplicates(bot.loan_database["loan_requests"])
+        print(f"Submitted in {elapsed:.2f}s: {len(bot.loan_database['loan_requests'])} requests stored for {users} users")
+    else:
+        store_path = args.store or os.path.join(tempfile.mkdtemp(), "loadtest.db")
+        share = args.submissions // args.processes
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.processes) as executor:
+            futures = [
+                executor.submit(run_worker, store_path, share, args.users, worker * share)
+                for worker in range(args.processes)
+            ]
+            for worker, future in enumerate(futures):
+                stored, elapsed = future.result()
+                print(f"Worker {worker}: {stored} requests accepted in {elapsed:.2f}s")
+
+        conn = sqlite3.connect(store_path)
+        rows = conn.execute(
+            "SELECT guild_id, user_id, status FROM loan_requests"
+        ).fetchall()
+        conn.close()
+
+        requests = [{"guild_id": guild_id, "user_id": user_id, "status": status} for guild_id, user_id, status in rows]
+        duplicates, users = count_duplicates(requests)
+        print(f"Shared store {store_path}: {len(requests)} requests stored for {users} users")
+
+    if duplicates:
+        print(f"FAILED: {duplicates} users have more than one pending request")
+        raise SystemExit(1)
+
+    print("OK: at most one pending request per user")
+
+
+if __name__ == "__main__":
+    main()
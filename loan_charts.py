@@ -0,0 +1,220 @@
+"""
+Loan Charts
+
+This module renders the /loanchart images: a guild's outstanding debt and
+daily repayments over the last 7, 30 or 90 days, built from the daily
+buckets kept by loan_stats.py. Images are drawn with matplotlib in a process
+pool, so rendering never blocks the event loop, and cached by (guild, period,
+statistics version, day). LoanStats bumps a guild's version whenever a loan
+in the guild changes, so a cached image is served until the guild's loans
+change or the day rolls over.
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import io
+import logging
+import time
+
+from loan_stats import PERIOD_DAYS, get_loan_stats
+
+try:
+    import config
+except ModuleNotFoundError:
+    config = None
+
+logger = logging.getLogger("discord")
+
+# Defaults used when config.CHARTS is missing or incomplete
+DEFAULT_CHART_SETTINGS = {
+    "WORKERS": 2,       # Rendering processes
+    "CACHE_SIZE": 128   # Images kept in memory
+}
+
+
+def get_chart_settings():
+    """
+    Get the chart settings merged with defaults
+    :return: Dict of chart settings
+    """
+    settings = dict(DEFAULT_CHART_SETTINGS)
+    settings.update(getattr(config, "CHARTS", {}) or {})
+    return settings
+
+
+def build_series(stats, guild_id, days, today=None):
+    """
+    Get the values plotted for a guild, one per day
+    :param stats: LoanStats instance
+    :param guild_id: The guild ID
+    :param days: Number of days, ending today
+    :param today: The last day (defaults to today)
+    :return: Dict with "labels", "debt" (outstanding at the end of each day) and "repaid" lists
+    """
+    daily = stats.get_daily(guild_id, days, today)
+    labels = [date.strftime("%b %d") for date, bucket in daily]
+    repaid = [bucket.get("amount_repaid", 0) for date, bucket in daily]
+
+    # Walk back from today's outstanding debt, undoing each day's loans, late fees and repayments
+    debt = [0] * len(daily)
+    outstanding = stats.get_guild(guild_id)["current_debt"]
+    for i in range(len(daily) - 1, -1, -1):
+        debt[i] = max(0, outstanding)
+        bucket = daily[i][1]
+        outstanding -= bucket.get("amount_owed", 0) + bucket.get("late_fees_charged", 0) - repaid[i]
+
+    return {"labels": labels, "debt": debt, "repaid": repaid}
+
+
+def _warm_up():
+    """Import matplotlib in a pool process ahead of the first chart"""
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def render_chart(title, labels, debt, repaid, currency):
+    """
+    Draw the debt and repayment chart (runs in a pool process)
+    :return: PNG image as bytes
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(8, 5), dpi=100)
+    debt_axes, repaid_axes = figure.subplots(2, 1, sharex=True)
+    positions = list(range(len(labels)))
+
+    debt_axes.plot(positions, debt, color="#00AAFF", linewidth=2)
+    debt_axes.fill_between(positions, debt, color="#00AAFF", alpha=0.2)
+    debt_axes.set_title(title)
+    debt_axes.set_ylabel(f"Outstanding ({currency})")
+    debt_axes.set_ylim(bottom=0)
+    debt_axes.grid(alpha=0.3)
+
+    repaid_axes.bar(positions, repaid, color="#43B581")
+    repaid_axes.set_ylabel(f"Repaid ({currency})")
+    repaid_axes.grid(axis="y", alpha=0.3)
+
+    # Label about a week's worth of days at most
+    step = max(1, len(labels) // 7)
+    repaid_axes.set_xticks(positions[::step])
+    repaid_axes.set_xticklabels(labels[::step], rotation=30, ha="right")
+
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+class ChartRenderer:
+    def __init__(self, settings=None):
+        """
+        Initialize the renderer
+        :param settings: Chart settings dict (defaults to config.CHARTS)
+        """
+        if settings is None:
+            settings = get_chart_settings()
+
+        self.settings = settings
+        self._pool = None
+        self._cache = collections.OrderedDict()  # (guild_id, period, version, day) -> PNG bytes, oldest first
+        self._rendering = {}  # Same keys -> task rendering the image
+        self.stats = {"hits": 0, "misses": 0, "renders": 0, "render_seconds": 0.0, "last_render": 0.0}
+
+    def start(self):
+        """Start the rendering processes (before the bot opens connections and threads)"""
+        if self._pool is not None:
+            return
+
+        workers = max(1, int(self.settings["WORKERS"]))
+        self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        for _ in range(workers):
+            self._pool.submit(_warm_up)
+
+    def stop(self):
+        """Stop the rendering processes"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def get_chart(self, bot, guild_id, period):
+        """
+        Get a guild's chart for a period, from the cache if its loans have not changed
+        :param bot: The bot instance
+        :param guild_id: The guild ID
+        :param period: "7d", "30d" or "90d"
+        :return: Tuple of (PNG bytes, whether it came from the cache)
+        """
+        stats = get_loan_stats(bot)
+        today = datetime.date.today()
+        key = (str(guild_id), period, stats.get_version(guild_id), today.isoformat())
+
+        png = self._cache.get(key)
+        if png is not None:
+            self._cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return png, True
+
+        # Share a render that is already running for the same chart
+        task = self._rendering.get(key)
+        if task is not None:
+            self.stats["hits"] += 1
+            return await asyncio.shield(task), True
+
+        self.stats["misses"] += 1
+        series = build_series(stats, guild_id, PERIOD_DAYS[period], today)
+        task = asyncio.create_task(self._render(key, series, PERIOD_DAYS[period]))
+        self._rendering[key] = task
+
+        return await asyncio.shield(task), False
+
+    async def _render(self, key, series, days):
+        """Render a chart in the process pool and cache it"""
+        self.start()
+        currency = config.UNBELIEVABOAT["CURRENCY_NAME"] if config else "Berries"
+        title = f"Outstanding debt and repayments - last {days} days"
+
+        started = time.perf_counter()
+        try:
+            png = await asyncio.get_running_loop().run_in_executor(
+                self._pool, render_chart, title, series["labels"], series["debt"], series["repaid"], currency
+            )
+        finally:
+            self._rendering.pop(key, None)
+
+        elapsed = time.perf_counter() - started
+        self.stats["renders"] += 1
+        self.stats["render_seconds"] += elapsed
+        self.stats["last_render"] = elapsed
+
+        # Older versions of the same chart will not be asked for again
+        guild_id, period = key[0], key[1]
+        for old_key in [k for k in self._cache if k[0] == guild_id and k[1] == period]:
+            del self._cache[old_key]
+
+        self._cache[key] = png
+        while len(self._cache) > self.settings["CACHE_SIZE"]:
+            self._cache.popitem(last=False)
+
+        logger.info(f"Rendered {period} loan chart for guild {guild_id} in {elapsed * 1000:.0f}ms")
+        return png
+
+    def get_stats(self):
+        """
+        Get renderer statistics
+        :return: Dict with cache hits, misses and hit rate, renders, average and last render time in seconds
+        """
+        requests = self.stats["hits"] + self.stats["misses"]
+        renders = self.stats["renders"]
+        return {
+            "hits": self.stats["hits"],
+            "misses": self.stats["misses"],
+            "hit_rate": self.stats["hits"] / requests if requests else 0.0,
+            "renders": renders,
+            "average_render": self.stats["render_seconds"] / renders if renders else 0.0,
+            "last_render": self.stats["last_render"],
+            "cached": len(self._cache)
+        }
@@ -0,0 +1,141 @@
+"""
+Loan Export
+
+This module streams a guild's loans, loan history and loan requests into a
+gzip-compressed CSV or JSON Lines file for /exportloans. A generator picks
+out the records that match the filters, and they are serialized CHUNK_SIZE
+at a time and compressed into a temporary file by a worker thread, so memory
+use stays flat however long the history is and the event loop gets control
+back between chunks.
+"""
+
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import itertools
+import logging
+
+from scheduling import to_timestamp
+from shared_store import encode_record
+
+logger = logging.getLogger("discord")
+
+# Collections exported, in order
+COLLECTIONS = ("loans", "history", "loan_requests")
+
+# Columns of the CSV export (JSON Lines exports every field)
+CSV_FIELDS = (
+    "collection",
+    "id",
+    "guild_id",
+    "user_id",
+    "user_name",
+    "status",
+    "amount",
+    "interest",
+    "late_fee",
+    "total_repayment",
+    "amount_repaid",
+    "days",
+    "request_date",
+    "approved_date",
+    "approved_by",
+    "due_date",
+    "repayment_date",
+    "denied_date",
+    "reason"
+)
+
+# Records serialized and written per chunk
+CHUNK_SIZE = 500
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+
+def iter_records(loan_database, guild_id, statuses=None, since=None, until=None):
+    """
+    Yield a guild's records that match the filters
+    :param loan_database: The bot's loan database dict
+    :param guild_id: The guild ID
+    :param statuses: Collection of statuses to include (None for all)
+    :param since: Earliest request date as a Unix timestamp (None for no limit)
+    :param until: Latest request date as a Unix timestamp (None for no limit)
+    :return: Generator of (collection, record)
+    """
+    guild_id = str(guild_id)
+
+    for collection in COLLECTIONS:
+        # Iterates the live list: records that move while exporting may be skipped
+        for record in loan_database.get(collection, []):
+            if not record or str(record.get("guild_id")) != guild_id:
+                continue
+            if statuses and record.get("status") not in statuses:
+                continue
+
+            if since is not None or until is not None:
+                requested = to_timestamp(record.get("request_date"))
+                if requested is None:
+                    continue
+                if since is not None and requested < since:
+                    continue
+                if until is not None and requested > until:
+                    continue
+
+            yield collection, record
+
+
+def _csv_value(value):
+    """Format a field for the CSV export"""
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def _serialize_chunk(chunk, export_format):
+    """Serialize a chunk of (collection, record) pairs to text"""
+    if export_format == "jsonl":
+        return "".join(encode_record({"collection": collection, **record}) + "\n" for collection, record in chunk)
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for collection, record in chunk:
+        row = dict(record, collection=collection)
+        writer.writerow([_csv_value(row.get(field)) for field in CSV_FIELDS])
+    return buffer.getvalue()
+
+
+async def write_export(path, records, export_format):
+    """
+    Write records to a gzip-compressed file, one chunk at a time
+    :param path: File to write
+    :param records: Iterable of (collection, record), e.g. from iter_records
+    :param export_format: "csv" or "jsonl"
+    :return: Number of records written
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+
+    count = 0
+    records = iter(records)
+
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as output:
+        if export_format == "csv":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerow(CSV_FIELDS)
+            output.write(buffer.getvalue())
+
+        while True:
+            chunk = list(itertools.islice(records, CHUNK_SIZE))
+            if not chunk:
+                break
+
+            text = _serialize_chunk(chunk, export_format)
+            await asyncio.to_thread(output.write, text)
+            count += len(chunk)
+
+    logger.info(f"Exported {count} loan records to {path}")
+    return count
@@ -0,0 +1,289 @@
+"""
+Loan Index
+
+This module keeps in-memory lookup tables over the loan database so that
+commands taking a loan_id (and their autocomplete callbacks) never have to
+scan every loan. Active loans are indexed by ID and by (guild, borrower),
+and pending loan requests by ID and by guild. The index holds references to
+the same dicts stored in bot.loan_database, so status changes made by the
+commands are seen immediately; entries whose status no longer matches are
+skipped and pruned lazily.
+"""
+
+import logging
+import time
+
+from discord import app_commands
+
+logger = logging.getLogger("discord")
+
+# Statuses of loans that can still receive payments
+ACTIVE_STATUSES = ("active", "active_partial")
+
+# Discord accepts at most 25 autocomplete choices
+MAX_CHOICES = 25
+
+# Seconds after a submitted loan request during which the same user's
+# further submissions in that guild are treated as duplicates (double taps)
+REQUEST_DEDUPE_SECONDS = 5
+
+
+class LoanIndex:
+    def __init__(self):
+        """Initialize an empty index"""
+        self.loans = {}              # loan_id -> active loan
+        self.user_loans = {}         # (guild_id, user_id) -> {loan_id: loan}
+        self.requests = {}           # (guild_id, loan_id) -> pending request
+        self.guild_requests = {}     # guild_id -> {loan_id: request}
+        self.user_requests = {}      # (guild_id, user_id) -> pending request
+        self.recent_submissions = {} # (guild_id, user_id) -> monotonic time of the last submission
+        self.loans_list = None
+        self.requests_list = None
+
+    def rebuild(self, loan_database):
+        """
+        Rebuild the index from the loan database
+        :param loan_database: The bot's loan database dict
+        """
+        self.loans.clear()
+        self.user_loans.clear()
+        self.requests.clear()
+        self.guild_requests.clear()
+        self.user_requests.clear()
+
+        self.loans_list = loan_database.setdefault("loans", [])
+        self.requests_list = loan_database.setdefault("loan_requests", [])
+
+        for loan in self.loans_list:
+            self.add_loan(loan)
+
+        for request in self.requests_list:
+            self.add_request(request)
+
+        logger.info(f"Loan index built: {len(self.loans)} active loans, {len(self.requests)} pending requests")
+
+    def is_stale(self, loan_database):
+        """Check if the database lists were replaced since the last rebuild"""
+        return (
+            self.loans_list is not loan_database.get("loans") or
+            self.requests_list is not loan_database.get("loan_requests")
+        )
+
+    def add_loan(self, loan):
+        """Index an active loan"""
+        if not loan or loan.get("status") not in ACTIVE_STATUSES:
+            return
+
+        loan_id = str(loan.get("id"))
+        self.loans[loan_id] = loan
+        self.user_loans.setdefault((str(loan.get("guild_id")), str(loan.get("user_id"))), {})[loan_id] = loan
+
+    def remove_loan(self, loan):
+        """Remove a loan from the index (e.g. once it is repaid)"""
+        if not loan:
+            return
+
+        loan_id = str(loan.get("id"))
+        if self.loans.get(loan_id) is loan:
+            del self.loans[loan_id]
+
+        key = (str(loan.get("guild_id")), str(loan.get("user_id")))
+        user_loans = self.user_loans.get(key)
+        if user_loans is not None:
+            if user_loans.get(loan_id) is loan:
+                del user_loans[loan_id]
+            if not user_loans:
+                del self.user_loans[key]
+
+    def add_request(self, request):
+        """Index a pending loan request"""
+        if not request or request.get("status") != "pending":
+            return
+
+        guild_id = str(request.get("guild_id"))
+        loan_id = str(request.get("id"))
+        self.requests[(guild_id, loan_id)] = request
+        self.guild_requests.setdefault(guild_id, {})[loan_id] = request
+        self.user_requests[(guild_id, str(request.get("user_id")))] = request
+
+    def remove_request(self, request):
+        """Remove a loan request from the index (e.g. once approved or denied)"""
+        if not request:
+            return
+
+        guild_id = str(request.get("guild_id"))
+        loan_id = str(request.get("id"))
+        if self.requests.get((guild_id, loan_id)) is request:
+            del self.requests[(guild_id, loan_id)]
+
+        guild_requests = self.guild_requests.get(guild_id)
+        if guild_requests is not None:
+            if guild_requests.get(loan_id) is request:
+                del guild_requests[loan_id]
+            if not guild_requests:
+                del self.guild_requests[guild_id]
+
+        user_key = (guild_id, str(request.get("user_id")))
+        if self.user_requests.get(user_key) is request:
+            del self.user_requests[user_key]
+
+    def get_loan(self, loan_id):
+        """
+        Get an active loan by ID
+        :param loan_id: The loan ID
+        :return: The loan dict, or None if there is no active loan with that ID
+        """
+        loan = self.loans.get(str(loan_id))
+        if loan is not None and loan.get("status") not in ACTIVE_STATUSES:
+            self.remove_loan(loan)
+            return None
+        return loan
+
+    def get_request(self, guild_id, loan_id):
+        """
+        Get a pending loan request of a guild by ID
+        :param guild_id: Discord guild ID
+        :param loan_id: The loan ID
+        :return: The request dict, or None if there is no pending request with that ID
+        """
+        request = self.requests.get((str(guild_id), str(loan_id)))
+        if request is not None and request.get("status") != "pending":
+            self.remove_request(request)
+            return None
+        return request
+
+    def get_outstanding(self, guild_id, user_id):
+        """
+        Get a user's outstanding loan or pending request in a guild. Partly
+        repaid installment loans (active_partial) are outstanding too, so they
+        block a new request like active loans do
+        :return: The active loan or pending request, or None
+        """
+        loans = self.get_user_loans(guild_id, user_id)
+        if loans:
+            return loans[0]
+
+        request = self.user_requests.get((str(guild_id), str(user_id)))
+        if request is not None and request.get("status") != "pending":
+            self.remove_request(request)
+            return None
+        return request
+
+    def try_add_request(self, loan_database, request, dedupe_seconds=REQUEST_DEDUPE_SECONDS):
+        """
+        Add a loan request unless the user already has an outstanding loan or
+        request in the guild, or submitted one within the dedupe window. The
+        check and insert run without awaiting, so they are atomic on the event loop
+        :param loan_database: The bot's loan database dict
+        :param request: The new pending request
+        :return: Tuple of (inserted, existing loan/request or None)
+        """
+        key = (str(request.get("guild_id")), str(request.get("user_id")))
+        now = time.monotonic()
+
+        existing = self.get_outstanding(*key)
+        if existing is not None:
+            return False, existing
+
+        last_submission = self.recent_submissions.get(key)
+        if last_submission is not None and now - last_submission < dedupe_seconds:
+            return False, None
+
+        loan_database.setdefault("loan_requests", []).append(request)
+        self.add_request(request)
+        self.recent_submissions[key] = now
+
+        # Forget old submissions now and then so the dict stays small
+        if len(self.recent_submissions) > 1000:
+            self.recent_submissions = {
+                user_key: submitted for user_key, submitted in self.recent_submissions.items()
+                if now - submitted < dedupe_seconds
+            }
+
+        return True, None
+
+    def discard_request(self, loan_database, request):
+        """Undo try_add_request (e.g. when the shared store rejected the request)"""
+        self.remove_request(request)
+
+        requests = loan_database.get("loan_requests", [])
+        for i in range(len(requests) - 1, -1, -1):
+            if requests[i] is request:
+                del requests[i]
+                break
+
+        self.recent_submissions.pop((str(request.get("guild_id")), str(request.get("user_id"))), None)
+
+    def get_user_loans(self, guild_id, user_id, prefix=""):
+        """
+        Get a user's active loans in a guild
+        :param prefix: Only return loans whose ID starts with this
+        :return: List of loan dicts
+        """
+        user_loans = self.user_loans.get((str(guild_id), str(user_id)), {})
+        return [
+            loan for loan_id, loan in user_loans.items()
+            if loan_id.startswith(prefix) and loan.get("status") in ACTIVE_STATUSES
+        ]
+
+    def get_guild_requests(self, guild_id, prefix="", limit=None):
+        """
+        Get a guild's pending loan requests, oldest first
+        :param prefix: Only return requests whose ID starts with this
+        :param limit: Maximum number of requests to return
+        :return: List of request dicts
+        """
+        result = []
+        stale = []
+
+        for loan_id, request in self.guild_requests.get(str(guild_id), {}).items():
+            if request.get("status") != "pending":
+                stale.append(request)
+                continue
+            if not loan_id.startswith(prefix):
+                continue
+            result.append(request)
+            if limit is not None and len(result) >= limit:
+                break
+
+        for request in stale:
+            self.remove_request(request)
+
+        return result
+
+
+def get_loan_index(bot):
+    """
+    Get the bot's loan index, (re)building it if missing or out of date
+    :param bot: The bot instance
+    :return: LoanIndex
+    """
+    index = getattr(bot, "loan_index", None)
+
+    if index is None:
+        index = LoanIndex()
+        bot.loan_index = index
+
+    if index.is_stale(bot.loan_database):
+        index.rebuild(bot.loan_database)
+
+    return index
+
+
+def build_choices(loans, currency_name):
+    """
+    Build autocomplete choices for a list of loans or loan requests
+    :param loans: List of loan dicts
+    :param currency_name: Currency name shown next to the amount
+    :return: List of app_commands.Choice (at most MAX_CHOICES)
+    """
+    choices = []
+
+    for loan in loans[:MAX_CHOICES]:
+        loan_id = str(loan.get("id"))
+        name = f"#{loan_id} - {loan.get('amount', 0):,} {currency_name}"
+        if loan.get("user_name") and loan.get("status") == "pending":
+            name += f" for {loan['user_name']}"
+        choices.append(app_commands.Choice(name=name[:100], value=loan_id))
+
+    return choices
@@ -0,0 +1,96 @@
+"""
+Loan Locks
+
+This module provides per-key asyncio locks so that work on the same loan
+(repay button and /repay, two admins approving the same request, an
+installment racing a repayment) runs one at a time, while unrelated loans
+never wait on each other. Locks are created on first use and kept in a
+WeakValueDictionary, so a loan's lock disappears as soon as nothing holds or
+waits on it. Time spent waiting for a lock is recorded for /botstats.
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+import weakref
+
+logger = logging.getLogger("discord")
+
+# Waits longer than this are logged
+SLOW_WAIT_SECONDS = 1.0
+
+
+class KeyedLockManager:
+    def __init__(self):
+        """Initialize the lock manager"""
+        self._locks = weakref.WeakValueDictionary()
+        self.stats = {
+            "acquired": 0,
+            "contended": 0,
+            "wait_total": 0.0,
+            "wait_max": 0.0
+        }
+
+    def _get_lock(self, key):
+        """Get the lock of a key, creating it if no one holds it"""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[key] = lock
+        return lock
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        """
+        Hold the lock of a key
+        :param key: Lock key, e.g. a loan ID
+        """
+        # The local reference keeps the lock alive while waiting and holding it
+        lock = self._get_lock(key)
+        contended = lock.locked()
+        started = time.monotonic()
+
+        async with lock:
+            self._record(key, contended, time.monotonic() - started)
+            yield
+
+    @contextlib.asynccontextmanager
+    async def hold_many(self, keys):
+        """
+        Hold the locks of several keys, taken in sorted order so two holders never deadlock
+        :param keys: Iterable of lock keys
+        """
+        async with contextlib.AsyncExitStack() as stack:
+            for key in sorted(set(keys)):
+                await stack.enter_async_context(self.hold(key))
+            yield
+
+    def _record(self, key, contended, wait_time):
+        """Record how long an acquisition waited"""
+        self.stats["acquired"] += 1
+        if contended:
+            self.stats["contended"] += 1
+            self.stats["wait_total"] += wait_time
+            self.stats["wait_max"] = max(self.stats["wait_max"], wait_time)
+
+            if wait_time >= SLOW_WAIT_SECONDS:
+                logger.warning(f"Waited {wait_time:.2f}s for the lock of {key}")
+
+    def get_stats(self):
+        """
+        Get lock contention statistics
+        :return: Dict with acquired and contended counts, avg/max contended wait in seconds and live locks
+        """
+        contended = self.stats["contended"]
+        return {
+            "acquired": self.stats["acquired"],
+            "contended": contended,
+            "wait_avg": self.stats["wait_total"] / contended if contended else 0.0,
+            "wait_max": self.stats["wait_max"],
+            "active": len(self._locks)
+        }
+
+
+# Shared lock manager for all loan mutations in this process
+loan_locks = KeyedLockManager()
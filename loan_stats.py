@@ -0,0 +1,583 @@
+"""
+Loan Statistics
+
+This module keeps running per-(guild, user) loan aggregates (loans taken and
+repaid, on-time and late repayments, totals borrowed and repaid, interest,
+late fees, current debt) and per-guild totals of the same figures plus the
+number of borrowers, so /credit and /loanstats read them in constant time
+instead of filtering the whole loan history.
+
+Every loan record contributes fixed amounts to its borrower's aggregates: an
+active loan in `loans` counts as taken and adds its remaining balance to the
+debt (so does a loan waiting for a manual repayment, which is still owed),
+a repaid loan in `history` counts as taken and repaid. A change to a
+record is applied as the difference between its contribution before and
+after, which UnitOfWork computes and writes to the shared store together with
+the change itself. The aggregates live in loan_database["user_stats"], so the
+JSON backup saves them too, and verify() recomputes them from the raw records.
+The guild totals are derived from the user aggregates when they are loaded
+and then move with every delta applied to them.
+
+For trends, each guild also has daily buckets in loan_database["daily_stats"]
+that are maintained the same way: a loan counts towards the day it was
+approved, the day it is due (and whether it went overdue), the day a late fee
+was charged, the day of each installment payment (from the loan's payments
+log) and the day it was repaid. A query over the last 7, 30 or 90 days adds up at most that many
+buckets, however many loans fall in the window.
+"""
+
+import datetime
+import logging
+
+from loan_index import ACTIVE_STATUSES
+from scheduling import to_timestamp
+
+logger = logging.getLogger("discord")
+
+USER_STAT_FIELDS = (
+    "loans_taken",
+    "loans_repaid",
+    "active_loans",
+    "on_time",
+    "late",
+    "total_borrowed",
+    "total_repaid",
+    "interest_paid",
+    "late_fees_paid",
+    "current_debt"
+)
+
+# Extra guild totals: users who ever borrowed, and users with an active loan
+GUILD_STAT_FIELDS = USER_STAT_FIELDS + ("borrowers", "active_borrowers")
+
+DAILY_STAT_FIELDS = (
+    "loans_created",    # Approved that day
+    "amount_lent",
+    "amount_owed",      # Total repayment (before late fees) of the loans approved that day
+    "late_fees_charged",  # Late fees added to loans that day
+    "loans_due",        # Due that day
+    "defaulted",        # Due that day and went overdue
+    "loans_repaid",     # Repaid that day
+    "on_time",
+    "late",
+    "amount_repaid",    # Installment payments and final repayments made that day
+    "interest_paid",
+    "late_fees_paid",
+    "repay_seconds"     # Total time from approval to repayment
+)
+
+# Loan statuses that still count as borrowed and owed: the active ones, and
+# loans whose manual repayment an admin has not completed yet
+OUTSTANDING_STATUSES = ACTIVE_STATUSES + ("manual_repayment",)
+
+# Periods offered by /loanstats, in days
+PERIOD_DAYS = {"7d": 7, "30d": 30, "90d": 90}
+
+
+def repaid_on_time(loan):
+    """Check if a repaid loan was repaid by its due date"""
+    if "repayment_on_time" in loan:
+        return bool(loan["repayment_on_time"])
+
+    repaid_at = to_timestamp(loan.get("repayment_date") or loan.get("repaid_date"))
+    due_at = to_timestamp(loan.get("due_date"))
+    if repaid_at is None or due_at is None:
+        return True
+    return repaid_at <= due_at
+
+
+def to_day(value):
+    """Get the local day of a datetime (or ISO string) as "YYYY-MM-DD" (None if it is neither)"""
+    timestamp = to_timestamp(value)
+    if timestamp is None:
+        return None
+    return datetime.date.fromtimestamp(timestamp).isoformat()
+
+
+def loan_contribution(collection, loan):
+    """
+    Get what a loan record adds to its borrower's aggregates
+    :param collection: "loans" or "history"
+    :param loan: The loan record (None contributes nothing)
+    :return: Dict of stat field to value
+    """
+    if not loan:
+        return {}
+
+    status = loan.get("status")
+    amount = loan.get("amount", 0)
+
+    if collection == "loans" and status in OUTSTANDING_STATUSES:
+        return {
+            "loans_taken": 1,
+            "active_loans": 1,
+            "total_borrowed": amount,
+            "current_debt": loan.get("total_repayment", 0) - loan.get("amount_repaid", 0)
+        }
+
+    if collection == "history" and status == "repaid":
+        on_time = repaid_on_time(loan)
+        return {
+            "loans_taken": 1,
+            "loans_repaid": 1,
+            "on_time": 1 if on_time else 0,
+            "late": 0 if on_time else 1,
+            "total_borrowed": amount,
+            "total_repaid": loan.get("total_repayment", 0),
+            "interest_paid": loan.get("interest", 0),
+            "late_fees_paid": loan.get("late_fee", 0)
+        }
+
+    return {}
+
+
+def _add_to_bucket(buckets, day, fields):
+    """Add stat values to a day's bucket (skipped if the day is unknown)"""
+    if day is None:
+        return
+    bucket = buckets.setdefault(day, {})
+    for field, value in fields.items():
+        bucket[field] = bucket.get(field, 0) + value
+
+
+def loan_daily_contribution(collection, loan):
+    """
+    Get what a loan record adds to its guild's daily buckets
+    :param collection: "loans" or "history"
+    :param loan: The loan record (None contributes nothing)
+    :return: Dict of day to {daily stat field: value}
+    """
+    if not loan:
+        return {}
+
+    status = loan.get("status")
+    repaid = collection == "history" and status == "repaid"
+    if not repaid and not (collection == "loans" and status in OUTSTANDING_STATUSES):
+        return {}
+
+    created = loan.get("approved_date") or loan.get("request_date")
+    on_time = repaid_on_time(loan) if repaid else True
+    late_fee = loan.get("late_fee", 0) if loan.get("late_fee_applied", False) else 0
+    buckets = {}
+
+    _add_to_bucket(buckets, to_day(created), {
+        "loans_created": 1,
+        "amount_lent": loan.get("amount", 0),
+        "amount_owed": loan.get("total_repayment", 0) - late_fee
+    })
+    _add_to_bucket(buckets, to_day(loan.get("due_date")), {
+        "loans_due": 1,
+        "defaulted": 1 if loan.get("overdue_penalty_applied", False) or not on_time else 0
+    })
+
+    # Loans from before late_fee_date was recorded were charged around their due date
+    if late_fee:
+        _add_to_bucket(buckets, to_day(loan.get("late_fee_date") or loan.get("due_date")), {
+            "late_fees_charged": late_fee
+        })
+
+    # Installment payments count on the day they were made
+    logged = 0
+    for payment in loan.get("payments") or ():
+        _add_to_bucket(buckets, to_day(payment.get("date")), {"amount_repaid": payment.get("amount", 0)})
+        logged += payment.get("amount", 0)
+
+    # Payments made before the log existed count on the last payment day
+    unlogged = loan.get("amount_repaid", 0) - logged
+    if not repaid and unlogged > 0:
+        _add_to_bucket(buckets, to_day(loan.get("last_payment_date")), {"amount_repaid": unlogged})
+
+    if repaid:
+        repaid_at = loan.get("repayment_date") or loan.get("repaid_date")
+        created_at = to_timestamp(created)
+        repaid_ts = to_timestamp(repaid_at)
+        _add_to_bucket(buckets, to_day(repaid_at), {
+            "loans_repaid": 1,
+            "on_time": 1 if on_time else 0,
+            "late": 0 if on_time else 1,
+            "amount_repaid": loan.get("total_repayment", 0) - logged,
+            "interest_paid": loan.get("interest", 0),
+            "late_fees_paid": loan.get("late_fee", 0),
+            "repay_seconds": round(max(0, repaid_ts - created_at)) if created_at and repaid_ts else 0
+        })
+
+    return buckets
+
+
+def _user_contributions(collection, record):
+    """Get a record's contribution keyed by (guild_id, user_id)"""
+    contribution = loan_contribution(collection, record)
+    if not contribution:
+        return {}
+    return {(str(record.get("guild_id")), str(record.get("user_id"))): contribution}
+
+
+def _daily_contributions(collection, record):
+    """Get a record's contributions keyed by (guild_id, day)"""
+    buckets = loan_daily_contribution(collection, record)
+    return {(str(record.get("guild_id")), day): bucket for day, bucket in buckets.items()}
+
+
+def _sum_contributions(changes, contributions):
+    """Add up the contributions removed (before) and added (after) by each change"""
+    deltas = {}
+
+    for collection, before, after in changes:
+        for record, sign in ((before, -1), (after, 1)):
+            for key, contribution in contributions(collection, record).items():
+                delta = deltas.setdefault(key, {})
+                for field, value in contribution.items():
+                    delta[field] = delta.get(field, 0) + sign * value
+
+    # Drop changes that cancel out
+    for key in list(deltas):
+        deltas[key] = {field: value for field, value in deltas[key].items() if value}
+        if not deltas[key]:
+            del deltas[key]
+
+    return deltas
+
+
+def compute_deltas(changes):
+    """
+    Work out how a set of record changes moves the aggregates
+    :param changes: List of (collection, record before or None, record after or None)
+    :return: Dict of (guild_id, user_id) to {stat field: change}
+    """
+    return _sum_contributions(changes, _user_contributions)
+
+
+def compute_daily_deltas(changes):
+    """
+    Work out how a set of record changes moves the daily buckets
+    :param changes: List of (collection, record before or None, record after or None)
+    :return: Dict of (guild_id, day) to {daily stat field: change}
+    """
+    return _sum_contributions(changes, _daily_contributions)
+
+
+class LoanStats:
+    def __init__(self):
+        """Initialize empty aggregates"""
+        self.users = {}   # guild_id -> {user_id: {stat field: value}}
+        self.guilds = {}  # guild_id -> {guild stat field: total}
+        self.days = {}    # guild_id -> {day: {daily stat field: value}}
+        self.versions = {}  # guild_id -> number of changes to the guild's statistics
+        self.generation = 0  # Number of times the statistics were (re)loaded
+
+    def rebuild(self, loan_database):
+        """
+        Recompute the aggregates from the raw loan records
+        :param loan_database: The bot's loan database dict
+        """
+        self.users = self._compute(loan_database)
+        self.guilds = self._compute_guilds(self.users)
+        self.days = self._compute_days(loan_database)
+        self.generation += 1
+        loan_database["user_stats"] = self.users
+        loan_database["daily_stats"] = self.days
+        logger.info(f"Loan statistics rebuilt for {sum(len(users) for users in self.users.values())} borrowers")
+
+    def load(self, loan_database):
+        """
+        Use the aggregates saved with the loan database, or rebuild them if there are none
+        :param loan_database: The bot's loan database dict
+        """
+        has_loans = bool(loan_database.get("loans") or loan_database.get("history"))
+        users = loan_database.get("user_stats")
+        days = loan_database.get("daily_stats")
+
+        # Backups from before the aggregates (or the daily buckets) existed are rebuilt
+        if (isinstance(users, dict) and (users or not has_loans)
+                and isinstance(days, dict) and (days or not has_loans)):
+            self.users = users
+            self.guilds = self._compute_guilds(users)
+            self.days = days
+            self.generation += 1
+        else:
+            self.rebuild(loan_database)
+
+    def is_stale(self, loan_database):
+        """Check if the aggregates belong to a different database dict"""
+        return loan_database.get("user_stats") is not self.users or loan_database.get("daily_stats") is not self.days
+
+    @staticmethod
+    def _raw_records(loan_database):
+        """Get every loan record as an addition, for recomputing from scratch"""
+        changes = [("loans", None, loan) for loan in loan_database.get("loans", [])]
+        changes += [("history", None, loan) for loan in loan_database.get("history", [])]
+        return changes
+
+    def _compute(self, loan_database):
+        """Compute fresh aggregates from the raw loan records"""
+        users = {}
+        for (guild_id, user_id), delta in compute_deltas(self._raw_records(loan_database)).items():
+            users.setdefault(guild_id, {})[user_id] = delta
+        return users
+
+    def _compute_days(self, loan_database):
+        """Compute fresh daily buckets from the raw loan records"""
+        days = {}
+        for (guild_id, day), delta in compute_daily_deltas(self._raw_records(loan_database)).items():
+            days.setdefault(guild_id, {})[day] = delta
+        return days
+
+    def _compute_guilds(self, users):
+        """Total the user aggregates of each guild"""
+        guilds = {}
+        for guild_id, guild_users in users.items():
+            totals = guilds.setdefault(guild_id, {})
+            for stats in guild_users.values():
+                self._add_to_guild(totals, {}, stats, stats)
+        return guilds
+
+    @staticmethod
+    def _add_to_guild(totals, before, after, delta):
+        """Move a guild's totals by a user's aggregate change"""
+        for field, value in delta.items():
+            totals[field] = totals.get(field, 0) + value
+
+        for field, counter in (("loans_taken", "borrowers"), ("active_loans", "active_borrowers")):
+            change = (after.get(field, 0) > 0) - (before.get(field, 0) > 0)
+            if change:
+                totals[counter] = totals.get(counter, 0) + change
+
+    def get_user(self, guild_id, user_id):
+        """
+        Get a user's aggregates in a guild
+        :return: Dict with every stat field (0 if the user never borrowed)
+        """
+        stats = self.users.get(str(guild_id), {}).get(str(user_id), {})
+        return {field: stats.get(field, 0) for field in USER_STAT_FIELDS}
+
+    def get_guild(self, guild_id):
+        """
+        Get the totals of a guild
+        :return: Dict with every guild stat field (0 if nobody borrowed there)
+        """
+        totals = self.guilds.get(str(guild_id), {})
+        return {field: totals.get(field, 0) for field in GUILD_STAT_FIELDS}
+
+    def get_version(self, guild_id):
+        """Get a value that changes whenever a guild's statistics change (e.g. for caching)"""
+        return self.generation, self.versions.get(str(guild_id), 0)
+
+    def _changed(self, guild_id):
+        """Bump a guild's version"""
+        self.versions[guild_id] = self.versions.get(guild_id, 0) + 1
+
+    def get_daily(self, guild_id, days, today=None):
+        """
+        Get a guild's daily buckets over a period
+        :param guild_id: The guild ID
+        :param days: Number of days, ending today
+        :param today: The last day of the period (defaults to today)
+        :return: List of (date, bucket dict) from the oldest day, with empty dicts for days without loans
+        """
+        if today is None:
+            today = datetime.date.today()
+
+        buckets = self.days.get(str(guild_id), {})
+        dates = [today - datetime.timedelta(days=offset) for offset in range(days - 1, -1, -1)]
+        return [(date, buckets.get(date.isoformat(), {})) for date in dates]
+
+    def get_period(self, guild_id, days, today=None):
+        """
+        Get the totals of a guild's daily buckets over a period
+        :param guild_id: The guild ID
+        :param days: Number of days, ending today
+        :param today: The last day of the period (defaults to today)
+        :return: Dict with every daily stat field
+        """
+        totals = {field: 0 for field in DAILY_STAT_FIELDS}
+
+        for date, bucket in self.get_daily(guild_id, days, today):
+            for field, value in bucket.items():
+                totals[field] = totals.get(field, 0) + value
+
+        return totals
+
+    def apply(self, deltas, daily_deltas=None):
+        """
+        Apply aggregate changes
+        :param deltas: Dict of (guild_id, user_id) to {stat field: change}
+        :param daily_deltas: Dict of (guild_id, day) to {daily stat field: change}
+        """
+        for (guild_id, user_id), delta in deltas.items():
+            stats = self.users.setdefault(guild_id, {}).setdefault(user_id, {})
+            before = dict(stats)
+            for field, value in delta.items():
+                stats[field] = stats.get(field, 0) + value
+
+            self._add_to_guild(self.guilds.setdefault(guild_id, {}), before, stats, delta)
+            self._changed(guild_id)
+
+        for (guild_id, day), delta in (daily_deltas or {}).items():
+            buckets = self.days.setdefault(guild_id, {})
+            bucket = buckets.setdefault(day, {})
+            for field, value in delta.items():
+                bucket[field] = bucket.get(field, 0) + value
+
+            # Keep the buckets compact
+            for field in [field for field, value in bucket.items() if not value]:
+                del bucket[field]
+            if not bucket:
+                del buckets[day]
+            self._changed(guild_id)
+
+    def set_user(self, guild_id, user_id, stats):
+        """Replace a user's aggregates (e.g. with the copy in the shared store)"""
+        guild_id = str(guild_id)
+        before = self.users.setdefault(guild_id, {}).get(str(user_id), {})
+        delta = {
+            field: stats.get(field, 0) - before.get(field, 0)
+            for field in set(before) | set(stats)
+            if stats.get(field, 0) != before.get(field, 0)
+        }
+
+        self.users[guild_id][str(user_id)] = dict(stats)
+        self._add_to_guild(self.guilds.setdefault(guild_id, {}), before, stats, delta)
+        self._changed(guild_id)
+
+    def set_day(self, guild_id, day, stats):
+        """Replace a guild's bucket for a day"""
+        buckets = self.days.setdefault(str(guild_id), {})
+        if stats:
+            buckets[day] = dict(stats)
+        else:
+            buckets.pop(day, None)
+        self._changed(str(guild_id))
+
+    def snapshot(self, loan_database):
+        """
+        Capture what compute_expected needs, so it can run in a worker thread
+        while the event loop keeps changing the loans
+        :param loan_database: The bot's loan database dict
+        :return: Snapshot dict with shallow copies of the loan and history records
+        """
+        return {
+            "loans": [dict(loan) for loan in loan_database.get("loans", [])],
+            "history": [dict(record) for record in loan_database.get("history", [])],
+            "generation": self.generation,
+            "versions": dict(self.versions)
+        }
+
+    def compute_expected(self, snapshot):
+        """
+        Recompute the aggregates and daily buckets from a snapshot's records
+        (reads nothing else, so it is safe to run in a worker thread)
+        :return: Tuple of (user aggregates, daily buckets)
+        """
+        return self._compute(snapshot), self._compute_days(snapshot)
+
+    def changed_since(self, snapshot):
+        """
+        Get the guilds whose statistics changed after a snapshot was taken
+        :return: Set of guild IDs, or None if the statistics were reloaded
+        """
+        if snapshot["generation"] != self.generation:
+            return None
+        before = snapshot["versions"]
+        return {guild_id for guild_id, version in self.versions.items() if before.get(guild_id) != version}
+
+    def verify(self, loan_database, expected=None):
+        """
+        Compare the aggregates with a recomputation from the raw loan records
+        :param loan_database: The bot's loan database dict
+        :param expected: Precomputed user aggregates (see compute_expected)
+        :return: List of (guild_id, user_id, current aggregates, expected aggregates) that differ
+        """
+        if expected is None:
+            expected = self._compute(loan_database)
+        mismatches = []
+
+        for guild_id in set(self.users) | set(expected):
+            current_users = self.users.get(guild_id, {})
+            expected_users = expected.get(guild_id, {})
+
+            for user_id in set(current_users) | set(expected_users):
+                current = {field: value for field, value in current_users.get(user_id, {}).items() if value}
+                wanted = expected_users.get(user_id, {})
+                if current != wanted:
+                    mismatches.append((guild_id, user_id, current, wanted))
+
+        return mismatches
+
+    def verify_days(self, loan_database, expected=None):
+        """
+        Compare the daily buckets with a recomputation from the raw loan records
+        :param loan_database: The bot's loan database dict
+        :param expected: Precomputed daily buckets (see compute_expected)
+        :return: List of (guild_id, day, current bucket, expected bucket) that differ
+        """
+        if expected is None:
+            expected = self._compute_days(loan_database)
+        mismatches = []
+
+        for guild_id in set(self.days) | set(expected):
+            current_days = self.days.get(guild_id, {})
+            expected_days = expected.get(guild_id, {})
+
+            for day in set(current_days) | set(expected_days):
+                current = {field: value for field, value in current_days.get(day, {}).items() if value}
+                wanted = expected_days.get(day, {})
+                if current != wanted:
+                    mismatches.append((guild_id, day, current, wanted))
+
+        return mismatches
+
+    def reconcile(self, loan_database, expected=None, skip_guilds=()):
+        """
+        Fix aggregates, guild totals and daily buckets that drifted from the raw loan records
+        :param expected: Precomputed (user aggregates, daily buckets) from compute_expected
+        :param skip_guilds: Guilds left alone, e.g. because they changed after the snapshot
+        :return: Tuple of (list of (guild_id, user_id, corrected aggregates),
+                 list of (guild_id, day, corrected bucket))
+        """
+        expected_users, expected_days = expected if expected is not None else (None, None)
+
+        fixed = []
+        for guild_id, user_id, current, wanted in self.verify(loan_database, expected_users):
+            if guild_id in skip_guilds:
+                continue
+            logger.warning(f"Loan statistics of user {user_id} in guild {guild_id} were {current}, expected {wanted}")
+            self.set_user(guild_id, user_id, wanted)
+            fixed.append((guild_id, user_id, wanted))
+
+        # The guild totals only depend on the user aggregates
+        guilds = self._compute_guilds(self.users)
+        for guild_id in set(self.guilds) | set(guilds):
+            current = {field: value for field, value in self.guilds.get(guild_id, {}).items() if value}
+            wanted = {field: value for field, value in guilds.get(guild_id, {}).items() if value}
+            if current != wanted:
+                logger.warning(f"Loan statistics totals of guild {guild_id} drifted and were recomputed")
+                self._changed(guild_id)
+        self.guilds = guilds
+
+        fixed_days = []
+        for guild_id, day, current, wanted in self.verify_days(loan_database, expected_days):
+            if guild_id in skip_guilds:
+                continue
+            logger.warning(f"Daily loan statistics of guild {guild_id} on {day} were {current}, expected {wanted}")
+            self.set_day(guild_id, day, wanted)
+            fixed_days.append((guild_id, day, wanted))
+
+        return fixed, fixed_days
+
+
+def get_loan_stats(bot):
+    """
+    Get the bot's loan statistics, loading them if missing or out of date
+    :param bot: The bot instance
+    :return: LoanStats
+    """
+    stats = getattr(bot, "loan_stats", None)
+
+    if stats is None:
+        stats = LoanStats()
+        bot.loan_stats = stats
+
+    if stats.is_stale(bot.loan_database):
+        stats.load(bot.loan_database)
+
+    return stats
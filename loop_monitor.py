@@ -0,0 +1,170 @@
+"""
+Event Loop Monitor
+
+This module watches the bot's event loop for blocking work. A task on the
+loop wakes up every INTERVAL seconds and records how late it woke (the loop
+lag) for /metrics and /looplag. A watchdog thread checks that those wake-ups
+keep happening; when the loop has not run for SLOW_THRESHOLD seconds it is
+stuck in a callback, so the watchdog captures the loop thread's stack and the
+command its current task is handling. The slow callback is recorded (with
+how long it blocked) once the loop gets going again.
+"""
+
+import asyncio
+import collections
+import logging
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+try:
+    import config
+except ModuleNotFoundError:
+    config = None
+
+logger = logging.getLogger("discord")
+
+# Defaults used when config.LOOP_MONITOR is missing or incomplete
+DEFAULT_LOOP_MONITOR_SETTINGS = {
+    "ENABLED": True,
+    "INTERVAL": 0.25,        # Seconds between lag samples
+    "SLOW_THRESHOLD": 0.5,   # Seconds the loop may be blocked before the callback is reported
+    "HISTORY": 20            # Slow callbacks kept for /looplag
+}
+
+# Lag samples kept for the recent average and maximum
+LAG_WINDOW = 240
+
+# Stack frames kept per slow callback
+STACK_LIMIT = 12
+
+
+def get_loop_monitor_settings():
+    """
+    Get the loop monitor settings merged with defaults
+    :return: Dict of loop monitor settings
+    """
+    settings = dict(DEFAULT_LOOP_MONITOR_SETTINGS)
+    settings.update(getattr(config, "LOOP_MONITOR", {}) or {})
+    return settings
+
+
+class LoopMonitor:
+    def __init__(self, settings=None):
+        """
+        Initialize the monitor
+        :param settings: Loop monitor settings (defaults to get_loop_monitor_settings())
+        """
+        settings = settings or get_loop_monitor_settings()
+        self.enabled = bool(settings["ENABLED"])
+        self.interval = float(settings["INTERVAL"])
+        self.slow_threshold = float(settings["SLOW_THRESHOLD"])
+
+        self.lags = collections.deque(maxlen=LAG_WINDOW)
+        self.slow_callbacks = collections.deque(maxlen=int(settings["HISTORY"]))
+        self.slow_count = 0
+
+        self._loop = None
+        self._loop_thread_id = None
+        self._heartbeat = None
+        self._stall = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start sampling on the running event loop and start the watchdog thread"""
+        if not self.enabled or self._task is not None:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+
+        self._task = asyncio.create_task(self._sample())
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+
+        logger.info(f"Event loop monitor started (sampling every {self.interval}s, slow callback threshold {self.slow_threshold}s)")
+
+    def stop(self):
+        """Stop sampling and the watchdog thread"""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=self.slow_threshold)
+            self._thread = None
+
+    async def _sample(self):
+        """Record how late each wake-up is, and finish stalls the watchdog caught"""
+        loop = asyncio.get_running_loop()
+
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+
+            lag = max(0.0, loop.time() - expected)
+            self._heartbeat = time.monotonic()
+            self.lags.append(lag)
+            metrics.LOOP_LAG_SECONDS.observe(lag)
+
+            stall = self._stall
+            if stall is not None:
+                self._stall = None
+                self._record_stall(stall, lag)
+
+    def _watch(self):
+        """Watchdog thread: capture what the loop is running when it stops waking up"""
+        while not self._stopped.wait(self.slow_threshold / 2):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+
+            # One capture per stall: the sampler clears it when the loop runs again
+            if blocked < self.slow_threshold or self._stall is not None:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            task = asyncio.current_task(self._loop)
+            self._stall = {
+                "started": time.time() - blocked,
+                "task": task.get_name() if task is not None else None,
+                "command": metrics.get_task_label(task),
+                "stack": "".join(traceback.format_stack(frame, limit=STACK_LIMIT)) if frame is not None else ""
+            }
+
+    def _record_stall(self, stall, lag):
+        """Record a slow callback once the loop runs again"""
+        stall["duration"] = lag
+        self.slow_callbacks.append(stall)
+        self.slow_count += 1
+
+        command = stall["command"] or "unknown"
+        metrics.SLOW_CALLBACKS.inc(command)
+        logger.warning(
+            f"Event loop blocked for {stall['duration']:.2f}s or more "
+            f"(task {stall['task']}, command {command}):\n{stall['stack']}"
+        )
+
+    def get_stats(self):
+        """
+        Get lag statistics over the recent samples
+        :return: Dict with current, average and maximum lag in seconds, the
+                 number of slow callbacks and the recent ones (newest first)
+        """
+        lags = list(self.lags)
+        return {
+            "enabled": self.enabled,
+            "current": lags[-1] if lags else 0.0,
+            "average": sum(lags) / len(lags) if lags else 0.0,
+            "max": max(lags) if lags else 0.0,
+            "window": len(lags) * self.interval,
+            "slow_count": self.slow_count,
+            "slow_threshold": self.slow_threshold,
+            "recent": list(reversed(self.slow_callbacks))
+        }
@@ -8,17 +8,33 @@ UnbelievaBoat currency transfers when direct API access is not available.
 import discord
 import config
 
+from guild_admin_cache import admin_cache
 
-def format_receive_loan_instructions(loan, user, guild):
+
+async def find_server_admin_id(guild):
+    """
+    Find a server administrator to mention in manual instructions.
+    The guild's admins and approvers are looked up once and then served
+    from the admin cache, which member and role update events keep current.
+    :param guild: The Discord guild object
+    :return: Member ID of an administrator or approver, or the guild owner's ID as fallback
+    """
+    await admin_cache.ensure(guild)
+    return admin_cache.get_admin_id(guild)
+
+
+def format_receive_loan_instructions(loan, user, guild, admin_id=None):
     """
     Formats a message with step-by-step instructions for receiving a loan
     :param loan: The loan object
     :param user: The Discord user object
     :param guild: The Discord guild object
+    :param admin_id: ID of the admin to mention (from find_server_admin_id)
     :return: Discord embed with instructions
     """
-    # Find a server admin if possible
-    server_admin = next((member for member in guild.members if member.guild_permissions.administrator), None)
+    # Use the cached admin if none was looked up
+    if admin_id is None:
+        admin_id = admin_cache.get_admin_id(guild)
 
     embed = discord.Embed(
         title="🏦 Loan Disbursement Instructions",
@@ -26,7 +42,7 @@ def format_receive_loan_instructions(loan, user, guild):
         color=0x0099FF
     )
     
-    admin_mention = f"<@{server_admin.id}>" if server_admin else "an admin"
+    admin_mention = f"<@{admin_id}>" if admin_id else "an admin"
     embed.add_field(
         name="1. Wait for Admin",
         value=f"Ask {admin_mention} to run this command:",
@@ -0,0 +1,349 @@
+"""
+Metrics
+
+This module keeps a small in-process metrics registry (counters, gauges and
+histograms with labels) and renders it in the Prometheus text format for the
+/metrics endpoint of the health server. Recording a value is a dict lookup
+and a few additions, so instrumenting hot paths costs next to nothing; values
+that are cheap to read but change constantly (such as database sizes) are
+read by callback only when metrics are scraped.
+"""
+
+import asyncio
+import bisect
+import functools
+import logging
+import re
+import time
+import weakref
+
+import aiohttp
+from discord import app_commands
+import discord
+
+logger = logging.getLogger("discord")
+
+# Histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_value(value):
+    """Format a sample value"""
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    """Escape a label value"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    """Format a label set, e.g. {command="loan",status="ok"}"""
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    type_name = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        """
+        Initialize the metric
+        :param name: Metric name
+        :param documentation: Help text
+        :param labels: Label names
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+
+    def _samples(self):
+        """Yield (suffix, label values, extra label, value) for every sample"""
+        for label_values, value in self._values.items():
+            yield "", label_values, None, value
+
+    def render(self):
+        """Render the metric in the Prometheus text format"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}"
+        ]
+        for suffix, label_values, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.label_names, label_values, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, *label_values, amount=1):
+        """
+        Increase the counter
+        :param label_values: Values of the labels, in order
+        :param amount: Amount to add
+        """
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, labels=(), callback=None):
+        """
+        Initialize the gauge
+        :param callback: Function returning a dict of label values tuple to value, called when scraped
+        """
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def set(self, value, *label_values):
+        """
+        Set the gauge
+        :param value: New value
+        :param label_values: Values of the labels, in order
+        """
+        self._values[label_values] = value
+
+    def _samples(self):
+        """Yield the samples, read from the callback if there is one"""
+        values = self._values
+        if self.callback is not None:
+            try:
+                values = self.callback()
+            except Exception as e:
+                logger.error(f"Error reading metric {self.name}: {e}")
+                values = {}
+
+        for label_values, value in values.items():
+            yield "", label_values, None, value
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """
+        Initialize the histogram
+        :param buckets: Upper bounds of the buckets, ascending
+        """
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        """
+        Record an observation
+        :param value: Observed value, e.g. seconds
+        :param label_values: Values of the labels, in order
+        """
+        entry = self._values.get(label_values)
+        if entry is None:
+            # Bucket counts (plus +Inf), sum
+            entry = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def _samples(self):
+        """Yield cumulative buckets, sum and count per label set"""
+        for label_values, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", label_values, ("le", _format_value(float(bound))), cumulative
+            yield "_sum", label_values, None, total
+            yield "_count", label_values, None, cumulative
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """Initialize an empty registry"""
+        self.metrics = {}
+
+    def _register(self, metric):
+        """Add a metric, or return the existing one of the same name"""
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        """Get or create a counter"""
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), callback=None):
+        """Get or create a gauge (read from callback when scraped, if given)"""
+        return self._register(Gauge(name, documentation, labels, callback))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        """Get or create a histogram"""
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text format
+        :return: Exposition text
+        """
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+# Shared registry exported by the health server
+registry = MetricsRegistry()
+
+COMMAND_SECONDS = registry.histogram(
+    "loanbot_command_duration_seconds",
+    "Time spent handling slash commands",
+    labels=("command", "status")
+)
+BUTTON_SECONDS = registry.histogram(
+    "loanbot_button_duration_seconds",
+    "Time spent handling button interactions",
+    labels=("button", "status")
+)
+QUEUE_WAIT_SECONDS = registry.histogram(
+    "loanbot_command_queue_wait_seconds",
+    "Time queued commands waited for a worker",
+    labels=("command",)
+)
+QUEUE_RUN_SECONDS = registry.histogram(
+    "loanbot_command_queue_run_seconds",
+    "Time queued commands ran on a worker",
+    labels=("command",)
+)
+API_SECONDS = registry.histogram(
+    "loanbot_unbelievaboat_request_duration_seconds",
+    "UnbelievaBoat API request latency",
+    labels=("method", "endpoint", "status")
+)
+BACKUP_SECONDS = registry.histogram(
+    "loanbot_backup_duration_seconds",
+    "Time spent writing database backups",
+    labels=("kind",)
+)
+LOOP_LAG_SECONDS = registry.histogram(
+    "loanbot_event_loop_lag_seconds",
+    "How late the event loop ran a scheduled callback",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+SLOW_CALLBACKS = registry.counter(
+    "loanbot_slow_callbacks_total",
+    "Times the event loop was blocked longer than the slow callback threshold",
+    labels=("command",)
+)
+
+# What each task is handling (e.g. "/loan"), so a blocked event loop can be traced to a command
+_task_labels = weakref.WeakKeyDictionary()
+
+
+def label_current_task(label):
+    """
+    Record what the current task is handling
+    :param label: Short description, e.g. "/loan" or "button repay"
+    """
+    task = asyncio.current_task()
+    if task is not None:
+        _task_labels[task] = label
+
+
+def get_task_label(task):
+    """
+    Get what a task is handling
+    :param task: asyncio task (or None)
+    :return: Label given with label_current_task, or None
+    """
+    if task is None:
+        return None
+    return _task_labels.get(task)
+
+
+class CommandTimingTree(app_commands.CommandTree):
+    """Command tree that records how long each slash command takes"""
+
+    async def interaction_check(self, interaction):
+        interaction.extras["started_at"] = time.perf_counter()
+        if interaction.command is not None:
+            label_current_task(f"/{interaction.command.qualified_name}")
+        return True
+
+    async def on_error(self, interaction, error):
+        record_command(interaction, "error")
+        await super().on_error(interaction, error)
+
+
+def record_command(interaction, status):
+    """
+    Record the handling time of a slash command
+    :param interaction: The command's interaction
+    :param status: "ok" or "error"
+    """
+    started_at = interaction.extras.get("started_at")
+    if started_at is None or interaction.command is None:
+        return
+    COMMAND_SECONDS.observe(time.perf_counter() - started_at, interaction.command.qualified_name, status)
+
+
+def track_buttons(*prefixes):
+    """
+    Decorate a cog's on_interaction listener to time the buttons it handles
+    :param prefixes: custom_id prefixes of the listener's buttons, e.g. "repay_"
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, interaction):
+            custom_id = ""
+            if interaction.type == discord.InteractionType.component and interaction.data:
+                custom_id = interaction.data.get("custom_id", "")
+
+            button = next((prefix.rstrip("_") for prefix in prefixes if custom_id.startswith(prefix)), None)
+            if button is None:
+                return await func(self, interaction)
+
+            label_current_task(f"button {button}")
+            started_at = time.perf_counter()
+            status = "error"
+            try:
+                result = await func(self, interaction)
+                status = "ok"
+                return result
+            finally:
+                BUTTON_SECONDS.observe(time.perf_counter() - started_at, button, status)
+        return wrapper
+    return decorator
+
+
+# Numeric path segments (guild and user IDs) collapsed in endpoint labels
+_ID_SEGMENT = re.compile(r"/\d+")
+
+
+def create_api_trace_config():
+    """
+    Create an aiohttp trace config that records UnbelievaBoat request latency
+    :return: aiohttp.TraceConfig to pass to the client session
+    """
+    async def on_request_start(session, context, params):
+        context.started_at = time.perf_counter()
+
+    def _record(context, params, status):
+        endpoint = _ID_SEGMENT.sub("/{id}", params.url.path)
+        API_SECONDS.observe(time.perf_counter() - context.started_at, params.method, endpoint, status)
+
+    async def on_request_end(session, context, params):
+        _record(context, params, str(params.response.status))
+
+    async def on_request_exception(session, context, params):
+        _record(context, params, type(params.exception).__name__)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
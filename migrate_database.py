@@ -0,0 +1,445 @@
+#!/usr/bin/env python
+"""
+Loan Database Migration
+
+Usage:
+  python migrate_database.py [SOURCE] [--store PATH] [--batch-size N] [--force]
+
+Moves a legacy JSON backup (data/database.json by default) into the shared
+SQLite store (config.MULTIPROCESS["STORE_PATH"] unless --store is given).
+The file is read as a stream, one record at a time, so it never has to fit
+in memory. Dates in any of the formats older versions wrote (ISO strings
+with or without a time zone, "YYYY-MM-DD HH:MM:SS", Unix timestamps) are
+converted to the ISO format the bot uses, and records are inserted in
+batches of --batch-size, each in one transaction together with the import's
+position. Running the same command again after an interruption resumes
+after the last committed batch.
+
+Afterwards the per-user and daily loan statistics are recomputed from the
+stored loans and history (read back with a cursor) and written to the store,
+and the record count and amount totals of each guild are checked against
+the source file. The exit status is 1 if any of them differ. Loans and loan
+requests are stored once per ID, so when the source repeats an ID the last
+record wins: the check counts distinct IDs, and the duplicates are reported
+separately as warnings. Only the amounts of each ID are kept for this, not
+the records.
+"""
+
+import argparse
+import codecs
+import datetime
+import json
+import os
+import sqlite3
+import time
+
+from dateutil import parser as date_parser
+
+from loan_stats import compute_daily_deltas, compute_deltas
+from shared_store import KEYED_COLLECTIONS, SharedStore, get_multiprocess_settings
+
+# Characters read from the file at a time
+READ_SIZE = 1 << 20
+
+# Collections copied into the store (other top-level keys, like the
+# statistics, are skipped and recomputed)
+ARRAY_COLLECTIONS = ("loans", "loan_requests", "history", "credit_adjustments")
+MAPPING_COLLECTIONS = ("credit_scores",)
+
+# Collections whose counts and amounts are checked per guild
+VERIFIED_COLLECTIONS = ("loans", "loan_requests", "history")
+
+DATE_FIELDS = (
+    "request_date",
+    "due_date",
+    "approved_date",
+    "denied_date",
+    "repaid_date",
+    "repayment_date",
+    "last_payment_date"
+)
+
+
+class JsonStream:
+    def __init__(self, file, read_size=READ_SIZE):
+        """
+        Read one JSON document from a binary file a piece at a time
+        :param file: File opened in binary mode
+        :param read_size: Bytes read at a time
+        """
+        self.file = file
+        self.read_size = read_size
+        self.bytes_read = 0
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8-sig")()
+
+    def _read(self):
+        """Append the next piece of the file to the buffer (False at the end of the file)"""
+        if self.eof:
+            return False
+
+        data = self.file.read(self.read_size)
+        if not data:
+            self.eof = True
+            self.buffer = self.buffer[self.pos:] + self._text.decode(b"", final=True)
+            self.pos = 0
+            return False
+
+        self.bytes_read += len(data)
+        self.buffer = self.buffer[self.pos:] + self._text.decode(data)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """Skip whitespace and get the next character ("" at the end of the file)"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._read():
+                return ""
+
+    def expect(self, chars):
+        """Consume the next character, which must be one of chars"""
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} near byte {self.bytes_read:,}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The value may continue past the end of the buffer
+                if self._read():
+                    continue
+                raise
+
+            # A number at the end of the buffer may have more digits to come
+            if end == len(self.buffer) and self._read():
+                continue
+
+            self.pos = end
+            return value
+
+    def array(self):
+        """Iterate over the values of the next array"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+    def items(self):
+        """Iterate over the (key, value) pairs of the next object"""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key, self.value()
+            if self.expect(",}") == "}":
+                return
+
+
+def stream_database(stream):
+    """
+    Iterate over the records of a JSON backup in file order
+    :param stream: JsonStream positioned at the start of the document
+    :return: Generator of (collection, record), with (user_id, score) records for credit_scores
+    """
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+
+    while True:
+        key = stream.value()
+        stream.expect(":")
+        char = stream.peek()
+
+        if key in ARRAY_COLLECTIONS and char == "[":
+            for record in stream.array():
+                yield key, record
+        elif key in MAPPING_COLLECTIONS and char == "{":
+            for item in stream.items():
+                yield key, item
+        else:
+            stream.value()
+
+        if stream.expect(",}") == "}":
+            return
+
+
+def normalize_date(value):
+    """
+    Convert a legacy date to a local ISO string
+    :param value: ISO string (any variant), other date string, or Unix timestamp in seconds or milliseconds
+    :return: ISO string, or the value unchanged if it is not a date
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        parsed = datetime.datetime.fromtimestamp(value / 1000 if value > 1e11 else value)
+    elif isinstance(value, str):
+        try:
+            parsed = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            parsed = date_parser.parse(value)
+    else:
+        return value
+
+    # The bot works with naive local times
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+
+def normalize_record(record, warnings):
+    """
+    Clean up a legacy loan record in place
+    :param record: Record dict
+    :param warnings: Dict of field to number of dates that could not be parsed
+    :return: The record
+    """
+    for field in ("id", "guild_id", "user_id"):
+        if record.get(field) is not None:
+            record[field] = str(record[field])
+
+    for field in DATE_FIELDS:
+        if record.get(field) is not None:
+            try:
+                record[field] = normalize_date(record[field])
+            except (ValueError, OverflowError):
+                warnings[field] = warnings.get(field, 0) + 1
+
+    return record
+
+
+def _number(value):
+    """Get a numeric field as a float (0 if missing or not a number)"""
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _add_stats(totals, deltas):
+    """Add statistics deltas to running totals"""
+    for key, delta in deltas.items():
+        stats = totals.setdefault(key, {})
+        for field, value in delta.items():
+            stats[field] = stats.get(field, 0) + value
+
+
+def compute_stats(store, batch_size=1000):
+    """
+    Recompute the per-user and daily loan statistics from the stored loans and history
+    :return: Tuple of (dict of (guild_id, user_id) to stats, dict of (guild_id, day) to stats)
+    """
+    user_stats = {}
+    daily_stats = {}
+
+    for collection in ("loans", "history"):
+        for record in store.iter_records(collection, batch_size):
+            change = [(collection, None, record)]
+            _add_stats(user_stats, compute_deltas(change))
+            _add_stats(daily_stats, compute_daily_deltas(change))
+
+    return user_stats, daily_stats
+
+
+def migrate(source_path, store, batch_size=1000):
+    """
+    Import a JSON backup into the store, resuming an interrupted import of the same file
+    :return: Dict of source totals: (collection, guild_id) -> [count, amount, total_repayment],
+             plus "credit_scores" -> [count, sum]. Loans and loan requests count
+             once per ID, with the amounts of the last record (as stored)
+    """
+    source = f"{os.path.abspath(source_path)}:{os.path.getsize(source_path)}"
+    progress = store.get_import_progress(source)
+    if progress:
+        print(f"Resuming: {', '.join(f'{c} after {n:,}' for c, n in sorted(progress.items()))}")
+
+    positions = {}
+    imported = 0
+    skipped = 0
+    warnings = {}
+    totals = {"credit_scores": [0, 0]}
+    latest = {}      # (collection, guild_id, loan_id) -> (amount, total_repayment) of the last record seen
+    duplicates = {}  # (collection, guild_id) -> records that repeated an earlier ID
+
+    batch = []
+    batch_collection = None
+
+    def flush():
+        nonlocal imported
+        if batch:
+            store.import_records(batch_collection, batch, source, positions[batch_collection])
+            imported += len(batch)
+            batch.clear()
+
+    file_size = os.path.getsize(source_path)
+    started = time.perf_counter()
+    last_report = started
+
+    with open(source_path, "rb") as f:
+        stream = JsonStream(f)
+
+        for collection, record in stream_database(stream):
+            positions[collection] = positions.get(collection, 0) + 1
+
+            # Tally the source for verification, including already imported records
+            if collection == "credit_scores":
+                user_id, score = record
+                record = (str(user_id), int(score))
+                totals["credit_scores"][0] += 1
+                totals["credit_scores"][1] += record[1]
+            else:
+                if not isinstance(record, dict) or (collection in KEYED_COLLECTIONS and not record.get("id")):
+                    skipped += 1
+                    continue
+                normalize_record(record, warnings)
+
+                # A repeated ID replaces the earlier record in the store
+                amounts = (_number(record.get("amount")), _number(record.get("total_repayment")))
+                previous = None
+                if collection in KEYED_COLLECTIONS:
+                    key = (collection, record.get("guild_id"), record.get("id"))
+                    previous = latest.get(key)
+                    latest[key] = amounts
+                    if previous is not None:
+                        duplicates[key[:2]] = duplicates.get(key[:2], 0) + 1
+
+                if collection in VERIFIED_COLLECTIONS:
+                    tally = totals.setdefault((collection, record.get("guild_id")), [0, 0.0, 0.0])
+                    if previous is None:
+                        tally[0] += 1
+                    else:
+                        tally[1] -= previous[0]
+                        tally[2] -= previous[1]
+                    tally[1] += amounts[0]
+                    tally[2] += amounts[1]
+
+            if positions[collection] <= progress.get(collection, 0):
+                continue
+
+            if collection != batch_collection:
+                flush()
+                batch_collection = collection
+            batch.append(record)
+            if len(batch) >= batch_size:
+                flush()
+
+            now = time.perf_counter()
+            if now - last_report >= 2:
+                last_report = now
+                print(f"  {collection}: {imported:,} records imported, "
+                      f"{stream.bytes_read / 1024 / 1024:.1f} of {file_size / 1024 / 1024:.1f} MB read "
+                      f"({imported / (now - started):,.0f} records/s)")
+
+        flush()
+
+    elapsed = time.perf_counter() - started
+    print(f"Imported {imported:,} records in {elapsed:.1f}s ({imported / elapsed if elapsed else 0:,.0f} records/s)")
+    if skipped:
+        print(f"Skipped {skipped:,} records that were empty or had no loan ID")
+    for field, count in sorted(warnings.items()):
+        print(f"Warning: {count:,} {field} values are not dates and were kept as they were")
+    for (collection, guild_id), count in sorted(duplicates.items(), key=str):
+        print(f"Warning: {count:,} {collection} records in guild {guild_id} repeat an earlier ID; the last one was kept")
+
+    # Loan statistics are recomputed from everything stored, so they are right after a resume too
+    user_stats, daily_stats = compute_stats(store, batch_size)
+    store.set_user_stats([(guild_id, user_id, stats) for (guild_id, user_id), stats in user_stats.items()])
+    store.set_daily_stats([(guild_id, day, stats) for (guild_id, day), stats in daily_stats.items()])
+    print(f"Wrote loan statistics for {len(user_stats):,} borrowers and {len(daily_stats):,} guild days")
+
+    return totals
+
+
+def verify(store, totals):
+    """
+    Compare per-guild counts and sums in the store with the source
+    :return: List of mismatch descriptions
+    """
+    mismatches = []
+
+    for collection in VERIFIED_COLLECTIONS:
+        stored = store.get_guild_totals(collection)
+        expected = {key[1]: tally for key, tally in totals.items() if key != "credit_scores" and key[0] == collection}
+
+        for guild_id in sorted(set(stored) | set(expected)):
+            want = expected.get(guild_id, [0, 0.0, 0.0])
+            have = stored.get(guild_id, (0, 0.0, 0.0))
+            if want[0] != have[0] or abs(want[1] - have[1]) > 0.005 or abs(want[2] - have[2]) > 0.005:
+                mismatches.append(
+                    f"{collection} in guild {guild_id}: source has {want[0]:,} records "
+                    f"(amount {want[1]:,.0f}, repayment {want[2]:,.0f}), store has {have[0]:,} "
+                    f"(amount {have[1]:,.0f}, repayment {have[2]:,.0f})"
+                )
+
+    conn = sqlite3.connect(store.path)
+    count, score_sum = conn.execute("SELECT COUNT(*), TOTAL(score) FROM credit_scores").fetchone()
+    conn.close()
+    if (count, score_sum) != (totals["credit_scores"][0], float(totals["credit_scores"][1])):
+        mismatches.append(
+            f"credit_scores: source has {totals['credit_scores'][0]:,} scores summing to {totals['credit_scores'][1]:,}, "
+            f"store has {count:,} summing to {score_sum:,.0f}"
+        )
+
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move a JSON loan database backup into the shared SQLite store")
+    parser.add_argument("source", nargs="?", default=os.path.join("data", "database.json"), help="JSON backup to import")
+    parser.add_argument("--store", default=None, help="Shared SQLite store path (defaults to MULTIPROCESS STORE_PATH)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Records inserted per transaction")
+    parser.add_argument("--force", action="store_true", help="Import even if the store already holds loans")
+    args = parser.parse_args()
+
+    store_path = args.store or get_multiprocess_settings()["STORE_PATH"]
+    if not store_path:
+        print("No store path: pass --store or set MULTIPROCESS STORE_PATH in config.py")
+        raise SystemExit(2)
+    if not os.path.exists(args.source):
+        print(f"Source file {args.source} not found")
+        raise SystemExit(2)
+
+    print(f"\n===== Migrating {args.source} into {store_path} =====")
+    store = SharedStore(store_path)
+
+    source = f"{os.path.abspath(args.source)}:{os.path.getsize(args.source)}"
+    if not store.get_import_progress(source) and not store.is_empty() and not args.force:
+        print("The store already holds loan data. Use --force to import into it anyway "
+              "(the per-guild checks will then count the existing records too)")
+        raise SystemExit(2)
+
+    totals = migrate(args.source, store, args.batch_size)
+
+    mismatches = verify(store, totals)
+    if mismatches:
+        for mismatch in mismatches:
+            print(f"MISMATCH: {mismatch}")
+        raise SystemExit(1)
+
+    guilds = len({key[1] for key in totals if key != "credit_scores"})
+    print(f"OK: counts and amounts match for {guilds} guilds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Overdue Scheduler
+
+This module applies the late fee (5% of the loan amount) and the overdue
+credit penalty (-5) when a loan passes its due date, instead of waiting for
+the borrower to run /repay or /pay_installment. Active loans are kept in a
+min-heap ordered by due date (see scheduling.py). When the earliest due date
+passes, the loans due by then are penalized in batches that each commit as
+one unit of work, holding the loans' locks in this process and in the
+shared store. The heap is rebuilt from the loaded loan database on startup.
+Repayments made after the due date still cost -5 credit each, as before.
+"""
+
+import datetime
+import logging
+
+from loan_index import ACTIVE_STATUSES, get_loan_index
+from loan_locks import loan_locks
+from scheduling import HeapScheduler, to_timestamp
+from shared_store import lock_loans
+from unit_of_work import UnitOfWork
+
+logger = logging.getLogger("discord")
+
+LATE_FEE_RATE = 0.05
+OVERDUE_CREDIT_PENALTY = -5
+ON_TIME_CREDIT_BONUS = 10
+
+# Maximum number of loans penalized in one unit of work
+BATCH_SIZE = 100
+
+
+def needs_penalty(loan):
+    """Check if a loan is active and has not been penalized for being overdue"""
+    return loan.get("status") in ACTIVE_STATUSES and not loan.get("overdue_penalty_applied", False)
+
+
+def repayment_credit_change(loan, on_time):
+    """
+    Get the credit score change for a repayment
+    :param loan: The loan being repaid
+    :param on_time: Whether the repayment is before the due date
+    :return: +10 on time, -5 if late (also after the overdue penalty was applied)
+    """
+    return ON_TIME_CREDIT_BONUS if on_time else OVERDUE_CREDIT_PENALTY
+
+
+def stage_overdue_penalty(uow, loan):
+    """
+    Stage the late fee (if not already applied) and the overdue credit penalty of a loan
+    :param uow: UnitOfWork to stage the changes in
+    :param loan: The overdue loan
+    """
+    fields = {"overdue_penalty_applied": True}
+
+    if not loan.get("late_fee_applied", False):
+        late_fee = round(loan["amount"] * LATE_FEE_RATE)
+        fields["late_fee"] = late_fee
+        fields["total_repayment"] = loan.get("total_repayment", 0) + late_fee
+        fields["late_fee_applied"] = True
+        fields["late_fee_date"] = datetime.datetime.now().isoformat()
+
+    uow.update("loans", loan, fields)
+    uow.adjust_credit(loan["user_id"], OVERDUE_CREDIT_PENALTY)
+
+
+class OverdueScheduler(HeapScheduler):
+    name = "overdue scheduler"
+
+    def __init__(self, bot, batch_size=BATCH_SIZE):
+        """
+        Initialize the scheduler
+        :param bot: The bot instance (for its loan database)
+        :param batch_size: Maximum number of loans penalized per commit
+        """
+        super().__init__(bot, batch_size)
+        self.stats = {"penalized": 0, "batches": 0}
+
+    def schedule(self, loan):
+        """Schedule a loan's overdue penalty at its due date"""
+        due = to_timestamp(loan.get("due_date"))
+        if due is not None and needs_penalty(loan):
+            self.push(due, loan)
+
+    def rebuild(self, loan_database):
+        """
+        Rebuild the heap from the loan database
+        :param loan_database: The bot's loan database dict
+        """
+        entries = []
+        for loan in loan_database.get("loans", []):
+            if loan and needs_penalty(loan):
+                due = to_timestamp(loan.get("due_date"))
+                if due is not None:
+                    entries.append((due, loan))
+
+        self.replace_all(entries)
+        logger.info(f"Overdue scheduler tracking {len(entries)} active loans")
+
+    async def process_due(self):
+        """
+        Penalize one batch of loans that are due
+        :return: Number of loans penalized
+        """
+        # Entries are not removed when a loan is repaid, so check them here
+        batch = [
+            loan for due, loan in self.pop_due()
+            if needs_penalty(loan) and to_timestamp(loan.get("due_date")) == due
+        ]
+        if not batch:
+            return 0
+
+        # Wait for any repayment in progress on these loans, here or in another process
+        async with loan_locks.hold_many(f"loan:{loan.get('id')}" for loan in batch), lock_loans(self.bot, batch):
+            # Another process may have repaid a loan (it is then no longer indexed)
+            index = get_loan_index(self.bot)
+            uow = UnitOfWork(self.bot)
+            penalized = [loan for loan in batch if needs_penalty(loan) and index.get_loan(loan.get("id")) is loan]
+            for loan in penalized:
+                stage_overdue_penalty(uow, loan)
+
+            try:
+                await uow.commit()
+            except Exception:
+                # Put the loans back so they are retried
+                for loan in penalized:
+                    self.schedule(loan)
+                raise
+
+        self.stats["penalized"] += len(penalized)
+        self.stats["batches"] += 1
+        logger.info(f"Applied overdue penalties to {len(penalized)} loans")
+        return len(penalized)
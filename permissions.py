@@ -0,0 +1,142 @@
+"""
+Permissions
+
+This module answers the loan permission checks (may a member request loans,
+may they approve and deny requests) for /loan, /approveloan, /denyloan and
+the approve/deny buttons. When member update events reach the bot for every
+member (members intent, joined member cache and chunking at startup), results
+are cached per guild and member together with the guild's settings version
+and role version, so a hit is a dict lookup; a role change drops the member's
+entry, a settings change or a role update makes the guild's entries miss.
+Without those events a cached result could outlive a removed role, so the
+checks are evaluated from the member's roles every time instead.
+"""
+
+import logging
+import time
+
+import server_settings
+
+logger = logging.getLogger("discord")
+
+# Seconds after which a cached result is evaluated again, to bound staleness
+# from changes no event or role ID reflects (e.g. guild ownership)
+ENTRY_TTL = 60
+
+# Entries kept before the oldest ones are dropped
+MAX_ENTRIES = 10000
+
+# Capability flags
+CAN_REQUEST = 1
+CAN_REVIEW = 2
+
+
+class PermissionService:
+    def __init__(self, ttl=ENTRY_TTL, max_entries=MAX_ENTRIES, cache_enabled=False):
+        """
+        Initialize the service
+        :param ttl: Seconds after which a cached result is evaluated again
+        :param max_entries: Maximum number of cached results
+        :param cache_enabled: Cache results (only safe if every member's role changes are delivered)
+        """
+        self.cache_enabled = cache_enabled
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._role_versions = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get_capabilities(self, guild_id, member, settings):
+        """Get the capability flags of a member, from the cache if still valid"""
+        if not self.cache_enabled:
+            return self._evaluate(member, settings)
+
+        guild_id = int(guild_id)
+        key = (guild_id, member.id)
+        role_version = self._role_versions.get(guild_id, 0)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, settings_version, entry_role_version, capabilities = entry
+            if (settings_version == settings.version and entry_role_version == role_version
+                    and time.monotonic() < expires_at):
+                self.hits += 1
+                return capabilities
+
+        self.misses += 1
+        capabilities = self._evaluate(member, settings)
+
+        # Drop the oldest entry once full (dicts keep insertion order)
+        self._entries.pop(key, None)
+        if len(self._entries) >= self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (time.monotonic() + self.ttl, settings.version, role_version, capabilities)
+
+        return capabilities
+
+    def _evaluate(self, member, settings):
+        """Work out a member's capability flags from their roles"""
+        if member.guild_permissions.administrator:
+            return CAN_REQUEST | CAN_REVIEW
+
+        capabilities = 0
+        if settings.is_captain(member):
+            capabilities |= CAN_REQUEST
+        if settings.has_approval_role(member):
+            capabilities |= CAN_REVIEW
+        return capabilities
+
+    def can_request_loan(self, guild_id, member):
+        """
+        Check if a member may request loans (admins and captains, everyone if no captain role is set)
+        :param guild_id: Discord guild ID
+        :param member: Discord member object
+        :return: True if the member may request loans
+        """
+        settings = server_settings.get_settings(guild_id)
+        if not settings.captain_role_ids:
+            return True
+        return bool(self._get_capabilities(guild_id, member, settings) & CAN_REQUEST)
+
+    def can_review_requests(self, guild_id, member):
+        """
+        Check if a member may approve and deny loan requests (admins and approval roles)
+        :param guild_id: Discord guild ID
+        :param member: Discord member object
+        :return: True if the member may review loan requests
+        """
+        settings = server_settings.get_settings(guild_id)
+        return bool(self._get_capabilities(guild_id, member, settings) & CAN_REVIEW)
+
+    def invalidate_member(self, member):
+        """
+        Drop a member's cached result after their roles changed
+        :param member: The updated Discord member object
+        """
+        self._entries.pop((member.guild.id, member.id), None)
+
+    def invalidate_roles(self, guild_id):
+        """
+        Make every cached result of a guild miss after a role was changed or deleted
+        :param guild_id: Discord guild ID
+        """
+        guild_id = int(guild_id)
+        self._role_versions[guild_id] = self._role_versions.get(guild_id, 0) + 1
+
+    def get_stats(self):
+        """
+        Get cache statistics for /botstats
+        :return: Dict with hits, misses, hit rate and number of entries
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries)
+        }
+
+
+# Shared service used by the loan commands
+permission_service = PermissionService()
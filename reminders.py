@@ -0,0 +1,368 @@
+"""
+Due-Date Reminders
+
+This module reminds borrowers of upcoming due dates by DM and posts a digest
+of the loans due soon to each guild's admin channel, at the offsets before
+due_date set in config.REMINDERS. Reminders are scheduled on a min-heap (see
+scheduling.py) and handed to a dispatcher that coalesces them per user and
+per channel: reminders for one recipient that pile up while waiting to be
+sent go out as a single message. The dispatcher drains its queue with a few
+workers that pace themselves with token buckets for Discord's global and
+per-route rate limits, and keeps sends per minute and queue lag for /botstats.
+"""
+
+import asyncio
+import collections
+import logging
+import time
+
+import discord
+
+from loan_index import ACTIVE_STATUSES
+from loan_locks import loan_locks
+from scheduling import HeapScheduler, to_timestamp
+from unit_of_work import UnitOfWork
+import server_settings
+
+try:
+    import config
+except ModuleNotFoundError:
+    config = None
+
+logger = logging.getLogger("discord")
+
+# Defaults used when config.REMINDERS is missing or incomplete
+DEFAULT_REMINDER_SETTINGS = {
+    "ENABLED": True,
+    "OFFSETS_HOURS": [24, 1],   # Hours before the due date at which to remind
+    "DM_BORROWERS": True,       # DM the borrower
+    "ADMIN_DIGEST": True,       # Post a digest in the guild's admin channel
+    "GLOBAL_RATE": 25,          # Sends per second across all routes (Discord allows 50 requests)
+    "ROUTE_RATE": 5,            # Sends per route (DM or channel) ...
+    "ROUTE_PERIOD": 5,          # ... per this many seconds
+    "WORKERS": 4                # Concurrent senders
+}
+
+# Maximum number of reminders handled per batch
+BATCH_SIZE = 200
+
+# Discord's message length limit, with room for the title
+MAX_MESSAGE_LENGTH = 1900
+
+
+def get_reminder_settings():
+    """
+    Get the reminder settings merged with defaults
+    :return: Dict of reminder settings
+    """
+    settings = dict(DEFAULT_REMINDER_SETTINGS)
+    settings.update(getattr(config, "REMINDERS", {}) or {})
+    return settings
+
+
+class TokenBucket:
+    def __init__(self, rate, per):
+        """
+        Allow rate sends per `per` seconds, in bursts of up to rate
+        :param rate: Number of sends
+        :param per: Period in seconds
+        """
+        self.capacity = float(rate)
+        self.fill_rate = rate / per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """
+        Take a token, going into debt if none is left
+        :return: Seconds to wait before using the token
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+        self.updated = now
+        self.tokens -= 1
+
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.fill_rate
+
+
+def _chunk_lines(title, lines):
+    """Split reminder lines into messages under Discord's length limit"""
+    messages = []
+    current = title
+
+    for line in lines:
+        if len(current) + len(line) + 1 > MAX_MESSAGE_LENGTH:
+            messages.append(current)
+            current = title
+        current += "\n" + line
+
+    messages.append(current)
+    return messages
+
+
+class ReminderDispatcher:
+    def __init__(self, bot, settings=None):
+        """
+        Initialize the dispatcher
+        :param bot: The bot instance
+        :param settings: Reminder settings dict (defaults to config.REMINDERS)
+        """
+        if settings is None:
+            settings = get_reminder_settings()
+
+        self.bot = bot
+        self.settings = settings
+        self.global_bucket = TokenBucket(settings["GLOBAL_RATE"], 1)
+        self.route_buckets = {}
+        self._pending = {}   # (kind, target ID) -> {"title", "lines", "enqueued_at"}, oldest first
+        self._queue = None
+        self._workers = []
+        self._sent_times = collections.deque()
+        self.stats = {"sent": 0, "failed": 0, "coalesced": 0, "last_lag": 0.0}
+
+    def enqueue(self, kind, target_id, title, line):
+        """
+        Queue a reminder line, merging it into a message already waiting for the same recipient
+        :param kind: "dm" for a user or "channel" for a channel
+        :param target_id: User or channel ID
+        :param title: First line of the message
+        :param line: Reminder line
+        """
+        key = (kind, str(target_id))
+        entry = self._pending.get(key)
+
+        if entry is not None:
+            entry["lines"].append(line)
+            self.stats["coalesced"] += 1
+            return
+
+        self._pending[key] = {"title": title, "lines": [line], "enqueued_at": time.monotonic()}
+        self._queue.put_nowait(key)
+
+    def start(self):
+        """Start the sender workers"""
+        if self._workers:
+            return
+
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker())
+            for _ in range(max(1, int(self.settings["WORKERS"])))
+        ]
+
+    def stop(self):
+        """Stop the sender workers"""
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def pending(self):
+        """Get the number of recipients with a message waiting"""
+        return len(self._pending)
+
+    def get_stats(self):
+        """
+        Get dispatcher statistics
+        :return: Dict with sends in the last minute, current queue lag in seconds, pending and total counts
+        """
+        cutoff = time.monotonic() - 60
+        while self._sent_times and self._sent_times[0] < cutoff:
+            self._sent_times.popleft()
+
+        oldest = next(iter(self._pending.values()), None)
+        return {
+            "sends_per_minute": len(self._sent_times),
+            "queue_lag": time.monotonic() - oldest["enqueued_at"] if oldest else 0.0,
+            "last_lag": self.stats["last_lag"],
+            "pending": len(self._pending),
+            "sent": self.stats["sent"],
+            "failed": self.stats["failed"],
+            "coalesced": self.stats["coalesced"]
+        }
+
+    async def _worker(self):
+        """Send queued messages once the bot is connected"""
+        await self.bot.wait_until_ready()
+
+        while True:
+            key = await self._queue.get()
+            entry = self._pending.pop(key, None)
+
+            try:
+                if entry is not None:
+                    await self._send(key, entry)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["failed"] += 1
+                logger.error(f"Error sending reminder to {key[0]} {key[1]}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _wait_for_slot(self, route):
+        """Wait until both the route's and the global rate limit allow a send"""
+        bucket = self.route_buckets.get(route)
+        if bucket is None:
+            bucket = TokenBucket(self.settings["ROUTE_RATE"], self.settings["ROUTE_PERIOD"])
+            self.route_buckets[route] = bucket
+
+            # Forget idle routes now and then
+            if len(self.route_buckets) > 10000:
+                self.route_buckets = {
+                    key: value for key, value in self.route_buckets.items()
+                    if value.tokens < value.capacity
+                }
+                self.route_buckets[route] = bucket
+
+        delay = max(bucket.reserve(), self.global_bucket.reserve())
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _send(self, key, entry):
+        """Send a coalesced message to a user or channel"""
+        kind, target_id = key
+
+        if kind == "dm":
+            target = self.bot.get_user(int(target_id))
+            if target is None:
+                await self._wait_for_slot(("users", None))
+                target = await self.bot.fetch_user(int(target_id))
+        else:
+            target = self.bot.get_channel(int(target_id))
+            if target is None:
+                logger.warning(f"Reminder channel {target_id} not found")
+                return
+
+        for content in _chunk_lines(entry["title"], entry["lines"]):
+            await self._wait_for_slot(key)
+
+            try:
+                await target.send(content, allowed_mentions=discord.AllowedMentions.none())
+                self.stats["sent"] += 1
+                self._sent_times.append(time.monotonic())
+            except discord.Forbidden:
+                # The user has DMs closed or the bot cannot post in the channel
+                self.stats["failed"] += 1
+                logger.info(f"Not allowed to send reminders to {kind} {target_id}")
+                return
+
+        self.stats["last_lag"] = time.monotonic() - entry["enqueued_at"]
+
+
+class ReminderScheduler(HeapScheduler):
+    name = "reminder scheduler"
+
+    def __init__(self, bot, dispatcher, settings=None):
+        """
+        Initialize the scheduler
+        :param bot: The bot instance (for its loan database)
+        :param dispatcher: ReminderDispatcher that sends the reminders
+        :param settings: Reminder settings dict (defaults to config.REMINDERS)
+        """
+        if settings is None:
+            settings = get_reminder_settings()
+
+        super().__init__(bot, BATCH_SIZE)
+        self.dispatcher = dispatcher
+        self.settings = settings
+        self.offsets = sorted({float(hours) for hours in settings["OFFSETS_HOURS"]}, reverse=True)
+
+    def _entries_for(self, loan, now):
+        """Get the (timestamp, (loan, offset)) entries still to send for a loan"""
+        due = to_timestamp(loan.get("due_date"))
+        if due is None or due <= now or loan.get("status") not in ACTIVE_STATUSES:
+            return []
+
+        sent = set(loan.get("reminders_sent", []))
+        entries = []
+        missed = None
+
+        for hours in self.offsets:
+            if hours in sent:
+                continue
+
+            remind_at = due - hours * 3600
+            if remind_at > now:
+                entries.append((remind_at, (loan, hours)))
+            else:
+                # Reminders missed while offline collapse into the latest one
+                missed = hours
+
+        if missed is not None:
+            entries.append((now, (loan, missed)))
+
+        return entries
+
+    def schedule(self, loan):
+        """Schedule a loan's reminders"""
+        for when, item in self._entries_for(loan, time.time()):
+            self.push(when, item)
+
+    def rebuild(self, loan_database):
+        """
+        Rebuild the heap from the loan database
+        :param loan_database: The bot's loan database dict
+        """
+        now = time.time()
+        entries = []
+        for loan in loan_database.get("loans", []):
+            if loan:
+                entries.extend(self._entries_for(loan, now))
+
+        self.replace_all(entries)
+        logger.info(f"Reminder scheduler tracking {len(entries)} reminders")
+
+    def _format_line(self, loan, for_admins):
+        """Format the reminder line of a loan"""
+        currency = config.UNBELIEVABOAT["CURRENCY_NAME"] if config else "Berries"
+        remaining = loan.get("total_repayment", 0) - loan.get("amount_repaid", 0)
+        due = int(to_timestamp(loan.get("due_date")))
+
+        if for_admins:
+            return f"<@{loan.get('user_id')}> - Loan #{loan.get('id')}: {remaining:,} {currency} due <t:{due}:R>"
+
+        command = "pay_installment" if loan.get("installment_enabled", False) else "repay"
+        return (f"Loan #{loan.get('id')} in **{loan.get('guild_name', 'your server')}**: "
+                f"{remaining:,} {currency} due <t:{due}:R> (`/{command} {loan.get('id')}`)")
+
+    async def process_due(self):
+        """
+        Queue one batch of due reminders and mark them as sent
+        :return: Number of loans reminded
+        """
+        reminders = {}
+        for _, (loan, hours) in self.pop_due():
+            if loan.get("status") in ACTIVE_STATUSES and hours not in loan.get("reminders_sent", []):
+                # A loan with several reminders due at once gets the latest one
+                previous = reminders.get(id(loan))
+                if previous is None or hours < previous[1]:
+                    reminders[id(loan)] = (loan, hours)
+
+        if not reminders:
+            return 0
+
+        for loan, hours in reminders.values():
+            if self.settings["DM_BORROWERS"]:
+                self.dispatcher.enqueue("dm", loan["user_id"], "⏰ **Loan due date reminder**", self._format_line(loan, False))
+
+            if self.settings["ADMIN_DIGEST"]:
+                channel_id = server_settings.get_admin_channel(loan.get("guild_id"))
+                if channel_id:
+                    self.dispatcher.enqueue("channel", channel_id, "📋 **Loans due soon**", self._format_line(loan, True))
+
+        # Remember the reminders so they are not sent again after a restart
+        loans = [loan for loan, _ in reminders.values()]
+        async with loan_locks.hold_many(f"loan:{loan.get('id')}" for loan in loans):
+            uow = UnitOfWork(self.bot)
+            for loan, hours in reminders.values():
+                if loan.get("status") not in ACTIVE_STATUSES:
+                    continue
+                sent = set(loan.get("reminders_sent", []))
+                sent.update(offset for offset in self.offsets if offset >= hours)
+                uow.update("loans", loan, {"reminders_sent": sorted(sent)})
+            await uow.commit()
+
+        logger.info(f"Queued due date reminders for {len(reminders)} loans")
+        return len(reminders)
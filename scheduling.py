@@ -0,0 +1,146 @@
+"""
+Scheduling
+
+This module contains the min-heap scheduler shared by the background tasks
+that act on loan due dates (overdue penalties, due-date reminders). Entries
+are (timestamp, item) pairs; the task sleeps until the earliest timestamp,
+or until an earlier entry is pushed, and then hands the entries that are due
+to process_due() in batches. Pushing and popping are O(log n).
+"""
+
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger("discord")
+
+
+def to_timestamp(value):
+    """Get a datetime (or ISO string) as a Unix timestamp (None if it is neither)"""
+    if isinstance(value, str):
+        try:
+            value = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime.datetime):
+        return None
+    return value.timestamp()
+
+
+class HeapScheduler:
+    # Name used in log messages
+    name = "scheduler"
+
+    def __init__(self, bot, batch_size=100):
+        """
+        Initialize the scheduler
+        :param bot: The bot instance
+        :param batch_size: Maximum number of entries handed to process_due at once
+        """
+        self.bot = bot
+        self.batch_size = batch_size
+        self._heap = []  # (timestamp, sequence, item)
+        self._sequence = itertools.count()
+        self._wakeup = None  # Created by start(), on the running event loop
+        self._task = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, when, item):
+        """
+        Schedule an item
+        :param when: Unix timestamp at which the item is due
+        :param item: Any object
+        """
+        entry = (when, next(self._sequence), item)
+        heapq.heappush(self._heap, entry)
+
+        # Wake the task up if this item is due before the one it is waiting for
+        if self._heap[0] is entry and self._wakeup is not None:
+            self._wakeup.set()
+
+    def replace_all(self, entries):
+        """
+        Replace every scheduled item
+        :param entries: Iterable of (timestamp, item)
+        """
+        heap = [(when, next(self._sequence), item) for when, item in entries]
+        heapq.heapify(heap)
+        self._heap = heap
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def pop_due(self, now=None):
+        """
+        Pop up to a batch of due entries
+        :return: List of (timestamp, item)
+        """
+        if now is None:
+            now = time.time()
+
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            when, _, item = heapq.heappop(self._heap)
+            due.append((when, item))
+
+        return due
+
+    def start(self):
+        """Start the background task"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """Stop the background task"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def is_running(self):
+        """Check if the background task is running"""
+        return self._task is not None and not self._task.done()
+
+    def _next_delay(self):
+        """Seconds until the earliest entry is due (None if nothing is scheduled)"""
+        if not self._heap:
+            return None
+        return max(0.0, self._heap[0][0] - time.time())
+
+    async def _run(self):
+        """Sleep until the next entry is due and process the due entries"""
+        while True:
+            try:
+                delay = self._next_delay()
+
+                if delay is None or delay > 0:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                await self.process_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in {self.name}: {e}")
+                import traceback
+                logger.error(traceback.format_exc())
+                await asyncio.sleep(5)
+
+    async def process_due(self):
+        """Process one batch of due entries (implemented by subclasses)"""
+        raise NotImplementedError
+
+
+def schedule_loan(bot, loan):
+    """Schedule a new loan with each of the bot's loan schedulers"""
+    for scheduler in getattr(bot, "loan_schedulers", []):
+        scheduler.schedule(loan)
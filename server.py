@@ -1,15 +1,21 @@
 """
 Simple HTTP server to keep the service alive and handle health checks
+
+The endpoints are served by an aiohttp web app on the bot's own event loop,
+so they can read the bot's state directly and reuse its UnbelievaBoat API
+client (and connection pool) instead of starting a thread, an event loop and
+a new HTTP session per request.
 """
 
 import os
+import sys
 import logging
-import threading
-import socket
-import json
-from flask import Flask, jsonify, request
 import asyncio
 
+from aiohttp import web
+
+import metrics
+
 # Set up logging
 logging.basicConfig(
     level=logging.INFO,
@@ -17,61 +23,125 @@ logging.basicConfig(
 )
 logger = logging.getLogger("server")
 
-# Create Flask app
-app = Flask(__name__)
-
-# Health check endpoint
-@app.route('/health')
-def health_check():
-    logger.info("Health check request received")
-    return 'OK'
-
-# Root endpoint (similar to the Express example)
-@app.route('/')
-def hello_world():
-    return 'Discord Loan Bot is running!'
-
-# Test endpoint for UnbelievaBoat API
-@app.route('/api-status')
-def api_status():
-    return jsonify({
-        "status": "online",
-        "message": "API endpoint available"
-    })
-
-# Diagnostic endpoint for UnbelievaBoat API
-@app.route('/check-unbelievaboat', methods=['GET'])
-def check_unbelievaboat():
-    try:
-        # Import here to avoid circular imports
-        import config
-        from unbelievaboat_integration import UnbelievaBoatAPI
-        
-        # Get guild_id and user_id from query parameters
-        guild_id = request.args.get('guild_id')
-        user_id = request.args.get('user_id')
-        
-        if not guild_id or not user_id:
-            return jsonify({
-                "status": "error",
-                "message": "Missing required parameters. Use ?guild_id=XXX&user_id=YYY"
-            }), 400
-            
-        # Create async function for testing
-        async def run_test():
-            # Create API client
-            api = UnbelievaBoatAPI(
+# Default port if the PORT environment variable is not set
+DEFAULT_PORT = 10000
+
+# Cogs whose UnbelievaBoat API client is reused, in order of preference
+CLIENT_MODULES = ("commands.repay", "commands.loan")
+
+
+class HealthServer:
+    def __init__(self, bot, port=None, host="0.0.0.0"):
+        """
+        Initialize the server
+        :param bot: The Discord bot
+        :param port: Port to listen on (default: PORT environment variable or 10000)
+        :param host: Interface to bind to
+        """
+        self.bot = bot
+        self.port = port or int(os.environ.get('PORT', DEFAULT_PORT))
+        self.host = host
+        self.runner = None
+        self._own_client = None
+
+        self.app = web.Application()
+        self.app.router.add_get('/health', self.health_check)
+        self.app.router.add_get('/', self.hello_world)
+        self.app.router.add_get('/api-status', self.api_status)
+        self.app.router.add_get('/check-unbelievaboat', self.check_unbelievaboat)
+        self.app.router.add_get('/metrics', self.metrics_endpoint)
+
+    async def start(self):
+        """Start serving on the running event loop"""
+        logger.info(f"Attempting to start server on port {self.port}")
+
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.host, self.port).start()
+        except OSError as e:
+            await self.runner.cleanup()
+            self.runner = None
+            logger.error(f"Port {self.port} is already in use!")
+            raise RuntimeError(f"Port {self.port} is already in use") from e
+
+        logger.info(f"HTTP server started on port {self.port}")
+
+    async def stop(self):
+        """Stop serving and close the API client if the server created one"""
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+        if self._own_client is not None:
+            await self._own_client.close()
+            self._own_client = None
+
+    def _get_unbelievaboat(self):
+        """Get the bot's UnbelievaBoat API client, creating one only if no cog has one"""
+        for module_name in CLIENT_MODULES:
+            client = getattr(sys.modules.get(module_name), "unbelievaboat", None)
+            if client is not None:
+                return client
+
+        if self._own_client is None:
+            import config
+            from unbelievaboat_integration import UnbelievaBoatAPI
+
+            self._own_client = UnbelievaBoatAPI(
                 api_key=config.UNBELIEVABOAT["API_KEY"],
                 port=None,  # Use default port
                 timeout=30
             )
-            
+        return self._own_client
+
+    # Health check endpoint
+    async def health_check(self, request):
+        logger.info("Health check request received")
+        return web.Response(text='OK')
+
+    # Root endpoint (similar to the Express example)
+    async def hello_world(self, request):
+        return web.Response(text='Discord Loan Bot is running!')
+
+    # Test endpoint for UnbelievaBoat API
+    async def api_status(self, request):
+        return web.json_response({
+            "status": "online",
+            "message": "API endpoint available",
+            "bot_ready": self.bot.is_ready(),
+            "guilds": len(self.bot.guilds)
+        })
+
+    # Prometheus metrics endpoint
+    async def metrics_endpoint(self, request):
+        return web.Response(
+            body=metrics.registry.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+        )
+
+    # Diagnostic endpoint for UnbelievaBoat API
+    async def check_unbelievaboat(self, request):
+        try:
+            # Import here to avoid circular imports
+            import config
+
+            # Get guild_id and user_id from query parameters
+            guild_id = request.query.get('guild_id')
+            user_id = request.query.get('user_id')
+
+            if not guild_id or not user_id:
+                return web.json_response({
+                    "status": "error",
+                    "message": "Missing required parameters. Use ?guild_id=XXX&user_id=YYY"
+                }, status=400)
+
             try:
-                # Test connection
-                balance = await api.get_user_balance(guild_id, user_id)
-                
+                # Test connection with the bot's pooled client
+                balance = await self._get_unbelievaboat().get_user_balance(guild_id, user_id)
+
                 if balance:
-                    return {
+                    result = {
                         "status": "success",
                         "message": "API connection successful",
                         "data": {
@@ -82,7 +152,7 @@ def check_unbelievaboat():
                         }
                     }
                 else:
-                    return {
+                    result = {
                         "status": "error",
                         "message": "Could not retrieve balance",
                         "data": {
@@ -92,7 +162,7 @@ def check_unbelievaboat():
                         }
                     }
             except Exception as e:
-                return {
+                result = {
                     "status": "error",
                     "message": f"API error: {str(e)}",
                     "data": {
@@ -100,63 +170,37 @@ def check_unbelievaboat():
                         "error": str(e)
                     }
                 }
-            finally:
-                await api.close()
-                
-        # Run the async function
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        result = loop.run_until_complete(run_test())
-        loop.close()
-        
-        return jsonify(result)
-        
-    except Exception as e:
-        logger.error(f"Error in check-unbelievaboat endpoint: {e}")
-        return jsonify({
-            "status": "error",
-            "message": f"Server error: {str(e)}"
-        }), 500
-
-def is_port_in_use(port):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        return s.connect_ex(('localhost', port)) == 0
-
-def run_server():
-    # Get port from environment variable, default to 10000 if not set
-    port = int(os.environ.get('PORT', 10000))
-    logger.info(f"Attempting to start server on port {port}")
-    
-    # Check if port is already in use
-    if is_port_in_use(port):
-        logger.error(f"Port {port} is already in use!")
-        raise RuntimeError(f"Port {port} is already in use")
-    
+
+            return web.json_response(result)
+
+        except Exception as e:
+            logger.error(f"Error in check-unbelievaboat endpoint: {e}")
+            return web.json_response({
+                "status": "error",
+                "message": f"Server error: {str(e)}"
+            }, status=500)
+
+
+async def run():
+    """Run the bot with the HTTP server on the same event loop"""
+    import bot
+
+    server = HealthServer(bot.bot)
+    await server.start()
     try:
-        # Start Flask app on the specified port and bind to all interfaces
-        logger.info(f"Starting Flask server on port {port}...")
-        app.run(host='0.0.0.0', port=port)
-    except Exception as e:
-        logger.error(f"Failed to start server: {e}")
-        raise
+        logger.info("Starting Discord bot...")
+        await bot.main()
+    finally:
+        await server.stop()
+
 
 if __name__ == "__main__":
     logger.info("Starting application...")
     logger.info(f"Current working directory: {os.getcwd()}")
     logger.info(f"Environment variables: PORT={os.environ.get('PORT', 'not set')}")
-    
-    # Start the HTTP server in a separate thread
-    server_thread = threading.Thread(target=run_server)
-    server_thread.daemon = True  # This ensures the thread will exit when the main program exits
-    server_thread.start()
-    logger.info("HTTP server thread started")
-    
-    # Import and run the bot
+
     try:
-        import bot
-        import asyncio
-        logger.info("Starting Discord bot...")
-        asyncio.run(bot.main())
+        asyncio.run(run())
     except Exception as e:
         logger.error(f"Error starting bot: {e}")
         raise
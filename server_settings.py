@@ -2,15 +2,230 @@
 Server Settings Management
 
 This module handles loading, saving, and managing server-specific settings.
+
+Setters only change the settings in memory and mark them dirty. A debounced
+background writer then saves all guilds in one atomic write SAVE_DELAY
+seconds after the last change (at most MAX_SAVE_DELAY after the first), so a
+burst of setup commands across guilds costs a single write off the event loop.
+
+Getters read immutable GuildSettings objects, built once per guild and change
+and cached by guild ID, so a lookup is a single dict hit and role checks are
+set operations.
+
+The bot polls the settings file's modification time and, when someone else
+changed it (a manual edit or another worker process), parses it in a worker
+thread and swaps the new settings in, so no restart is needed.
 """
 
+import asyncio
+import atexit
+import contextlib
+import copy
+import itertools
 import json
 import os
 import config
 import logging
 
+import shared_store
+
 logger = logging.getLogger("discord")
 
+# Callbacks notified whenever a guild's settings change
+_settings_listeners = []
+
+# Guilds whose settings this process changed since the last save
+_changed_guilds = set()
+
+SETTINGS_FILE = "data/server_settings.json"
+
+# Seconds without changes before the settings are written
+SAVE_DELAY = 2.0
+
+# Longest a change waits to be written while changes keep coming in
+MAX_SAVE_DELAY = 10.0
+
+# Defaults for settings a guild has not configured
+DEFAULT_MAX_LOAN_AMOUNT = 1000000000  # 1 billion, effectively unlimited unless restricted
+DEFAULT_MAX_REPAYMENT_DAYS = 365
+DEFAULT_INSTALLMENT_ENABLED = True
+DEFAULT_MIN_INSTALLMENT_PERCENT = 10
+
+# GuildSettings by guild ID, under both the string and the integer form of the ID
+_guild_cache = {}
+
+# Settings versions: a guild's version changes whenever its settings change
+_version_counter = itertools.count(1)
+_guild_versions = {}
+_base_version = next(_version_counter)
+
+# Modification time and size of the settings file when it was last read or written
+_file_stat = None
+
+# State of the debounced writer
+_dirty = False
+_first_change = None
+_save_timer = None
+_save_task = None
+
+
+def _parse_role_ids(role_ids):
+    """Get a frozenset of integer role IDs, skipping IDs that are not numbers"""
+    parsed = set()
+    for role_id in role_ids:
+        try:
+            parsed.add(int(role_id))
+        except (TypeError, ValueError):
+            logger.warning(f"Ignoring invalid role ID in server settings: {role_id!r}")
+    return frozenset(parsed)
+
+
+class GuildSettings:
+    """Immutable, typed settings of one guild, with defaults filled in"""
+
+    __slots__ = (
+        "guild_id",
+        "version",
+        "captain_role_id",
+        "captain_role_ids",
+        "max_loan_amount",
+        "max_repayment_days",
+        "installment_enabled",
+        "min_installment_percent",
+        "admin_channel",
+        "approval_roles",
+        "approval_role_ids"
+    )
+
+    def __init__(self, guild_id, raw, version):
+        """
+        :param guild_id: Discord guild ID as string
+        :param raw: The guild's settings dict from config.SERVER_SETTINGS
+        :param version: The guild's settings version
+        """
+        captain_role_id = raw.get("captain_role_id") or None
+        approval_roles = tuple(str(role_id) for role_id in raw.get("approval_roles") or ())
+
+        values = {
+            "guild_id": guild_id,
+            "version": version,
+            "captain_role_id": str(captain_role_id) if captain_role_id else None,
+            "captain_role_ids": _parse_role_ids([captain_role_id] if captain_role_id else []),
+            "max_loan_amount": raw.get("max_loan_amount", DEFAULT_MAX_LOAN_AMOUNT),
+            "max_repayment_days": raw.get("max_repayment_days", DEFAULT_MAX_REPAYMENT_DAYS),
+            "installment_enabled": raw.get("installment_enabled", DEFAULT_INSTALLMENT_ENABLED),
+            "min_installment_percent": raw.get("min_installment_percent", DEFAULT_MIN_INSTALLMENT_PERCENT),
+            "admin_channel": raw.get("admin_channel", None),
+            "approval_roles": approval_roles,
+            "approval_role_ids": _parse_role_ids(approval_roles)
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GuildSettings is immutable, use the server_settings setters")
+
+    def __delattr__(self, name):
+        raise AttributeError("GuildSettings is immutable, use the server_settings setters")
+
+    def __repr__(self):
+        return f"<GuildSettings guild_id={self.guild_id} version={self.version}>"
+
+    def is_captain(self, member):
+        """
+        Check if a member has the captain role (everyone does if none is set)
+        :param member: Discord member object
+        :return: True if the member may request loans
+        """
+        if not self.captain_role_ids:
+            return True
+        return not self.captain_role_ids.isdisjoint(role.id for role in member.roles)
+
+    def has_approval_role(self, member):
+        """
+        Check if a member has one of the approval roles
+        :param member: Discord member object
+        :return: True if the member has an approval role
+        """
+        if not self.approval_role_ids:
+            return False
+        return not self.approval_role_ids.isdisjoint(role.id for role in member.roles)
+
+
+def get_settings(guild_id):
+    """
+    Get the typed settings of a guild
+    :param guild_id: Discord guild ID as string or integer
+    :return: GuildSettings object
+    """
+    settings = _guild_cache.get(guild_id)
+    if settings is None:
+        settings = _build_settings(guild_id)
+    return settings
+
+
+def _build_settings(guild_id):
+    """Build and cache a guild's GuildSettings"""
+    key = str(guild_id)
+    settings = GuildSettings(key, config.SERVER_SETTINGS.get(key, {}), _guild_versions.get(key, _base_version))
+    
+    _guild_cache[key] = settings
+    if key.isdigit():
+        _guild_cache[int(key)] = settings
+    return settings
+
+
+def get_settings_version(guild_id):
+    """
+    Get the version of a guild's settings, which changes whenever they change
+    :param guild_id: Discord guild ID as string or integer
+    :return: Version number
+    """
+    return get_settings(guild_id).version
+
+
+def _invalidate(guild_id):
+    """Drop a guild's cached settings and give it a new version (None for every guild)"""
+    global _base_version
+    
+    if guild_id is None:
+        _guild_cache.clear()
+        _guild_versions.clear()
+        _base_version = next(_version_counter)
+        return
+    
+    key = str(guild_id)
+    _guild_cache.pop(key, None)
+    if key.isdigit():
+        _guild_cache.pop(int(key), None)
+    _guild_versions[key] = next(_version_counter)
+
+
+def add_settings_listener(callback):
+    """
+    Register a callback that is called whenever settings change
+    :param callback: Function taking the changed guild ID as string (None when all guilds were reloaded)
+    """
+    _settings_listeners.append(callback)
+
+
+def _notify_settings_changed(guild_id):
+    """Record that this process changed a guild's settings and notify the listeners"""
+    if guild_id is not None:
+        _changed_guilds.add(str(guild_id))
+    _notify_listeners(guild_id)
+
+
+def _notify_listeners(guild_id):
+    """Notify all registered listeners that a guild's settings changed"""
+    _invalidate(guild_id)
+    
+    for callback in _settings_listeners:
+        try:
+            callback(guild_id)
+        except Exception as e:
+            logger.error(f"Error in settings listener: {e}")
+
 
 def load_settings():
     """Load server settings from file"""
@@ -19,12 +234,15 @@ def load_settings():
         os.makedirs("data", exist_ok=True)
         
         # Check if the settings file exists
-        if os.path.exists("data/server_settings.json"):
-            with open("data/server_settings.json", "r") as f:
+        if os.path.exists(SETTINGS_FILE):
+            stat = _stat_settings_file()
+            with open(SETTINGS_FILE, "r") as f:
                 settings = json.load(f)
                 
             # Update the config
             config.SERVER_SETTINGS = settings
+            _set_file_stat(stat)
+            _notify_settings_changed(None)
             logger.info("Loaded server settings from file")
         else:
             logger.info("No server settings file found, using defaults")
@@ -32,21 +250,251 @@ def load_settings():
         logger.error(f"Error loading server settings: {e}")
 
 
-def save_settings():
-    """Save server settings to file"""
+def _stat_settings_file():
+    """Get the modification time and size of the settings file (None if it does not exist)"""
     try:
-        # Ensure data directory exists
-        os.makedirs("data", exist_ok=True)
-        
-        # Save to file
-        with open("data/server_settings.json", "w") as f:
-            json.dump(config.SERVER_SETTINGS, f, indent=2)
+        stat = os.stat(SETTINGS_FILE)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def _set_file_stat(stat):
+    """Remember the settings file as last read or written"""
+    global _file_stat
+    _file_stat = stat
+
+
+def _read_if_changed(known_stat):
+    """
+    Read the settings file if it changed since it was last read or written
+    :param known_stat: The file's (mtime, size) when it was last read or written
+    :return: Tuple of (stat, settings dict), settings is None if unchanged or unreadable
+    """
+    stat = _stat_settings_file()
+    if stat is None or stat == known_stat:
+        return stat, None
+    
+    try:
+        with open(SETTINGS_FILE, "r") as f:
+            return stat, json.load(f)
+    except ValueError as e:
+        # Probably caught mid-edit, try again on the next check
+        logger.warning(f"Server settings file changed but could not be parsed, not reloading: {e}")
+        return known_stat, None
+
+
+async def reload_if_changed():
+    """
+    Reload the settings if the file was changed outside this process (a manual
+    edit or another worker process). Guilds with changes not yet saved here keep
+    their settings from memory.
+    :return: Number of guilds whose settings changed
+    """
+    # Our own write in progress updates the file, check again next time
+    if _save_task is not None:
+        return 0
+    
+    stat, on_disk = await asyncio.to_thread(_read_if_changed, _file_stat)
+    if on_disk is None or _save_task is not None:
+        return 0
+    
+    if not isinstance(on_disk, dict):
+        logger.warning("Server settings file does not contain an object, not reloading")
+        _set_file_stat(stat)
+        return 0
+    
+    current = config.SERVER_SETTINGS
+    settings = {}
+    changed = []
+    
+    for guild_id, guild_settings in on_disk.items():
+        if guild_id in _changed_guilds:
+            continue
+        settings[guild_id] = guild_settings
+        if current.get(guild_id) != guild_settings:
+            changed.append(guild_id)
+    
+    for guild_id, guild_settings in current.items():
+        if guild_id in _changed_guilds:
+            settings[guild_id] = guild_settings
+        elif guild_id not in on_disk:
+            changed.append(guild_id)
+    
+    # Swap the whole dict in one assignment so readers never see a partial reload
+    config.SERVER_SETTINGS = settings
+    _set_file_stat(stat)
+    
+    for guild_id in changed:
+        _notify_listeners(guild_id)
+    
+    logger.info(f"Reloaded server settings from file ({len(changed)} guilds changed)")
+    return len(changed)
+
+
+def _write_settings(settings, changed_guilds):
+    """
+    Write the settings file atomically
+    :param settings: Settings of all guilds to write
+    :param changed_guilds: Guilds this process changed, the others are taken from disk
+    :return: Dict of the guild settings taken from disk
+    """
+    # Ensure data directory exists
+    os.makedirs("data", exist_ok=True)
+    
+    # Worker processes share the settings file, so hold the shared lock and
+    # keep the other processes' guilds as they are on disk
+    store = shared_store.get_shared_store()
+    from_disk = {}
+    
+    with store.hold("server_settings") if store else contextlib.nullcontext():
+        if store is not None and os.path.exists(SETTINGS_FILE):
+            with open(SETTINGS_FILE, "r") as f:
+                on_disk = json.load(f)
             
+            for guild_id, guild_settings in on_disk.items():
+                if guild_id not in changed_guilds and settings.get(guild_id) != guild_settings:
+                    settings[guild_id] = guild_settings
+                    from_disk[guild_id] = guild_settings
+        
+        # Write to a temporary file and move it into place, so a crash
+        # mid-write never leaves a truncated settings file
+        temp_path = f"{SETTINGS_FILE}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(settings, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, SETTINGS_FILE)
+        
+        # Our own write must not trigger a reload
+        _set_file_stat(_stat_settings_file())
+    
+    return from_disk
+
+
+def save_settings():
+    """Save server settings to file right away"""
+    global _dirty, _first_change
+    
+    _dirty = False
+    _first_change = None
+    try:
+        from_disk = _write_settings(config.SERVER_SETTINGS, _changed_guilds)
+        for guild_id in from_disk:
+            _notify_listeners(guild_id)
+        _changed_guilds.clear()
         logger.info("Server settings saved to file")
     except Exception as e:
+        _dirty = True
         logger.error(f"Error saving server settings: {e}")
 
 
+def schedule_save():
+    """
+    Mark the settings dirty and save them once changes stop coming in.
+    Without a running event loop (e.g. in scripts) the settings are saved right away.
+    """
+    global _dirty, _first_change
+    
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        save_settings()
+        return
+    
+    _dirty = True
+    if _first_change is None:
+        _first_change = loop.time()
+    
+    # A write in progress reschedules itself if more changes came in
+    if _save_task is None:
+        _schedule_timer(loop)
+
+
+def _schedule_timer(loop):
+    """(Re)start the debounce timer of the background writer"""
+    global _save_timer
+    
+    if _save_timer is not None:
+        _save_timer.cancel()
+    
+    delay = min(SAVE_DELAY, max(0.0, _first_change + MAX_SAVE_DELAY - loop.time()))
+    _save_timer = loop.call_later(delay, _start_write)
+
+
+def _start_write():
+    """Start the background write when the debounce timer fires"""
+    global _save_timer, _save_task
+    
+    _save_timer = None
+    _save_task = asyncio.get_running_loop().create_task(_write_pending())
+
+
+async def _write_pending():
+    """Write the dirty settings in a worker thread"""
+    global _dirty, _first_change, _save_task
+    
+    loop = asyncio.get_running_loop()
+    try:
+        if not _dirty:
+            return
+        
+        # Snapshot on the event loop so setters can keep changing the settings meanwhile
+        settings = copy.deepcopy(config.SERVER_SETTINGS)
+        changed_guilds = set(_changed_guilds)
+        _changed_guilds.clear()
+        _dirty = False
+        _first_change = None
+        
+        try:
+            from_disk = await asyncio.to_thread(_write_settings, settings, changed_guilds)
+        except Exception as e:
+            logger.error(f"Error saving server settings: {e}")
+            _changed_guilds.update(changed_guilds)
+            _dirty = True
+            _first_change = loop.time()
+            return
+        
+        # Take other processes' guilds, unless they were changed here during the write
+        for guild_id, guild_settings in from_disk.items():
+            if guild_id not in _changed_guilds:
+                config.SERVER_SETTINGS[guild_id] = guild_settings
+                _notify_listeners(guild_id)
+        
+        logger.info(f"Server settings saved to file ({len(changed_guilds) or 'all'} guilds changed)")
+    finally:
+        _save_task = None
+        if _dirty:
+            _schedule_timer(loop)
+
+
+async def flush_settings():
+    """Write any pending settings changes now, e.g. before shutting down"""
+    global _save_timer
+    
+    if _save_timer is not None:
+        _save_timer.cancel()
+        _save_timer = None
+    
+    if _save_task is not None:
+        await _save_task
+    
+    # A failed or interrupted write leaves the settings dirty, try once more
+    if _save_timer is not None:
+        _save_timer.cancel()
+        _save_timer = None
+    if _dirty:
+        await _write_pending()
+
+
+@atexit.register
+def _save_at_exit():
+    """Last resort if the process exits without flush_settings(): save pending changes synchronously"""
+    if _dirty:
+        logger.warning("Saving server settings changes still pending at exit")
+        save_settings()
+
+
 def get_guild_settings(guild_id):
     """
     Get settings for a specific guild
@@ -68,9 +516,10 @@ def save_guild_settings(guild_id, settings):
     
     # Update the settings in memory
     config.SERVER_SETTINGS[guild_id] = settings
+    _notify_settings_changed(guild_id)
     
     # Save to file
-    save_settings()
+    schedule_save()
     
     return True
 
@@ -91,8 +540,10 @@ def set_captain_role(guild_id, role_id):
     # Update the captain role
     config.SERVER_SETTINGS[guild_id]["captain_role_id"] = role_id
     
+    _notify_settings_changed(guild_id)
+    
     # Save the changes
-    save_settings()
+    schedule_save()
     
     return True
 
@@ -113,8 +564,10 @@ def set_max_loan_amount(guild_id, amount):
     # Update the max loan amount
     config.SERVER_SETTINGS[guild_id]["max_loan_amount"] = amount
     
+    _notify_settings_changed(guild_id)
+    
     # Save the changes
-    save_settings()
+    schedule_save()
     
     return True
 
@@ -135,8 +588,10 @@ def set_max_repayment_days(guild_id, days):
     # Update the max repayment days
     config.SERVER_SETTINGS[guild_id]["max_repayment_days"] = days
     
+    _notify_settings_changed(guild_id)
+    
     # Save the changes
-    save_settings()
+    schedule_save()
     
     return True
 
@@ -157,8 +612,10 @@ def set_installment_enabled(guild_id, enabled):
     # Update the installment enabled setting
     config.SERVER_SETTINGS[guild_id]["installment_enabled"] = enabled
     
+    _notify_settings_changed(guild_id)
+    
     # Save the changes
-    save_settings()
+    schedule_save()
     
     return True
 
@@ -185,8 +642,10 @@ def set_min_installment_percent(guild_id, percent):
     # Update the min installment percentage
     config.SERVER_SETTINGS[guild_id]["min_installment_percent"] = percent
     
+    _notify_settings_changed(guild_id)
+    
     # Save the changes
-    save_settings()
+    schedule_save()
     
     return True
 
@@ -197,21 +656,16 @@ def get_captain_role(guild_id):
     :param guild_id: Discord guild ID as string
     :return: Captain role ID as string or None if not set
     """
-    guild_id = str(guild_id)  # Ensure it's a string
-    guild_settings = get_guild_settings(guild_id)
-    return guild_settings.get("captain_role_id", None)
+    return get_settings(guild_id).captain_role_id
 
 
 def get_max_loan_amount(guild_id):
     """
     Get the maximum loan amount for a guild
     :param guild_id: Discord guild ID as string
-    :return: Maximum loan amount as integer or default if not set
+    :return: Maximum loan amount as integer or default (1 billion) if not set
     """
-    guild_id = str(guild_id)  # Ensure it's a string
-    guild_settings = get_guild_settings(guild_id)
-    # Set a significantly high default to make it effectively unlimited unless restricted
-    return guild_settings.get("max_loan_amount", 1000000000)  # Default: 1 billion
+    return get_settings(guild_id).max_loan_amount
 
 
 def get_max_repayment_days(guild_id):
@@ -220,31 +674,25 @@ def get_max_repayment_days(guild_id):
     :param guild_id: Discord guild ID as string
     :return: Maximum repayment days as integer or default (365) if not set
     """
-    guild_id = str(guild_id)  # Ensure it's a string
-    guild_settings = get_guild_settings(guild_id)
-    return guild_settings.get("max_repayment_days", 365)  # Default: 365 days (1 year)
+    return get_settings(guild_id).max_repayment_days
 
 
 def get_installment_enabled(guild_id):
     """
     Check if installment payments are enabled for a guild
     :param guild_id: Discord guild ID as string
-    :return: Boolean indicating if installments are enabled
+    :return: Boolean indicating if installments are enabled (default: enabled)
     """
-    guild_id = str(guild_id)  # Ensure it's a string
-    guild_settings = get_guild_settings(guild_id)
-    return guild_settings.get("installment_enabled", True)  # Default: Enabled
+    return get_settings(guild_id).installment_enabled
 
 
 def get_min_installment_percent(guild_id):
     """
     Get the minimum installment percentage for a guild
     :param guild_id: Discord guild ID as string
-    :return: Minimum installment percentage as integer
+    :return: Minimum installment percentage as integer or default (10) if not set
     """
-    guild_id = str(guild_id)  # Ensure it's a string
-    guild_settings = get_guild_settings(guild_id)
-    return guild_settings.get("min_installment_percent", 10)  # Default: 10%
+    return get_settings(guild_id).min_installment_percent
 
 
 def check_is_captain(guild_id, member):
@@ -254,17 +702,8 @@ def check_is_captain(guild_id, member):
     :param member: Discord member object
     :return: True if member has captain role, False otherwise
     """
-    captain_role_id = get_captain_role(guild_id)
-    
     # If no captain role is set, allow everyone
-    if not captain_role_id:
-        return True
-    
-    # Convert to strings for comparison
-    member_role_ids = [str(role.id) for role in member.roles]
-    
-    # Check if member has the captain role
-    return captain_role_id in member_role_ids
+    return get_settings(guild_id).is_captain(member)
 
 
 def set_admin_channel(guild_id, channel_id):
@@ -293,9 +732,7 @@ def get_admin_channel(guild_id):
     :param guild_id: Discord guild ID as string
     :return: Channel ID as string or None if not set
     """
-    guild_id = str(guild_id)  # Ensure it's a string
-    guild_settings = get_guild_settings(guild_id)
-    return guild_settings.get("admin_channel", None)
+    return get_settings(guild_id).admin_channel
 
 
 def set_approval_roles(guild_id, role_ids):
@@ -314,8 +751,10 @@ def set_approval_roles(guild_id, role_ids):
     # Update approval roles
     config.SERVER_SETTINGS[guild_id]["approval_roles"] = role_ids
     
+    _notify_settings_changed(guild_id)
+    
     # Save settings
-    save_settings()
+    schedule_save()
     
     return True
 
@@ -324,8 +763,15 @@ def get_approval_roles(guild_id):
     """
     Get the roles that can approve loan requests
     :param guild_id: Discord guild ID as string
-    :return: List of role IDs as strings or empty list if not set
+    :return: Tuple of role IDs as strings, empty if not set
     """
-    guild_id = str(guild_id)  # Ensure it's a string
-    guild_settings = get_guild_settings(guild_id)
-    return guild_settings.get("approval_roles", []) 
\ No newline at end of file
+    return get_settings(guild_id).approval_roles
+
+
+def get_approval_role_ids(guild_id):
+    """
+    Get the roles that can approve loan requests as integers
+    :param guild_id: Discord guild ID as string or integer
+    :return: Frozenset of role IDs as integers
+    """
+    return get_settings(guild_id).approval_role_ids
@@ -0,0 +1,225 @@
+"""
+Sharding
+
+This module contains the helpers for the opt-in AutoShardedBot mode
+(config.SHARDING). Guilds are mapped to shards the same way Discord does,
+and the loan database backup is partitioned by shard: every shard writes
+only its own guilds' loans, history and loan requests to
+data/database.shard<N>.json. Data that is not tied to a guild (credit
+scores, credit adjustments) is written to data/database.global.json by the
+lowest shard this process runs. The module also keeps per-shard command
+counters for the /botstats command.
+"""
+
+import json
+import logging
+import os
+import time
+
+try:
+    import config
+except ModuleNotFoundError:
+    config = None
+
+logger = logging.getLogger("discord")
+
+# Defaults used when config.SHARDING is missing or incomplete
+DEFAULT_SHARDING_SETTINGS = {
+    "ENABLED": False,       # Use AutoShardedBot
+    "SHARD_COUNT": None,    # None lets Discord recommend a shard count
+    "SHARD_IDS": None,      # Shards run by this process (None for all), needs SHARD_COUNT
+    "BACKUP_MINUTES": 5     # Interval of each shard's backup task
+}
+
+# Database collections whose records carry a guild_id and are partitioned
+GUILD_COLLECTIONS = ("loans", "history", "loan_requests")
+
+DATA_DIR = "data"
+GLOBAL_BACKUP_FILE = os.path.join(DATA_DIR, "database.global.json")
+
+
+def get_sharding_settings():
+    """
+    Get the sharding settings merged with defaults
+    :return: Dict of sharding settings
+    """
+    settings = dict(DEFAULT_SHARDING_SETTINGS)
+    settings.update(getattr(config, "SHARDING", {}) or {})
+
+    # discord.py needs the total shard count to run a subset of shards
+    if settings["SHARD_IDS"] and not settings["SHARD_COUNT"]:
+        logger.warning("SHARD_IDS is set without SHARD_COUNT, running all shards")
+        settings["SHARD_IDS"] = None
+
+    return settings
+
+
+def get_shard_options(settings=None):
+    """
+    Get the keyword arguments for creating an AutoShardedBot
+    :param settings: Sharding settings dict (defaults to config.SHARDING)
+    :return: Dict with shard_count and shard_ids if configured
+    """
+    if settings is None:
+        settings = get_sharding_settings()
+
+    options = {}
+    if settings.get("SHARD_COUNT"):
+        options["shard_count"] = int(settings["SHARD_COUNT"])
+    if settings.get("SHARD_IDS"):
+        options["shard_ids"] = [int(shard_id) for shard_id in settings["SHARD_IDS"]]
+
+    return options
+
+
+def shard_id_for_guild(guild_id, shard_count):
+    """
+    Get the shard a guild belongs to
+    :param guild_id: Discord guild ID
+    :param shard_count: Total number of shards
+    :return: Shard ID
+    """
+    return (int(guild_id) >> 22) % max(1, int(shard_count or 1))
+
+
+def get_shard_count(bot):
+    """Get the bot's total shard count (1 when not sharded)"""
+    return getattr(bot, "shard_count", None) or 1
+
+
+def get_owned_shards(bot):
+    """Get the shard IDs run by this process"""
+    shard_ids = getattr(bot, "shard_ids", None)
+    if shard_ids:
+        return sorted(shard_ids)
+    return list(range(get_shard_count(bot)))
+
+
+def shard_backup_path(shard_id):
+    """Get the backup file of a shard"""
+    return os.path.join(DATA_DIR, f"database.shard{shard_id}.json")
+
+
+def list_shard_backups():
+    """
+    Find the shard backup files on disk
+    :return: List of file paths
+    """
+    if not os.path.isdir(DATA_DIR):
+        return []
+
+    return sorted(
+        os.path.join(DATA_DIR, filename)
+        for filename in os.listdir(DATA_DIR)
+        if filename.startswith("database.shard") and filename.endswith(".json")
+    )
+
+
+def _write_json_atomic(path, data):
+    """Write JSON to a temporary file and move it into place"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f, indent=2, default=str)
+    os.replace(temp_path, path)
+
+
+def partition_database(loan_database, shard_id, shard_count):
+    """
+    Get the guild records of one shard
+    :param loan_database: The bot's loan database dict
+    :return: Dict with the shard's records of each guild collection
+    """
+    partition = {}
+
+    for collection in GUILD_COLLECTIONS:
+        partition[collection] = [
+            record for record in loan_database.get(collection, [])
+            if record and record.get("guild_id") and
+            shard_id_for_guild(record["guild_id"], shard_count) == shard_id
+        ]
+
+    return partition
+
+
+def save_shard_backup(loan_database, shard_id, shard_count, include_global=False):
+    """
+    Back up one shard's partition of the loan database
+    :param loan_database: The bot's loan database dict
+    :param shard_id: Shard to back up
+    :param shard_count: Total number of shards
+    :param include_global: Also write the data not tied to a guild
+    """
+    partition = partition_database(loan_database, shard_id, shard_count)
+    partition["shard_id"] = shard_id
+    partition["shard_count"] = shard_count
+    _write_json_atomic(shard_backup_path(shard_id), partition)
+
+    if include_global:
+        global_data = {
+            key: value for key, value in loan_database.items()
+            if key not in GUILD_COLLECTIONS
+        }
+        _write_json_atomic(GLOBAL_BACKUP_FILE, global_data)
+
+    logger.info(f"Shard {shard_id} database backed up ({sum(len(partition[c]) for c in GUILD_COLLECTIONS)} records)")
+
+
+def load_shard_backups(shard_ids=None, shard_count=None):
+    """
+    Merge the shard backups into a single database dict
+    :param shard_ids: Shards run by this process (None for all)
+    :param shard_count: Total number of shards, used to keep only the records of shard_ids
+    :return: Database dict, or None if there are no shard backups
+    """
+    paths = list_shard_backups()
+    if not paths:
+        return None
+
+    data = {collection: [] for collection in GUILD_COLLECTIONS}
+
+    for path in paths:
+        try:
+            with open(path, "r") as f:
+                partition = json.load(f)
+        except Exception as e:
+            logger.error(f"Error reading shard backup {path}: {e}")
+            continue
+
+        for collection in GUILD_COLLECTIONS:
+            for record in partition.get(collection, []):
+                # Records are re-partitioned in case the shard count changed
+                if shard_ids and shard_count and record.get("guild_id"):
+                    if shard_id_for_guild(record["guild_id"], shard_count) not in shard_ids:
+                        continue
+                data[collection].append(record)
+
+    if os.path.exists(GLOBAL_BACKUP_FILE):
+        try:
+            with open(GLOBAL_BACKUP_FILE, "r") as f:
+                data.update(json.load(f))
+        except Exception as e:
+            logger.error(f"Error reading global backup: {e}")
+
+    logger.info(f"Loaded {len(paths)} shard backups")
+    return data
+
+
+class ShardStats:
+    def __init__(self):
+        """Initialize the per-shard command counters"""
+        self.started_at = time.monotonic()
+        self.commands = {}
+
+    def record_command(self, shard_id):
+        """Count an application command handled by a shard"""
+        self.commands[shard_id] = self.commands.get(shard_id, 0) + 1
+
+    def get_command_count(self, shard_id):
+        """Get the number of commands a shard has handled"""
+        return self.commands.get(shard_id, 0)
+
+    def get_command_rate(self, shard_id):
+        """Get a shard's average commands per minute since startup"""
+        minutes = max((time.monotonic() - self.started_at) / 60, 1 / 60)
+        return self.get_command_count(shard_id) / minutes
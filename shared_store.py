@@ -0,0 +1,987 @@
+"""
+Shared Store
+
+This module provides the SQLite (WAL mode) store used when the bot runs as
+several worker processes (see launch_workers.py). Every worker keeps its own
+shards' loans in memory as before, but writes each change through to the
+shared database. Mutations that must be serialized across processes
+(approving, denying and repaying a loan) run under an advisory lock held in
+the database, and loan IDs and credit score changes are allocated and
+applied atomically in SQL, so two processes can never hand out the same
+loan ID or lose a credit score update.
+
+The store is enabled by setting MULTIPROCESS["STORE_PATH"] in config.py (or
+the SHARED_STORE_PATH environment variable). Without it none of this is used
+and the bot keeps its JSON backups.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import datetime
+import json
+import logging
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from loan_locks import loan_locks
+
+try:
+    import config
+except ModuleNotFoundError:
+    config = None
+
+logger = logging.getLogger("discord")
+
+# Defaults used when config.MULTIPROCESS is missing or incomplete
+DEFAULT_MULTIPROCESS_SETTINGS = {
+    "STORE_PATH": "",       # Path of the shared SQLite database, empty to disable
+    "WORKERS": 2,           # Worker processes started by launch_workers.py
+    "SHARD_COUNT": 2,       # Total shards split across the workers
+    "LOCK_TIMEOUT": 30,     # Seconds to wait for a loan lock
+    "LOCK_TTL": 120         # Seconds after which a lock of a crashed worker expires
+}
+
+# Collections stored one row per loan, keyed by (guild_id, loan_id)
+KEYED_COLLECTIONS = ("loans", "loan_requests")
+
+# Record fields holding datetimes
+DATE_FIELDS = ("request_date", "due_date", "approved_date", "denied_date", "repaid_date")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS loans (
+    guild_id TEXT NOT NULL,
+    loan_id TEXT NOT NULL,
+    user_id TEXT,
+    status TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (guild_id, loan_id)
+);
+CREATE TABLE IF NOT EXISTS loan_requests (
+    guild_id TEXT NOT NULL,
+    loan_id TEXT NOT NULL,
+    user_id TEXT,
+    status TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (guild_id, loan_id)
+);
+CREATE INDEX IF NOT EXISTS loans_user ON loans (guild_id, user_id, status);
+CREATE INDEX IF NOT EXISTS loan_requests_user ON loan_requests (guild_id, user_id, status);
+CREATE TABLE IF NOT EXISTS history (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id TEXT,
+    loan_id TEXT,
+    user_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_guild ON history (guild_id);
+CREATE TABLE IF NOT EXISTS credit_scores (
+    user_id TEXT PRIMARY KEY,
+    score INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS credit_adjustments (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS user_stats (
+    guild_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (guild_id, user_id)
+);
+CREATE TABLE IF NOT EXISTS daily_stats (
+    guild_id TEXT NOT NULL,
+    day TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (guild_id, day)
+);
+CREATE TABLE IF NOT EXISTS import_progress (
+    source TEXT NOT NULL,
+    collection TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (source, collection)
+);
+CREATE TABLE IF NOT EXISTS loan_ids (
+    loan_id TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS locks (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+class LockTimeout(Exception):
+    """Raised when a shared lock could not be acquired in time"""
+    pass
+
+
+def get_multiprocess_settings():
+    """
+    Get the multi-process settings merged with defaults
+    :return: Dict of multi-process settings
+    """
+    settings = dict(DEFAULT_MULTIPROCESS_SETTINGS)
+    settings.update(getattr(config, "MULTIPROCESS", {}) or {})
+
+    # The launcher passes the store path to its workers
+    if os.environ.get("SHARED_STORE_PATH"):
+        settings["STORE_PATH"] = os.environ["SHARED_STORE_PATH"]
+
+    return settings
+
+
+def _encode(value):
+    """JSON encoder for datetimes and other non-JSON values"""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_record(record):
+    """Serialize a record for storage"""
+    return json.dumps(record, default=_encode)
+
+
+def decode_record(data):
+    """Deserialize a stored record, restoring datetime fields"""
+    record = json.loads(data)
+
+    for field in DATE_FIELDS:
+        if isinstance(record.get(field), str):
+            try:
+                record[field] = datetime.datetime.fromisoformat(record[field])
+            except ValueError:
+                pass
+
+    return record
+
+
+class SharedStore:
+    def __init__(self, path, lock_timeout=30, lock_ttl=120):
+        """
+        Open (and create if needed) the shared store
+        :param path: Path of the SQLite database file
+        :param lock_timeout: Default seconds to wait for a lock
+        :param lock_ttl: Seconds after which an unreleased lock expires
+        """
+        self.path = path
+        self.lock_timeout = lock_timeout
+        self.lock_ttl = lock_ttl
+        self.process_name = f"{socket.gethostname()}:{os.getpid()}"
+        self._local = threading.local()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        logger.info(f"Shared store opened at {path}")
+
+    def _connection(self):
+        """Get this thread's connection (SQLite connections are not shared between threads)"""
+        conn = getattr(self._local, "conn", None)
+
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+
+        return conn
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Run statements in a write transaction (BEGIN IMMEDIATE serializes writers across processes)"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def is_empty(self):
+        """Check if the store holds no loan data yet"""
+        conn = self._connection()
+        for table in ("loans", "loan_requests", "history", "credit_scores"):
+            if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                return False
+        return True
+
+    # ----- Loading -----
+
+    def load_database(self, shard_ids=None, shard_count=None):
+        """
+        Load a loan database dict, optionally only the guilds of some shards
+        :param shard_ids: Shards run by this process (None for all)
+        :param shard_count: Total number of shards
+        :return: Database dict in the same shape as the JSON backup
+        """
+        conn = self._connection()
+        where = ""
+        params = ()
+
+        # Same mapping as sharding.shard_id_for_guild
+        if shard_ids and shard_count:
+            placeholders = ",".join("?" for _ in shard_ids)
+            where = f" WHERE ((CAST(guild_id AS INTEGER) >> 22) % ?) IN ({placeholders})"
+            params = (int(shard_count), *[int(shard_id) for shard_id in shard_ids])
+
+        # Records are returned as stored (dates as ISO strings), like the JSON backup
+        data = {}
+        for collection in KEYED_COLLECTIONS:
+            rows = conn.execute(f"SELECT data FROM {collection}{where}", params)
+            data[collection] = [json.loads(row[0]) for row in rows]
+
+        # Stores written before repaid loans were deleted still hold them
+        data["loans"] = [loan for loan in data["loans"] if loan.get("status") != "repaid"]
+
+        rows = conn.execute(f"SELECT data FROM history{where} ORDER BY seq", params)
+        data["history"] = [json.loads(row[0]) for row in rows]
+
+        data["user_stats"] = {}
+        for guild_id, user_id, stats in conn.execute(f"SELECT guild_id, user_id, data FROM user_stats{where}", params):
+            data["user_stats"].setdefault(guild_id, {})[user_id] = json.loads(stats)
+
+        data["daily_stats"] = {}
+        for guild_id, day, stats in conn.execute(f"SELECT guild_id, day, data FROM daily_stats{where}", params):
+            data["daily_stats"].setdefault(guild_id, {})[day] = json.loads(stats)
+
+        data["credit_scores"] = dict(conn.execute("SELECT user_id, score FROM credit_scores"))
+        data["credit_adjustments"] = [
+            json.loads(row[0]) for row in conn.execute("SELECT data FROM credit_adjustments ORDER BY seq")
+        ]
+
+        return data
+
+    def import_database(self, loan_database):
+        """
+        Copy a whole loan database (e.g. the JSON backup) into the store
+        :param loan_database: Database dict
+        """
+        with self.transaction() as conn:
+            for collection in KEYED_COLLECTIONS:
+                for record in loan_database.get(collection, []):
+                    if record and record.get("id"):
+                        self._upsert(conn, collection, record)
+
+            for record in loan_database.get("history", []):
+                if record:
+                    self._append_history(conn, record)
+
+            for user_id, score in loan_database.get("credit_scores", {}).items():
+                conn.execute(
+                    "INSERT OR REPLACE INTO credit_scores (user_id, score) VALUES (?, ?)",
+                    (str(user_id), int(score))
+                )
+
+            for adjustment in loan_database.get("credit_adjustments", []):
+                conn.execute(
+                    "INSERT INTO credit_adjustments (user_id, data) VALUES (?, ?)",
+                    (adjustment.get("user_id"), encode_record(adjustment))
+                )
+
+            for guild_id, users in loan_database.get("user_stats", {}).items():
+                for user_id, stats in users.items():
+                    self._set_user_stats(conn, guild_id, user_id, stats)
+
+            for guild_id, days in loan_database.get("daily_stats", {}).items():
+                for day, stats in days.items():
+                    self._set_daily_stats(conn, guild_id, day, stats)
+
+        logger.info("Imported loan database into the shared store")
+
+    def import_records(self, collection, records, source=None, position=None):
+        """
+        Import a batch of records from one collection of a JSON backup in one transaction
+        :param collection: "loans", "loan_requests", "history", "credit_adjustments" or "credit_scores"
+        :param records: List of records ((user_id, score) pairs for credit_scores)
+        :param source: If given, the import's progress is saved under this name ...
+        :param position: ... as the number of records of the collection imported so far
+        """
+        with self.transaction() as conn:
+            for record in records:
+                if collection in KEYED_COLLECTIONS:
+                    self._upsert(conn, collection, record)
+                elif collection == "history":
+                    self._append_history(conn, record)
+                elif collection == "credit_adjustments":
+                    conn.execute(
+                        "INSERT INTO credit_adjustments (user_id, data) VALUES (?, ?)",
+                        (record.get("user_id"), encode_record(record))
+                    )
+                elif collection == "credit_scores":
+                    conn.execute(
+                        "INSERT OR REPLACE INTO credit_scores (user_id, score) VALUES (?, ?)",
+                        (str(record[0]), int(record[1]))
+                    )
+
+            # Saved with the batch, so a resumed import neither skips nor repeats records
+            if source is not None:
+                conn.execute(
+                    "INSERT OR REPLACE INTO import_progress (source, collection, position) VALUES (?, ?, ?)",
+                    (source, collection, position)
+                )
+
+    def get_import_progress(self, source):
+        """
+        Get how far an import got
+        :return: Dict of collection to number of records imported
+        """
+        rows = self._connection().execute(
+            "SELECT collection, position FROM import_progress WHERE source = ?", (source,)
+        )
+        return dict(rows)
+
+    def iter_records(self, collection, batch_size=1000):
+        """
+        Iterate over the stored records of a collection without loading them all
+        :param collection: "loans", "loan_requests" or "history"
+        :param batch_size: Rows fetched at a time
+        :return: Generator of record dicts, as stored (dates as ISO strings)
+        """
+        order = " ORDER BY seq" if collection == "history" else ""
+        cursor = self._connection().execute(f"SELECT data FROM {collection}{order}")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield json.loads(row[0])
+
+    def get_guild_totals(self, collection):
+        """
+        Get per-guild record counts and amount sums of a collection
+        :param collection: "loans", "loan_requests" or "history"
+        :return: Dict of guild_id to (count, sum of amount, sum of total_repayment)
+        """
+        rows = self._connection().execute(
+            f"SELECT guild_id, COUNT(*), TOTAL(json_extract(data, '$.amount')), "
+            f"TOTAL(json_extract(data, '$.total_repayment')) FROM {collection} GROUP BY guild_id"
+        )
+        return {guild_id: (count, amount, total) for guild_id, count, amount, total in rows}
+
+    # ----- Records -----
+
+    def _upsert(self, conn, collection, record):
+        """Insert or replace a keyed record"""
+        loan_id = str(record.get("id"))
+        conn.execute(
+            f"INSERT OR REPLACE INTO {collection} (guild_id, loan_id, user_id, status, data) VALUES (?, ?, ?, ?, ?)",
+            (str(record.get("guild_id")), loan_id, record.get("user_id"), record.get("status"), encode_record(record))
+        )
+        conn.execute("INSERT OR IGNORE INTO loan_ids (loan_id) VALUES (?)", (loan_id,))
+
+    def _append_history(self, conn, record):
+        """Append a record to the loan history"""
+        conn.execute(
+            "INSERT INTO history (guild_id, loan_id, user_id, data) VALUES (?, ?, ?, ?)",
+            (str(record.get("guild_id")), str(record.get("id")), record.get("user_id"), encode_record(record))
+        )
+
+    def _set_user_stats(self, conn, guild_id, user_id, stats):
+        """Insert or replace a user's loan statistics"""
+        conn.execute(
+            "INSERT OR REPLACE INTO user_stats (guild_id, user_id, data) VALUES (?, ?, ?)",
+            (str(guild_id), str(user_id), json.dumps(stats))
+        )
+
+    def _set_daily_stats(self, conn, guild_id, day, stats):
+        """Insert or replace a guild's loan statistics for a day (deleted if empty)"""
+        if not stats:
+            conn.execute("DELETE FROM daily_stats WHERE guild_id = ? AND day = ?", (str(guild_id), day))
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO daily_stats (guild_id, day, data) VALUES (?, ?, ?)",
+            (str(guild_id), day, json.dumps(stats))
+        )
+
+    def get_user_stats(self, guild_id, user_id):
+        """
+        Get the stored loan statistics of a user in a guild
+        :return: Dict of stat field to value, or None if not stored
+        """
+        row = self._connection().execute(
+            "SELECT data FROM user_stats WHERE guild_id = ? AND user_id = ?",
+            (str(guild_id), str(user_id))
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_history_record(self, guild_id, loan_id):
+        """
+        Get the latest history entry of a loan
+        :return: Record dict, or None if the loan is not in the history
+        """
+        row = self._connection().execute(
+            "SELECT data FROM history WHERE guild_id = ? AND loan_id = ? ORDER BY seq DESC LIMIT 1",
+            (str(guild_id), str(loan_id))
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_daily_stats(self, guild_id, day):
+        """
+        Get the stored loan statistics of a guild for a day
+        :return: Dict of daily stat field to value (empty if not stored)
+        """
+        row = self._connection().execute(
+            "SELECT data FROM daily_stats WHERE guild_id = ? AND day = ?",
+            (str(guild_id), day)
+        ).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def set_user_stats(self, rows):
+        """
+        Replace the loan statistics of some users (e.g. after reconciling them)
+        :param rows: List of (guild_id, user_id, stats dict)
+        """
+        with self.transaction() as conn:
+            for guild_id, user_id, stats in rows:
+                self._set_user_stats(conn, guild_id, user_id, stats)
+
+    def set_daily_stats(self, rows):
+        """
+        Replace the daily loan statistics of some guilds (e.g. after reconciling them)
+        :param rows: List of (guild_id, day, stats dict)
+        """
+        with self.transaction() as conn:
+            for guild_id, day, stats in rows:
+                self._set_daily_stats(conn, guild_id, day, stats)
+
+    def get_record(self, collection, guild_id, loan_id):
+        """
+        Get the stored copy of a loan or loan request
+        :return: Record dict, or None if not stored
+        """
+        row = self._connection().execute(
+            f"SELECT data FROM {collection} WHERE guild_id = ? AND loan_id = ?",
+            (str(guild_id), str(loan_id))
+        ).fetchone()
+        return decode_record(row[0]) if row else None
+
+    def apply_changes(self, upserts=None, deletes=None, history=None, credit_deltas=None, adjustments=None, stat_deltas=None,
+                      daily_deltas=None):
+        """
+        Write a set of changes in one transaction
+        :param upserts: List of (collection, record) to insert or replace
+        :param deletes: List of (collection, record) to delete
+        :param history: List of records appended to the history
+        :param credit_deltas: Dict of user ID to credit score change
+        :param adjustments: List of credit adjustment log entries
+        :param stat_deltas: Dict of (guild_id, user_id) to loan statistics changes
+        :param daily_deltas: Dict of (guild_id, day) to daily loan statistics changes
+        :return: Dict of user ID to new credit score for the changed users
+        """
+        new_scores = {}
+
+        with self.transaction() as conn:
+            for collection, record in upserts or []:
+                self._upsert(conn, collection, record)
+
+            for collection, record in deletes or []:
+                conn.execute(
+                    f"DELETE FROM {collection} WHERE guild_id = ? AND loan_id = ?",
+                    (str(record.get("guild_id")), str(record.get("id")))
+                )
+
+            for record in history or []:
+                self._append_history(conn, record)
+
+            for user_id, delta in (credit_deltas or {}).items():
+                conn.execute(
+                    "INSERT INTO credit_scores (user_id, score) VALUES (?, 100 + ?) "
+                    "ON CONFLICT (user_id) DO UPDATE SET score = score + excluded.score - 100",
+                    (str(user_id), int(delta))
+                )
+                row = conn.execute("SELECT score FROM credit_scores WHERE user_id = ?", (str(user_id),)).fetchone()
+                new_scores[str(user_id)] = row[0]
+
+            for adjustment in adjustments or []:
+                conn.execute(
+                    "INSERT INTO credit_adjustments (user_id, data) VALUES (?, ?)",
+                    (adjustment.get("user_id"), encode_record(adjustment))
+                )
+
+            for (guild_id, user_id), delta in (stat_deltas or {}).items():
+                row = conn.execute(
+                    "SELECT data FROM user_stats WHERE guild_id = ? AND user_id = ?",
+                    (str(guild_id), str(user_id))
+                ).fetchone()
+                stats = json.loads(row[0]) if row else {}
+                for field, value in delta.items():
+                    stats[field] = stats.get(field, 0) + value
+                self._set_user_stats(conn, guild_id, user_id, stats)
+
+            for (guild_id, day), delta in (daily_deltas or {}).items():
+                row = conn.execute(
+                    "SELECT data FROM daily_stats WHERE guild_id = ? AND day = ?",
+                    (str(guild_id), day)
+                ).fetchone()
+                stats = json.loads(row[0]) if row else {}
+                for field, value in delta.items():
+                    stats[field] = stats.get(field, 0) + value
+                self._set_daily_stats(conn, guild_id, day, {field: value for field, value in stats.items() if value})
+
+        return new_scores
+
+    def reserve_loan_id(self, min_id=1000, max_id=9999):
+        """
+        Reserve a loan ID no process has used before
+        :return: Loan ID as string
+        """
+        with self.transaction() as conn:
+            used = conn.execute("SELECT COUNT(*) FROM loan_ids").fetchone()[0]
+            if used > max_id - min_id:
+                raise RuntimeError("All loan IDs are in use")
+
+            while True:
+                loan_id = str(random.randint(min_id, max_id))
+                if conn.execute("INSERT OR IGNORE INTO loan_ids (loan_id) VALUES (?)", (loan_id,)).rowcount:
+                    return loan_id
+
+    def try_insert_request(self, request):
+        """
+        Insert a pending loan request unless the user already has an active loan
+        or pending request in the guild. The check and insert share one write
+        transaction, so concurrent submissions from any process insert at most one
+        :param request: The new loan request
+        :return: The existing loan or request, or None if the request was inserted
+        """
+        guild_id = str(request.get("guild_id"))
+        user_id = str(request.get("user_id"))
+
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT data FROM loans WHERE guild_id = ? AND user_id = ? AND status IN ('active', 'active_partial') "
+                "UNION ALL SELECT data FROM loan_requests WHERE guild_id = ? AND user_id = ? AND status = 'pending' "
+                "LIMIT 1",
+                (guild_id, user_id, guild_id, user_id)
+            ).fetchone()
+            if row:
+                return decode_record(row[0])
+
+            self._upsert(conn, "loan_requests", request)
+
+        return None
+
+    # ----- Advisory locks -----
+
+    def try_acquire(self, name, token, ttl=None):
+        """
+        Try to take a named lock once
+        :param name: Lock name
+        :param token: Unique token of this acquisition
+        :param ttl: Seconds after which the lock expires if never released
+        :return: True if the lock was taken
+        """
+        now = time.time()
+
+        with self.transaction() as conn:
+            row = conn.execute("SELECT expires_at FROM locks WHERE name = ?", (name,)).fetchone()
+            if row and row[0] > now:
+                return False
+
+            conn.execute(
+                "INSERT OR REPLACE INTO locks (name, owner, expires_at) VALUES (?, ?, ?)",
+                (name, token, now + (ttl or self.lock_ttl))
+            )
+            return True
+
+    def release(self, name, token):
+        """Release a named lock if it is still held with the given token"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM locks WHERE name = ? AND owner = ?", (name, token))
+
+    @contextlib.contextmanager
+    def hold(self, name, timeout=None):
+        """
+        Hold a named lock from synchronous code
+        :param name: Lock name
+        :param timeout: Seconds to wait before raising LockTimeout
+        """
+        token = f"{self.process_name}:{uuid.uuid4().hex}"
+        deadline = time.monotonic() + (timeout or self.lock_timeout)
+        delay = 0.005
+
+        while not self.try_acquire(name, token):
+            if time.monotonic() > deadline:
+                raise LockTimeout(name)
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+        try:
+            yield
+        finally:
+            self.release(name, token)
+
+    @contextlib.asynccontextmanager
+    async def locked(self, name, timeout=None):
+        """
+        Hold a named lock without blocking the event loop
+        :param name: Lock name
+        :param timeout: Seconds to wait before raising LockTimeout
+        """
+        token = f"{self.process_name}:{uuid.uuid4().hex}"
+        deadline = time.monotonic() + (timeout or self.lock_timeout)
+        delay = 0.005
+
+        while not await asyncio.to_thread(self.try_acquire, name, token):
+            if time.monotonic() > deadline:
+                raise LockTimeout(name)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.25)
+
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self.release, name, token)
+
+
+# Store of this process, opened by open_shared_store()
+_store = None
+
+
+def open_shared_store(settings=None):
+    """
+    Open the configured shared store
+    :param settings: Multi-process settings dict (defaults to config.MULTIPROCESS)
+    :return: SharedStore, or None if no store path is configured
+    """
+    global _store
+
+    if settings is None:
+        settings = get_multiprocess_settings()
+
+    if _store is None and settings.get("STORE_PATH"):
+        _store = SharedStore(
+            settings["STORE_PATH"],
+            lock_timeout=settings.get("LOCK_TIMEOUT", 30),
+            lock_ttl=settings.get("LOCK_TTL", 120)
+        )
+
+    return _store
+
+
+def get_shared_store():
+    """Get the store opened by this process (None if not in multi-process mode)"""
+    return _store
+
+
+@contextlib.asynccontextmanager
+async def shared_lock(name):
+    """
+    Hold a cross-process lock if the shared store is enabled (no-op otherwise)
+    :param name: Lock name, e.g. "loan:1234"
+    """
+    if _store is None:
+        yield
+        return
+
+    async with _store.locked(name):
+        yield
+
+
+async def persist(upserts=None, deletes=None, history=None, credit_deltas=None, adjustments=None, stat_deltas=None,
+                  daily_deltas=None, loan_database=None):
+    """
+    Write changes through to the shared store if enabled (no-op otherwise)
+    :param loan_database: If given, credit scores are updated to the stored values
+    :return: Dict of user ID to new credit score (empty if the store is disabled)
+    """
+    if _store is None:
+        return {}
+
+    new_scores = await asyncio.to_thread(
+        _store.apply_changes,
+        upserts=upserts,
+        deletes=deletes,
+        history=history,
+        credit_deltas=credit_deltas,
+        adjustments=adjustments,
+        stat_deltas=stat_deltas,
+        daily_deltas=daily_deltas
+    )
+
+    # Other processes may have changed the same users' scores
+    if loan_database is not None and new_scores:
+        loan_database.setdefault("credit_scores", {}).update(new_scores)
+
+    return new_scores
+
+
+async def get_stored_record(collection, guild_id, loan_id):
+    """
+    Get the stored copy of a loan or request (None if the store is disabled or it is not stored)
+    """
+    if _store is None:
+        return None
+
+    return await asyncio.to_thread(_store.get_record, collection, guild_id, loan_id)
+
+
+def _snapshot(bot, guild_id, loan_id):
+    """Capture the in-memory state of a loan and its request before a change"""
+    from loan_index import get_loan_index
+    index = get_loan_index(bot)
+    loan_database = bot.loan_database
+
+    request = index.requests.get((str(guild_id), str(loan_id)))
+    loan = index.loans.get(str(loan_id))
+    user_id = (loan or request or {}).get("user_id")
+
+    return {
+        "request": request,
+        "request_data": encode_record(request) if request else None,
+        "loan": loan,
+        "loan_data": encode_record(loan) if loan else None,
+        "history_length": len(loan_database.get("history", [])),
+        "user_id": user_id,
+        "credit_score": loan_database.get("credit_scores", {}).get(user_id, 100) if user_id else None
+    }
+
+
+def _collect_changes(bot, loan_id, before):
+    """Work out what changed on a loan since the snapshot"""
+    from loan_index import get_loan_index
+    index = get_loan_index(bot)
+    loan_database = bot.loan_database
+
+    upserts = []
+
+    request = before["request"]
+    if request is not None and encode_record(request) != before["request_data"]:
+        upserts.append(("loan_requests", request))
+
+    # An approval creates the loan; repaid loans stay stored with their status
+    loan = before["loan"] or index.loans.get(str(loan_id))
+    if loan is not None and (before["loan"] is None or encode_record(loan) != before["loan_data"]):
+        upserts.append(("loans", loan))
+
+    history = [
+        record for record in loan_database.get("history", [])[before["history_length"]:]
+        if record and str(record.get("id")) == str(loan_id)
+    ]
+
+    credit_deltas = {}
+    user_id = before["user_id"] or (loan or request or {}).get("user_id")
+    if user_id:
+        score = loan_database.get("credit_scores", {}).get(user_id, 100)
+        if before["credit_score"] is not None and score != before["credit_score"]:
+            credit_deltas[user_id] = score - before["credit_score"]
+
+    return {"upserts": upserts, "history": history, "credit_deltas": credit_deltas}
+
+
+def _rollback(bot, loan_id, before):
+    """Undo the in-memory changes made to a loan since the snapshot (they were never stored)"""
+    from loan_index import get_loan_index
+    index = get_loan_index(bot)
+    loan_database = bot.loan_database
+
+    request = before["request"]
+    if request is not None and encode_record(request) != before["request_data"]:
+        request.clear()
+        request.update(json.loads(before["request_data"]))
+        index.remove_request(request)
+        index.add_request(request)
+
+    loans = loan_database.setdefault("loans", [])
+    loan = before["loan"]
+    if loan is None:
+        # Drop a loan created since the snapshot
+        created = index.loans.get(str(loan_id))
+        if created is not None:
+            loans[:] = [record for record in loans if record is not created]
+            index.remove_loan(created)
+    else:
+        if encode_record(loan) != before["loan_data"]:
+            loan.clear()
+            loan.update(json.loads(before["loan_data"]))
+        if not any(record is loan for record in loans):
+            loans.append(loan)
+        index.remove_loan(loan)
+        index.add_loan(loan)
+
+    history = loan_database.get("history", [])
+    history[before["history_length"]:] = [
+        record for record in history[before["history_length"]:]
+        if not record or str(record.get("id")) != str(loan_id)
+    ]
+
+    user_id = before["user_id"]
+    if user_id and before["credit_score"] is not None:
+        loan_database.setdefault("credit_scores", {})[user_id] = before["credit_score"]
+
+
+# The loan transaction the current task is running in (multi-process mode only)
+_current_transaction = contextvars.ContextVar("loan_transaction", default=None)
+
+
+@contextlib.asynccontextmanager
+async def loan_transaction(bot, guild_id, loan_id):
+    """
+    Serialize work on a loan within this process (per-loan asyncio lock) and
+    across processes, writing its changes through to the shared store if enabled.
+    If the work fails, its changes are rolled back in memory instead
+    :param bot: The bot instance
+    :param guild_id: Discord guild ID of the loan
+    :param loan_id: The loan ID
+    """
+    async with loan_locks.hold(f"loan:{loan_id}"):
+        if _store is None:
+            yield
+            return
+
+        async with _store.locked(f"loan:{loan_id}"):
+            await _refresh(bot, guild_id, loan_id)
+            transaction = {
+                "guild_id": guild_id,
+                "loan_id": loan_id,
+                "before": _snapshot(bot, guild_id, loan_id),
+                "aborted": False
+            }
+            token = _current_transaction.set(transaction)
+
+            try:
+                yield
+
+                # Handlers that reply with an error themselves abort instead of raising
+                if transaction["aborted"]:
+                    _rollback(bot, loan_id, transaction["before"])
+                else:
+                    changes = _collect_changes(bot, loan_id, transaction["before"])
+                    if any(changes.values()):
+                        await persist(**changes, loan_database=bot.loan_database)
+            except BaseException:
+                # A failed handler (or store write) leaves neither the store nor memory half changed
+                _rollback(bot, loan_id, transaction["before"])
+                raise
+            finally:
+                _current_transaction.reset(token)
+
+
+def abort_loan_transaction():
+    """
+    Mark the current loan transaction as failed (no-op outside one), so its
+    uncommitted changes are rolled back instead of stored. For handlers that
+    catch their own errors to reply to the user
+    """
+    transaction = _current_transaction.get()
+    if transaction is not None:
+        transaction["aborted"] = True
+
+
+def rebase_loan_transaction(bot):
+    """
+    Take a new snapshot for the current loan transaction after its changes
+    were already written (e.g. by a unit of work), so they are not written twice
+    """
+    transaction = _current_transaction.get()
+    if transaction is not None:
+        transaction["before"] = _snapshot(bot, transaction["guild_id"], transaction["loan_id"])
+
+
+def _differs(stored, record):
+    """Check if a stored record differs from the in-memory one in any field"""
+    return json.loads(encode_record(stored)) != json.loads(encode_record(record))
+
+
+async def _refresh(bot, guild_id, loan_id):
+    """Pick up changes another process made to a loan or request since it was loaded"""
+    from loan_index import get_loan_index
+    index = get_loan_index(bot)
+
+    request = index.requests.get((str(guild_id), str(loan_id)))
+    if request is not None:
+        stored = await get_stored_record("loan_requests", guild_id, loan_id)
+        if stored and _differs(stored, request):
+            request.update(stored)
+            index.remove_request(request)
+            index.add_request(request)
+
+    loan = index.loans.get(str(loan_id))
+    if loan is not None:
+        stored = await get_stored_record("loans", guild_id, loan_id)
+        if stored is None:
+            # Another process removed the loan, e.g. repaid it and moved it to the history
+            repaid = await asyncio.to_thread(_store.get_history_record, guild_id, loan_id)
+            if repaid is not None:
+                loans = bot.loan_database.setdefault("loans", [])
+                loans[:] = [record for record in loans if record is not loan]
+                index.remove_loan(loan)
+                bot.loan_database.setdefault("history", []).append(repaid)
+                await _refresh_stats(bot, loan, repaid)
+        elif _differs(stored, loan):
+            previous = dict(loan)
+            loan.update(stored)
+            index.remove_loan(loan)
+            index.add_loan(loan)
+            await _refresh_stats(bot, previous, loan)
+
+
+async def _refresh_stats(bot, previous, loan):
+    """Load the borrower's statistics and the daily buckets another process updated with a loan"""
+    from loan_stats import get_loan_stats, loan_daily_contribution
+    stats = get_loan_stats(bot)
+    guild_id = loan.get("guild_id")
+
+    user_stats = await asyncio.to_thread(_store.get_user_stats, guild_id, loan.get("user_id"))
+    if user_stats is not None:
+        stats.set_user(guild_id, loan.get("user_id"), user_stats)
+
+    # Only the days the loan counts towards, before or after the change, can have moved
+    days = set(loan_daily_contribution("loans", previous))
+    days |= set(loan_daily_contribution("loans", loan)) | set(loan_daily_contribution("history", loan))
+    for day in sorted(days):
+        stats.set_day(guild_id, day, await asyncio.to_thread(_store.get_daily_stats, guild_id, day))
+
+
+@contextlib.asynccontextmanager
+async def lock_loans(bot, loans):
+    """
+    Hold the cross-process locks of several loans, taken in sorted order so two
+    holders never deadlock, and pick up changes other processes made to them
+    (no-op if the store is disabled). For batch jobs that already hold the
+    loans' per-process locks
+    :param bot: The bot instance
+    :param loans: Loan dicts
+    """
+    if _store is None:
+        yield
+        return
+
+    guilds = {str(loan.get("id")): loan.get("guild_id") for loan in loans}
+    async with contextlib.AsyncExitStack() as stack:
+        for loan_id in sorted(guilds):
+            await stack.enter_async_context(_store.locked(f"loan:{loan_id}"))
+            await _refresh(bot, guilds[loan_id], loan_id)
+        yield
+
+
+async def run_in_loan_transaction(bot, interaction, guild_id, loan_id, handler, *args):
+    """
+    Run a loan command handler inside loan_transaction, telling the user to
+    retry if another process holds the loan for too long
+    :param handler: Coroutine function that does the work and replies via followup
+    :param args: Arguments passed to the handler
+    """
+    try:
+        async with loan_transaction(bot, guild_id, loan_id):
+            await handler(*args)
+    except LockTimeout:
+        logger.warning(f"Timed out waiting for the lock of loan #{loan_id}")
+        await interaction.followup.send(
+            f"Loan #{loan_id} is being processed by another request. Please try again in a moment.",
+            ephemeral=True
+        )
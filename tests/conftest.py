@@ -0,0 +1,20 @@
+"""
+Test configuration
+
+Puts the repository root on the import path and, when no config.py exists
+(it is created from config_template.py on deployment), uses the template as
+the config module.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+try:
+    import config  # noqa: F401
+except ModuleNotFoundError:
+    import config_template
+    sys.modules["config"] = config_template
@@ -0,0 +1,88 @@
+"""
+Tests for the acknowledge-first command queue
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from command_queue import CommandQueue, defer_and_enqueue
+
+
+class FakeInteraction:
+    """Interaction that records its deferral and followups"""
+
+    def __init__(self):
+        self.deferred = False
+        self.followups = []
+        self.response = SimpleNamespace(is_done=lambda: self.deferred, defer=self._defer)
+        self.followup = SimpleNamespace(send=self._send)
+
+    async def _defer(self, ephemeral=False):
+        self.deferred = True
+
+    async def _send(self, content=None, **kwargs):
+        self.followups.append(content)
+
+
+def test_work_runs_after_the_interaction_is_acknowledged():
+    async def run():
+        bot = SimpleNamespace(command_queue=CommandQueue(workers=2))
+        interaction = FakeInteraction()
+        done = asyncio.Event()
+        seen = []
+
+        async def handler(value):
+            seen.append((value, interaction.deferred))
+            done.set()
+
+        await defer_and_enqueue(bot, interaction, "repay", handler, 42)
+        await asyncio.wait_for(done.wait(), timeout=2)
+        await bot.command_queue.stop()
+        return seen, bot.command_queue.get_stats()
+
+    seen, stats = asyncio.run(run())
+    assert seen == [(42, True)]
+    assert stats["repay"]["count"] == 1
+
+
+def test_failing_handler_does_not_stop_the_worker():
+    async def run():
+        queue = CommandQueue(workers=1)
+        done = asyncio.Event()
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        async def succeed():
+            done.set()
+
+        queue.submit("fail", fail)
+        queue.submit("succeed", succeed)
+        await asyncio.wait_for(done.wait(), timeout=2)
+        await queue.stop()
+
+    asyncio.run(run())
+
+
+def test_full_queue_tells_the_user_to_retry():
+    async def run():
+        bot = SimpleNamespace(command_queue=CommandQueue(workers=1, max_size=1))
+        blocker = asyncio.Event()
+
+        async def wait():
+            await blocker.wait()
+
+        # One command runs, one waits in the queue, the third is rejected
+        bot.command_queue.submit("approveloan", wait)
+        await asyncio.sleep(0)
+        bot.command_queue.submit("approveloan", wait)
+
+        interaction = FakeInteraction()
+        await defer_and_enqueue(bot, interaction, "approveloan", wait)
+        blocker.set()
+        await bot.command_queue.stop()
+        return interaction, bot.command_queue.get_stats()
+
+    interaction, stats = asyncio.run(run())
+    assert interaction.followups == ["The bot is busy right now. Please try again in a moment."]
+    assert stats["approveloan"]["rejected"] == 1
@@ -0,0 +1,40 @@
+"""
+Tests for the hash-diffed slash command deploy
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import deploy_commands
+from deploy_commands import hash_payload, sync_guilds
+
+
+def test_hash_ignores_command_order():
+    first = {"name": "loan", "description": "Request a loan"}
+    second = {"name": "repay", "description": "Repay a loan"}
+
+    assert hash_payload([first, second]) == hash_payload([second, first])
+    assert hash_payload([first]) != hash_payload([dict(first, description="Borrow")])
+
+
+def test_only_changed_guilds_are_synced(monkeypatch):
+    payloads = {1: [{"name": "loan"}], 2: [{"name": "loan"}, {"name": "repay"}], 3: [{"name": "repay"}]}
+    monkeypatch.setattr(deploy_commands, "build_payload", lambda guild=None: payloads[guild.id])
+
+    synced = []
+
+    async def sync(guild=None):
+        if guild.id == 3:
+            raise RuntimeError("rate limited")
+        synced.append(guild.id)
+
+    monkeypatch.setattr(deploy_commands.bot.tree, "sync", sync)
+
+    guilds = [SimpleNamespace(id=guild_id, name=f"guild {guild_id}") for guild_id in payloads]
+    stored = {"1": hash_payload(payloads[1]), "2": "outdated", "3": "old"}
+    hashes, synced_count, skipped, failed = asyncio.run(sync_guilds(guilds, stored, force=False, concurrency=2))
+
+    assert synced == [2]
+    assert (synced_count, skipped, failed) == (1, 1, 1)
+    # A failed guild keeps its old hash, so it is retried next time
+    assert hashes == {"1": hash_payload(payloads[1]), "2": hash_payload(payloads[2]), "3": "old"}
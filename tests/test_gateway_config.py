@@ -0,0 +1,35 @@
+"""
+Tests for the gateway intents and member cache policy
+"""
+
+from gateway_config import DEFAULT_GATEWAY_SETTINGS, get_bot_options
+
+
+def make_settings(**overrides):
+    """Gateway settings with some values changed"""
+    settings = dict(DEFAULT_GATEWAY_SETTINGS)
+    settings.update(overrides)
+    return settings
+
+
+def test_defaults_request_no_privileged_intents():
+    options = get_bot_options(make_settings())
+    intents = options["intents"]
+
+    assert not intents.members and not intents.presences and not intents.message_content
+    assert intents.guilds
+    assert not options["member_cache_flags"].joined
+    assert not options["chunk_guilds_at_startup"]
+
+
+def test_joined_cache_needs_the_members_intent():
+    assert not get_bot_options(make_settings(MEMBER_CACHE="joined"))["member_cache_flags"].joined
+
+    options = get_bot_options(make_settings(MEMBERS_INTENT=True, MEMBER_CACHE="joined"))
+    assert options["intents"].members
+    assert options["member_cache_flags"].joined
+
+
+def test_chunking_at_startup_needs_the_members_intent():
+    assert not get_bot_options(make_settings(CHUNK_GUILDS_AT_STARTUP=True))["chunk_guilds_at_startup"]
+    assert get_bot_options(make_settings(CHUNK_GUILDS_AT_STARTUP=True, MEMBERS_INTENT=True))["chunk_guilds_at_startup"]
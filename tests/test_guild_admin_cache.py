@@ -0,0 +1,82 @@
+"""
+Tests for the per-guild admin and approver cache
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import server_settings
+from guild_admin_cache import GuildAdminCache
+
+APPROVER_ROLE = 333
+
+
+def make_member(member_id, *role_ids, administrator=False, bot=False):
+    """Create a guild member"""
+    return SimpleNamespace(
+        id=member_id,
+        bot=bot,
+        roles=[SimpleNamespace(id=role_id) for role_id in role_ids],
+        guild_permissions=SimpleNamespace(administrator=administrator)
+    )
+
+
+class FakeGuild:
+    """Guild whose member list counts how often it is scanned"""
+
+    def __init__(self, members):
+        self.id = 111
+        self.owner_id = 999
+        self.chunked = True
+        self._members = members
+        self.scans = 0
+
+    @property
+    def members(self):
+        self.scans += 1
+        return self._members
+
+
+@pytest.fixture(autouse=True)
+def approval_roles(monkeypatch):
+    monkeypatch.setattr(server_settings, "get_approval_role_ids", lambda guild_id: frozenset({APPROVER_ROLE}))
+
+
+def test_admin_is_found_with_one_member_scan():
+    guild = FakeGuild([make_member(1, bot=True, administrator=True), make_member(2, administrator=True)])
+    cache = GuildAdminCache()
+
+    async def run():
+        await asyncio.gather(cache.ensure(guild), cache.ensure(guild))
+        await cache.ensure(guild)
+
+    asyncio.run(run())
+    assert cache.get_admin_id(guild) == 2
+    assert guild.scans == 1
+
+
+def test_member_update_and_fallback_to_owner():
+    approver = make_member(3, APPROVER_ROLE)
+    guild = FakeGuild([approver])
+    cache = GuildAdminCache()
+    asyncio.run(cache.ensure(guild))
+    assert cache.get_admin_id(guild) == 3
+    assert cache.get_approver_ids(guild.id) == [3]
+
+    # The approver role is taken away
+    approver.roles = []
+    approver.guild = guild
+    cache.update_member(approver)
+    assert cache.get_admin_id(guild) == guild.owner_id
+
+
+def test_invalidated_guild_is_rebuilt():
+    guild = FakeGuild([make_member(2, administrator=True)])
+    cache = GuildAdminCache()
+    asyncio.run(cache.ensure(guild))
+
+    cache.invalidate(guild.id)
+    asyncio.run(cache.ensure(guild))
+    assert guild.scans == 2
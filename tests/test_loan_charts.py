@@ -0,0 +1,83 @@
+"""
+Tests for the /loanchart series
+"""
+
+import asyncio
+import concurrent.futures
+import datetime
+from types import SimpleNamespace
+
+import loan_charts
+from loan_charts import ChartRenderer, build_series
+from loan_stats import LoanStats, compute_daily_deltas, compute_deltas
+
+GUILD_ID = "1"
+TODAY = datetime.date(2026, 3, 14)
+
+
+def test_installment_loan_debt_line():
+    loan = {
+        "id": "1001",
+        "guild_id": GUILD_ID,
+        "user_id": "42",
+        "amount": 1000,
+        "interest": 100,
+        "total_repayment": 1150,
+        "amount_repaid": 500,
+        "status": "active_partial",
+        "installment_enabled": True,
+        "approved_date": "2026-03-09T12:00:00",
+        "due_date": "2026-03-11T12:00:00",
+        "late_fee": 50,
+        "late_fee_applied": True,
+        "late_fee_date": "2026-03-12T12:00:00",
+        "last_payment_date": "2026-03-13T12:00:00",
+        "payments": [
+            {"date": "2026-03-10T12:00:00", "amount": 300},
+            {"date": "2026-03-13T12:00:00", "amount": 200}
+        ]
+    }
+    stats = LoanStats()
+    stats.rebuild({"loans": [loan], "history": []})
+
+    series = build_series(stats, GUILD_ID, 7, TODAY)
+
+    # Mar 08 .. Mar 14: lent on the 9th, paid 300 on the 10th, fee on the 12th, paid 200 on the 13th
+    assert series["debt"] == [0, 1100, 800, 800, 850, 650, 650]
+    assert series["repaid"] == [0, 0, 300, 0, 0, 200, 0]
+
+
+def test_chart_is_cached_until_the_guild_changes(monkeypatch):
+    monkeypatch.setattr(loan_charts, "render_chart", lambda title, labels, debt, repaid, currency: bytes(debt))
+    loan = {
+        "id": "1001",
+        "guild_id": GUILD_ID,
+        "user_id": "42",
+        "amount": 10,
+        "total_repayment": 11,
+        "status": "active",
+        "approved_date": datetime.datetime.now().isoformat()
+    }
+    bot = SimpleNamespace(loan_database={"loans": [loan], "history": []})
+    renderer = ChartRenderer({"WORKERS": 1, "CACHE_SIZE": 8})
+    renderer._pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    async def run():
+        first = await renderer.get_chart(bot, GUILD_ID, "7d")
+        second = await renderer.get_chart(bot, GUILD_ID, "7d")
+
+        # A payment changes the guild's statistics, so the chart is drawn again
+        paid = dict(loan, status="active_partial", amount_repaid=5)
+        changes = [("loans", loan, paid)]
+        bot.loan_stats.apply(compute_deltas(changes), compute_daily_deltas(changes))
+        third = await renderer.get_chart(bot, GUILD_ID, "7d")
+        return first, second, third
+
+    try:
+        first, second, third = asyncio.run(run())
+    finally:
+        renderer.stop()
+
+    assert first == (second[0], False) and second[1] is True
+    assert third[1] is False and third[0] != first[0]
+    assert renderer.get_stats()["renders"] == 2
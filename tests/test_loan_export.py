@@ -0,0 +1,62 @@
+"""
+Tests for the streaming loan export
+"""
+
+import asyncio
+import csv
+import gzip
+import json
+
+import loan_export
+from loan_export import CSV_FIELDS, iter_records, write_export
+from scheduling import to_timestamp
+
+GUILD_ID = "1"
+
+
+def make_database():
+    """Create a database with records in two guilds"""
+    return {
+        "loans": [
+            {"id": "1001", "guild_id": GUILD_ID, "status": "active", "amount": 1000, "request_date": "2026-03-01T12:00:00"},
+            {"id": "2001", "guild_id": "2", "status": "active", "amount": 500, "request_date": "2026-03-01T12:00:00"}
+        ],
+        "history": [
+            {"id": "1000", "guild_id": GUILD_ID, "status": "repaid", "amount": 300, "request_date": "2026-02-01T12:00:00"}
+        ],
+        "loan_requests": [
+            {"id": "1002", "guild_id": GUILD_ID, "status": "denied", "amount": 200, "request_date": "2026-03-05T12:00:00"}
+        ]
+    }
+
+
+def test_filters_by_guild_status_and_date():
+    database = make_database()
+
+    assert [record["id"] for collection, record in iter_records(database, GUILD_ID)] == ["1001", "1000", "1002"]
+    assert [record["id"] for collection, record in iter_records(database, GUILD_ID, statuses={"repaid"})] == ["1000"]
+
+    since = to_timestamp("2026-03-01T00:00:00")
+    assert [record["id"] for collection, record in iter_records(database, GUILD_ID, since=since)] == ["1001", "1002"]
+
+
+def test_csv_export_is_written_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(loan_export, "CHUNK_SIZE", 2)
+    path = tmp_path / "export.csv.gz"
+
+    count = asyncio.run(write_export(str(path), iter_records(make_database(), GUILD_ID), "csv"))
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert count == 3
+    assert rows[0] == list(CSV_FIELDS)
+    assert [(row[0], row[1]) for row in rows[1:]] == [("loans", "1001"), ("history", "1000"), ("loan_requests", "1002")]
+
+
+def test_jsonl_export_keeps_every_field(tmp_path):
+    path = tmp_path / "export.jsonl.gz"
+    asyncio.run(write_export(str(path), iter_records(make_database(), GUILD_ID, statuses={"denied"}), "jsonl"))
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert records == [dict(make_database()["loan_requests"][0], collection="loan_requests")]
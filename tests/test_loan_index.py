@@ -0,0 +1,97 @@
+"""
+Tests for the loan index
+"""
+
+from loan_index import MAX_CHOICES, LoanIndex, build_choices
+
+GUILD_ID = "1"
+USER_ID = "42"
+
+
+def make_request(loan_id="1001", user_id=USER_ID):
+    """Create a pending loan request"""
+    return {"id": loan_id, "guild_id": GUILD_ID, "user_id": user_id, "amount": 1000, "status": "pending"}
+
+
+def make_index(loans=(), requests=()):
+    """Create an index over a loan database"""
+    database = {"loans": list(loans), "loan_requests": list(requests), "history": []}
+    index = LoanIndex()
+    index.rebuild(database)
+    return index, database
+
+
+def test_partly_repaid_loan_blocks_a_new_request():
+    loan = {"id": "1000", "guild_id": GUILD_ID, "user_id": USER_ID, "amount": 500, "status": "active_partial"}
+    index, database = make_index(loans=[loan])
+
+    assert index.get_outstanding(GUILD_ID, USER_ID) is loan
+    assert index.try_add_request(database, make_request()) == (False, loan)
+    assert database["loan_requests"] == []
+
+
+def test_autocomplete_lookups_filter_by_prefix_and_status():
+    loans = [
+        {"id": "1100", "guild_id": GUILD_ID, "user_id": USER_ID, "amount": 500, "status": "active"},
+        {"id": "1200", "guild_id": GUILD_ID, "user_id": USER_ID, "amount": 500, "status": "active"},
+        {"id": "1101", "guild_id": "2", "user_id": USER_ID, "amount": 500, "status": "active"}
+    ]
+    requests = [make_request("1300"), make_request("1301", user_id="43")]
+    index, database = make_index(loans=loans, requests=requests)
+
+    assert index.get_user_loans(GUILD_ID, USER_ID, prefix="11") == [loans[0]]
+
+    # A repaid loan is skipped even before the index hears about it
+    loans[0]["status"] = "repaid"
+    assert index.get_user_loans(GUILD_ID, USER_ID) == [loans[1]]
+
+    requests[0]["status"] = "approved"
+    assert index.get_guild_requests(GUILD_ID, prefix="13") == [requests[1]]
+
+
+def test_choices_are_capped_and_name_the_requester():
+    requests = [dict(make_request(str(1000 + number)), user_name="Ann") for number in range(30)]
+    choices = build_choices(requests, "coins")
+
+    assert len(choices) == MAX_CHOICES
+    assert (choices[0].name, choices[0].value) == ("#1000 - 1,000 coins for Ann", "1000")
+
+
+def test_pending_request_blocks_a_second_one():
+    index, database = make_index()
+    first = make_request()
+
+    assert index.try_add_request(database, first) == (True, None)
+    assert index.try_add_request(database, make_request("1002")) == (False, first)
+    assert database["loan_requests"] == [first]
+
+
+def test_resubmission_within_the_dedupe_window_is_dropped():
+    index, database = make_index()
+    first = make_request()
+    assert index.try_add_request(database, first, dedupe_seconds=60) == (True, None)
+
+    # The request was denied, but a double click right after must not create a new one
+    first["status"] = "denied"
+    index.remove_request(first)
+    assert index.try_add_request(database, make_request("1002"), dedupe_seconds=60) == (False, None)
+
+    # Outside the window the user may ask again
+    assert index.try_add_request(database, make_request("1003"), dedupe_seconds=0) == (True, None)
+    assert [request["id"] for request in database["loan_requests"]] == ["1001", "1003"]
+
+
+def test_other_users_are_not_deduplicated():
+    index, database = make_index()
+    assert index.try_add_request(database, make_request(), dedupe_seconds=60) == (True, None)
+    assert index.try_add_request(database, make_request("1002", user_id="43"), dedupe_seconds=60) == (True, None)
+
+
+def test_discard_request_undoes_the_insert():
+    index, database = make_index()
+    request = make_request()
+    index.try_add_request(database, request)
+    index.discard_request(database, request)
+
+    assert database["loan_requests"] == []
+    assert index.get_outstanding(GUILD_ID, USER_ID) is None
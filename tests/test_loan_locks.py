@@ -0,0 +1,50 @@
+"""
+Tests for the per-loan locks
+"""
+
+import asyncio
+import gc
+
+from loan_locks import KeyedLockManager
+
+
+def test_same_loan_runs_one_at_a_time():
+    locks = KeyedLockManager()
+    events = []
+
+    async def work(name):
+        async with locks.hold("loan:1001"):
+            events.append(f"{name} start")
+            await asyncio.sleep(0.01)
+            events.append(f"{name} end")
+
+    async def run():
+        await asyncio.gather(work("repay"), work("installment"))
+
+    asyncio.run(run())
+    assert events == ["repay start", "repay end", "installment start", "installment end"]
+    assert locks.get_stats()["contended"] == 1
+
+
+def test_different_loans_do_not_wait():
+    locks = KeyedLockManager()
+
+    async def run():
+        async with locks.hold("loan:1001"):
+            # Would deadlock if the keys shared a lock
+            await asyncio.wait_for(_hold(locks, "loan:1002"), timeout=1)
+
+    asyncio.run(run())
+    assert locks.get_stats()["contended"] == 0
+
+
+def test_unused_locks_are_dropped():
+    locks = KeyedLockManager()
+    asyncio.run(_hold(locks, "loan:1001"))
+    gc.collect()
+    assert locks.get_stats()["active"] == 0
+
+
+async def _hold(locks, key):
+    async with locks.hold(key):
+        pass
@@ -0,0 +1,170 @@
+"""
+Tests for the loan aggregates and daily buckets
+"""
+
+import copy
+
+from loan_stats import LoanStats, compute_daily_deltas, compute_deltas, loan_contribution, loan_daily_contribution
+
+GUILD_ID = "1"
+
+
+def make_loan(**fields):
+    """Create an active installment loan of 1000 with 100 interest"""
+    loan = {
+        "id": "1001",
+        "guild_id": GUILD_ID,
+        "user_id": "42",
+        "amount": 1000,
+        "interest": 100,
+        "total_repayment": 1100,
+        "status": "active",
+        "installment_enabled": True,
+        "approved_date": "2026-03-01T12:00:00",
+        "due_date": "2026-03-10T12:00:00"
+    }
+    loan.update(fields)
+    return loan
+
+
+def pay(loan, day, amount):
+    """Return a copy of a loan with an installment payment made on a day"""
+    loan = copy.deepcopy(loan)
+    loan["amount_repaid"] = loan.get("amount_repaid", 0) + amount
+    loan["payments"] = loan.get("payments", []) + [{"date": f"{day}T12:00:00", "amount": amount}]
+    loan["status"] = "active_partial"
+    loan["last_payment_date"] = f"{day}T12:00:00"
+    return loan
+
+
+def test_active_loan_contribution():
+    loan = pay(make_loan(), "2026-03-03", 300)
+    assert loan_contribution("loans", loan) == {
+        "loans_taken": 1,
+        "active_loans": 1,
+        "total_borrowed": 1000,
+        "current_debt": 800
+    }
+
+
+def test_installment_payments_count_on_their_day():
+    loan = pay(pay(make_loan(), "2026-03-03", 300), "2026-03-05", 200)
+    buckets = loan_daily_contribution("loans", loan)
+
+    assert buckets["2026-03-01"] == {"loans_created": 1, "amount_lent": 1000, "amount_owed": 1100}
+    assert buckets["2026-03-03"] == {"amount_repaid": 300}
+    assert buckets["2026-03-05"] == {"amount_repaid": 200}
+
+
+def test_payment_delta_lands_on_payment_day():
+    before = pay(make_loan(), "2026-03-03", 300)
+    after = pay(before, "2026-03-05", 200)
+
+    assert compute_daily_deltas([("loans", before, after)]) == {(GUILD_ID, "2026-03-05"): {"amount_repaid": 200}}
+    assert compute_deltas([("loans", before, after)]) == {(GUILD_ID, "42"): {"current_debt": -200}}
+
+
+def test_late_fee_counts_on_the_day_it_was_charged():
+    loan = make_loan(late_fee=50, late_fee_applied=True, late_fee_date="2026-03-11T09:00:00", total_repayment=1150)
+    buckets = loan_daily_contribution("loans", loan)
+
+    assert buckets["2026-03-01"]["amount_owed"] == 1100
+    assert buckets["2026-03-11"] == {"late_fees_charged": 50}
+
+
+def test_final_repayment_counts_only_the_remainder():
+    loan = pay(make_loan(), "2026-03-03", 300)
+    repaid = dict(loan, status="repaid", repayment_date="2026-03-08T12:00:00", amount_repaid=1100)
+    buckets = loan_daily_contribution("history", repaid)
+
+    assert buckets["2026-03-03"] == {"amount_repaid": 300}
+    assert buckets["2026-03-08"]["amount_repaid"] == 800
+    assert buckets["2026-03-08"]["loans_repaid"] == 1
+
+
+def test_manual_repayment_loan_is_outstanding():
+    loan = make_loan()
+    manual = dict(loan, status="manual_repayment", manual_repayment_started="2026-03-05T12:00:00")
+
+    assert loan_contribution("loans", manual)["current_debt"] == 1100
+    assert loan_daily_contribution("loans", manual)["2026-03-01"]["loans_created"] == 1
+    assert compute_deltas([("loans", loan, manual)]) == {}
+    assert compute_daily_deltas([("loans", loan, manual)]) == {}
+
+
+def test_applied_deltas_match_a_rebuild():
+    database = {"loans": [make_loan()], "history": []}
+    stats = LoanStats()
+    stats.rebuild(database)
+
+    # Pay an installment, then repay the rest late
+    loan = database["loans"][0]
+    paid = pay(loan, "2026-03-03", 300)
+    changes = [("loans", loan, paid)]
+    stats.apply(compute_deltas(changes), compute_daily_deltas(changes))
+    database["loans"][0] = paid
+
+    repaid = dict(paid, status="repaid", repayment_date="2026-03-12T12:00:00", amount_repaid=1100)
+    changes = [("loans", paid, None), ("history", None, repaid)]
+    stats.apply(compute_deltas(changes), compute_daily_deltas(changes))
+    database["loans"] = []
+    database["history"] = [repaid]
+
+    assert stats.verify(database) == []
+    assert stats.verify_days(database) == []
+    assert stats.get_user(GUILD_ID, "42")["late"] == 1
+    assert stats.get_guild(GUILD_ID)["current_debt"] == 0
+
+
+def test_verify_reports_drift():
+    database = {"loans": [make_loan()], "history": []}
+    stats = LoanStats()
+    stats.rebuild(database)
+    stats.users[GUILD_ID]["42"]["current_debt"] = 5
+
+    mismatches = stats.verify(database)
+    assert [(guild_id, user_id) for guild_id, user_id, current, wanted in mismatches] == [(GUILD_ID, "42")]
+
+    stats.reconcile(database)
+    assert stats.verify(database) == []
+
+
+def test_reconcile_from_snapshot_skips_guilds_changed_meanwhile():
+    other = make_loan(id="2001", guild_id="2", user_id="7")
+    database = {"loans": [make_loan(), other], "history": []}
+    stats = LoanStats()
+    stats.rebuild(database)
+    stats.users[GUILD_ID]["42"]["current_debt"] = 5
+
+    snapshot = stats.snapshot(database)
+    expected = stats.compute_expected(snapshot)
+
+    # A payment in guild 2 lands while the recomputation runs
+    paid = dict(other, status="active_partial", amount_repaid=100)
+    changes = [("loans", other, paid)]
+    stats.apply(compute_deltas(changes), compute_daily_deltas(changes))
+    database["loans"][1] = paid
+
+    changed = stats.changed_since(snapshot)
+    assert changed == {"2"}
+    fixed, fixed_days = stats.reconcile(database, expected=expected, skip_guilds=changed)
+    assert [(guild_id, user_id) for guild_id, user_id, wanted in fixed] == [(GUILD_ID, "42")]
+    assert stats.verify(database) == []
+
+
+def test_guild_totals_count_borrowers():
+    database = {"loans": [make_loan(), make_loan(id="1002", user_id="43")], "history": []}
+    stats = LoanStats()
+    stats.rebuild(database)
+    assert stats.get_guild(GUILD_ID)["borrowers"] == 2
+    assert stats.get_guild(GUILD_ID)["active_borrowers"] == 2
+
+    # Repaying the second loan keeps the borrower but not as an active one
+    loan = database["loans"][1]
+    repaid = dict(loan, status="repaid", repayment_date="2026-03-08T12:00:00")
+    stats.apply(compute_deltas([("loans", loan, None), ("history", None, repaid)]))
+
+    assert stats.get_guild(GUILD_ID)["borrowers"] == 2
+    assert stats.get_guild(GUILD_ID)["active_borrowers"] == 1
+    assert stats.get_guild(GUILD_ID)["loans_repaid"] == 1
+    assert stats.get_guild("2") == dict.fromkeys(stats.get_guild(GUILD_ID), 0)
@@ -0,0 +1,52 @@
+"""
+Tests for the event loop lag monitor
+"""
+
+import asyncio
+import time
+
+import metrics
+from loop_monitor import LoopMonitor
+
+
+def make_monitor():
+    """Create a monitor that samples quickly"""
+    return LoopMonitor({"ENABLED": True, "INTERVAL": 0.02, "SLOW_THRESHOLD": 0.1, "HISTORY": 5})
+
+
+def test_blocking_callback_is_captured_with_its_command():
+    monitor = make_monitor()
+
+    async def blocking_command():
+        metrics.label_current_task("repay")
+        time.sleep(0.4)
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        await asyncio.create_task(blocking_command())
+        await asyncio.sleep(0.1)
+        monitor.stop()
+
+    asyncio.run(run())
+    stats = monitor.get_stats()
+    assert stats["slow_count"] == 1
+    slow = stats["recent"][0]
+    assert slow["command"] == "repay"
+    assert slow["duration"] >= 0.2
+    assert "blocking_command" in slow["stack"]
+
+
+def test_idle_loop_has_no_slow_callbacks():
+    monitor = make_monitor()
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.2)
+        monitor.stop()
+
+    asyncio.run(run())
+    stats = monitor.get_stats()
+    assert stats["slow_count"] == 0
+    assert stats["window"] > 0
+    assert monitor._thread is None
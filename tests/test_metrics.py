@@ -0,0 +1,56 @@
+"""
+Tests for the Prometheus metrics
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from metrics import MetricsRegistry
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("command_seconds", "Command latency", labels=("command",), buckets=(0.1, 1.0))
+    histogram.observe(0.05, "loan")
+    histogram.observe(0.5, "loan")
+    histogram.observe(5, "loan")
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP command_seconds Command latency", "# TYPE command_seconds histogram"]
+    assert 'command_seconds_bucket{command="loan",le="0.1"} 1' in lines
+    assert 'command_seconds_bucket{command="loan",le="1"} 2' in lines
+    assert 'command_seconds_bucket{command="loan",le="+Inf"} 3' in lines
+    assert 'command_seconds_sum{command="loan"} 5.55' in lines
+    assert 'command_seconds_count{command="loan"} 3' in lines
+
+
+def test_counters_gauges_and_label_escaping():
+    registry = MetricsRegistry()
+    registry.counter("errors_total", "Errors", labels=("endpoint",)).inc('say "hi"', amount=2)
+    registry.gauge("queue_depth", "Queued commands", callback=lambda: {(): 4})
+
+    # Registering a metric again returns the existing one
+    assert registry.counter("errors_total", "Errors") is registry.metrics["errors_total"]
+
+    text = registry.render()
+    assert 'errors_total{endpoint="say \\"hi\\""} 2' in text
+    assert "queue_depth 4" in text
+
+
+def test_health_server_exports_the_shared_registry():
+    import metrics
+    from server import HealthServer
+
+    metrics.registry.counter("test_scrapes_total", "Scrapes seen by the tests").inc()
+
+    async def scrape():
+        bot = SimpleNamespace(is_ready=lambda: True, guilds=[])
+        async with TestClient(TestServer(HealthServer(bot, port=0).app)) as client:
+            response = await client.get("/metrics")
+            return response.headers["Content-Type"], await response.text()
+
+    content_type, text = asyncio.run(scrape())
+    assert content_type.startswith("text/plain; version=0.0.4")
+    assert "test_scrapes_total 1" in text
@@ -0,0 +1,65 @@
+"""
+Tests for the JSON to shared store migration
+"""
+
+import json
+
+from migrate_database import migrate, verify
+from shared_store import SharedStore
+
+
+def make_loan(loan_id, amount, **fields):
+    """Create an active loan"""
+    loan = {
+        "id": loan_id,
+        "guild_id": "1",
+        "user_id": "42",
+        "amount": amount,
+        "total_repayment": amount + 100,
+        "status": "active",
+        "approved_date": "2026-03-01T12:00:00",
+        "due_date": "2026-03-10T12:00:00"
+    }
+    loan.update(fields)
+    return loan
+
+
+def test_duplicate_ids_do_not_cause_mismatches(tmp_path, capsys):
+    source = tmp_path / "database.json"
+    source.write_text(json.dumps({
+        "loans": [make_loan("1001", 1000), make_loan("1002", 500), make_loan("1001", 2000)],
+        "loan_requests": [],
+        "history": [],
+        "credit_scores": {"42": 100}
+    }))
+    store = SharedStore(str(tmp_path / "store.db"))
+
+    totals = migrate(str(source), store)
+
+    assert totals[("loans", "1")] == [2, 2500.0, 2700.0]
+    assert verify(store, totals) == []
+    assert "1 loans records in guild 1 repeat an earlier ID" in capsys.readouterr().out
+
+    # The statistics count the stored (last) record of each ID once
+    stats = store.get_user_stats("1", "42")
+    assert stats["loans_taken"] == 2
+    assert stats["total_borrowed"] == 2500
+
+
+def test_statistics_are_recomputed_from_the_store(tmp_path):
+    from loan_stats import LoanStats
+
+    repaid = make_loan("1003", 300, status="repaid", repayment_date="2026-03-05T12:00:00", amount_repaid=400)
+    database = {"loans": [make_loan("1001", 1000), make_loan("1001", 2000)], "history": [repaid]}
+    source = tmp_path / "database.json"
+    source.write_text(json.dumps(database))
+    store = SharedStore(str(tmp_path / "store.db"))
+
+    migrate(str(source), store, batch_size=1)
+
+    # Same as a rebuild from the stored records, i.e. the last loan of each ID
+    expected = LoanStats()
+    expected.rebuild({"loans": [database["loans"][1]], "history": [repaid]})
+    wanted = {field: value for field, value in expected.get_user("1", "42").items() if value}
+    assert {field: value for field, value in store.get_user_stats("1", "42").items() if value} == wanted
+    assert store.get_daily_stats("1", "2026-03-05") == expected.days["1"]["2026-03-05"]
@@ -0,0 +1,87 @@
+"""
+Tests for the overdue penalties
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import shared_store
+from loan_index import get_loan_index
+from overdue_scheduler import OverdueScheduler, repayment_credit_change
+from shared_store import SharedStore
+
+GUILD_ID = "1"
+
+
+def make_loan(loan_id="1001", **fields):
+    """Create an active loan that is past its due date"""
+    loan = {
+        "id": loan_id,
+        "guild_id": GUILD_ID,
+        "user_id": "42",
+        "amount": 1000,
+        "total_repayment": 1100,
+        "status": "active",
+        "due_date": "2026-03-10T12:00:00"
+    }
+    loan.update(fields)
+    return loan
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = SharedStore(str(tmp_path / "store.db"))
+    monkeypatch.setattr(shared_store, "_store", store)
+    return store
+
+
+def make_bot(store, *loans):
+    """Create a bot whose database (and store) hold the given loans"""
+    store.apply_changes(upserts=[("loans", loan) for loan in loans])
+    bot = SimpleNamespace(loan_database={"loans": list(loans), "history": [], "credit_scores": {"42": 100}})
+    get_loan_index(bot)
+    return bot
+
+
+def test_late_repayment_after_penalty_still_costs_credit():
+    assert repayment_credit_change(make_loan(), on_time=True) == 10
+    assert repayment_credit_change(make_loan(), on_time=False) == -5
+    assert repayment_credit_change(make_loan(overdue_penalty_applied=True), on_time=False) == -5
+
+
+def test_overdue_loan_is_penalized_under_the_shared_lock(store):
+    loan = make_loan()
+    bot = make_bot(store, loan)
+    scheduler = OverdueScheduler(bot)
+    scheduler.rebuild(bot.loan_database)
+
+    acquired = []
+    locked = store.locked
+
+    def recording_locked(name, timeout=None):
+        acquired.append(name)
+        return locked(name, timeout)
+
+    store.locked = recording_locked
+    assert asyncio.run(scheduler.process_due()) == 1
+
+    assert acquired == ["loan:1001"]
+    assert loan["overdue_penalty_applied"] and loan["total_repayment"] == 1150
+    assert store.get_record("loans", GUILD_ID, "1001")["late_fee"] == 50
+    assert bot.loan_database["credit_scores"]["42"] == 95
+
+
+def test_loan_repaid_by_another_process_is_not_penalized(store):
+    loan = make_loan()
+    bot = make_bot(store, loan)
+    scheduler = OverdueScheduler(bot)
+    scheduler.rebuild(bot.loan_database)
+
+    repaid = make_loan(status="repaid", repayment_date="2026-03-09T12:00:00")
+    store.apply_changes(deletes=[("loans", repaid)], history=[repaid])
+
+    assert asyncio.run(scheduler.process_due()) == 0
+    assert bot.loan_database["loans"] == []
+    assert store.get_record("loans", GUILD_ID, "1001") is None
@@ -0,0 +1,89 @@
+"""
+Tests for the cached loan permission checks
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import config
+import server_settings
+from permissions import PermissionService
+
+GUILD_ID = 111
+CAPTAIN_ROLE = 222
+APPROVER_ROLE = 333
+
+
+def make_member(*role_ids, administrator=False):
+    """Create a member with the given role IDs"""
+    return SimpleNamespace(
+        id=444,
+        roles=[SimpleNamespace(id=role_id) for role_id in role_ids],
+        guild_permissions=SimpleNamespace(administrator=administrator)
+    )
+
+
+@pytest.fixture
+def guild_settings(monkeypatch):
+    monkeypatch.setattr(config, "SERVER_SETTINGS", {
+        str(GUILD_ID): {"captain_role_id": str(CAPTAIN_ROLE), "approval_roles": [str(APPROVER_ROLE)]}
+    })
+    server_settings._invalidate(None)
+    yield
+    server_settings._invalidate(None)
+
+
+@pytest.fixture
+def service(guild_settings):
+    return PermissionService(cache_enabled=True)
+
+
+def test_removed_role_is_denied_without_member_updates(guild_settings):
+    service = PermissionService()
+    member = make_member(CAPTAIN_ROLE, APPROVER_ROLE)
+    assert service.can_request_loan(GUILD_ID, member)
+    assert service.can_review_requests(GUILD_ID, member)
+
+    # No member update event: the role is just gone from the member
+    member.roles = [SimpleNamespace(id=CAPTAIN_ROLE)]
+    assert service.can_request_loan(GUILD_ID, member)
+    assert not service.can_review_requests(GUILD_ID, member)
+
+    member.roles = []
+    assert not service.can_request_loan(GUILD_ID, member)
+
+
+def test_member_update_drops_cached_result(service):
+    member = make_member(CAPTAIN_ROLE, APPROVER_ROLE)
+    member.guild = SimpleNamespace(id=GUILD_ID)
+    assert service.can_review_requests(GUILD_ID, member)
+
+    member.roles = [SimpleNamespace(id=CAPTAIN_ROLE)]
+    service.invalidate_member(member)
+    assert not service.can_review_requests(GUILD_ID, member)
+
+
+def test_unchanged_roles_are_served_from_cache(service):
+    member = make_member(APPROVER_ROLE)
+    assert service.can_review_requests(GUILD_ID, member)
+
+    # A hit never looks at the member's roles
+    member.roles = None
+    assert service.can_review_requests(GUILD_ID, member)
+    assert service.get_stats()["hits"] == 1
+
+
+def test_settings_change_is_seen(service, monkeypatch):
+    member = make_member(APPROVER_ROLE)
+    assert service.can_review_requests(GUILD_ID, member)
+
+    config.SERVER_SETTINGS[str(GUILD_ID)]["approval_roles"] = []
+    server_settings._invalidate(GUILD_ID)
+    assert not service.can_review_requests(GUILD_ID, member)
+
+
+def test_administrator_may_do_everything(service):
+    member = make_member(administrator=True)
+    assert service.can_request_loan(GUILD_ID, member)
+    assert service.can_review_requests(GUILD_ID, member)
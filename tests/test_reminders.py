@@ -0,0 +1,55 @@
+"""
+Tests for the reminder rate limiter
+"""
+
+import pytest
+
+import reminders
+from reminders import TokenBucket
+
+
+class FakeClock:
+    """Monotonic clock moved by hand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(reminders.time, "monotonic", clock)
+    return clock
+
+
+def test_burst_up_to_the_rate_is_free(clock):
+    bucket = TokenBucket(rate=5, per=10)
+    assert [bucket.reserve() for _ in range(5)] == [0.0] * 5
+
+
+def test_sends_past_the_burst_wait_in_turn(clock):
+    bucket = TokenBucket(rate=5, per=10)
+    for _ in range(5):
+        bucket.reserve()
+
+    # One token comes back every 2 seconds
+    assert bucket.reserve() == pytest.approx(2.0)
+    assert bucket.reserve() == pytest.approx(4.0)
+
+
+def test_tokens_refill_over_time_up_to_the_capacity(clock):
+    bucket = TokenBucket(rate=5, per=10)
+    for _ in range(5):
+        bucket.reserve()
+
+    clock.now += 4
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(2.0)
+
+    clock.now += 3600
+    assert [bucket.reserve() for _ in range(5)] == [0.0] * 5
+    assert bucket.reserve() > 0
@@ -0,0 +1,74 @@
+"""
+Tests for the min-heap scheduler
+"""
+
+import asyncio
+import datetime
+import time
+
+from scheduling import HeapScheduler, to_timestamp
+
+
+class RecordingScheduler(HeapScheduler):
+    """Scheduler that records the items it processed"""
+
+    def __init__(self, batch_size=100):
+        super().__init__(bot=None, batch_size=batch_size)
+        self.processed = []
+
+    async def process_due(self):
+        self.processed.extend(item for when, item in self.pop_due())
+
+
+def test_pop_due_returns_due_entries_in_time_order():
+    scheduler = RecordingScheduler()
+    for when, item in ((30, "c"), (10, "a"), (20, "b"), (40, "d")):
+        scheduler.push(when, item)
+
+    assert scheduler.pop_due(now=30) == [(10, "a"), (20, "b"), (30, "c")]
+    assert len(scheduler) == 1
+
+
+def test_equal_timestamps_keep_push_order():
+    scheduler = RecordingScheduler()
+    for item in ("first", "second", "third"):
+        scheduler.push(10, item)
+
+    assert [item for when, item in scheduler.pop_due(now=10)] == ["first", "second", "third"]
+
+
+def test_pop_due_stops_at_the_batch_size():
+    scheduler = RecordingScheduler(batch_size=2)
+    scheduler.replace_all((when, when) for when in (5, 1, 4, 2, 3))
+
+    assert scheduler.pop_due(now=10) == [(1, 1), (2, 2)]
+    assert scheduler.pop_due(now=10) == [(3, 3), (4, 4)]
+    assert scheduler.pop_due(now=10) == [(5, 5)]
+
+
+def test_earlier_entry_wakes_the_task():
+    async def run():
+        scheduler = RecordingScheduler()
+        scheduler.push(time.time() + 3600, "later")
+        scheduler.start()
+        await asyncio.sleep(0)
+
+        # The task is waiting an hour for "later"; a due entry must not wait that long
+        scheduler.push(time.time() - 1, "now")
+        await asyncio.wait_for(_wait_for(scheduler, "now"), timeout=2)
+        scheduler.stop()
+        return scheduler.processed
+
+    assert asyncio.run(run()) == ["now"]
+
+
+async def _wait_for(scheduler, item):
+    """Wait until the scheduler processed an item"""
+    while item not in scheduler.processed:
+        await asyncio.sleep(0.01)
+
+
+def test_to_timestamp():
+    assert to_timestamp("2026-03-10T12:00:00") == to_timestamp(datetime.datetime(2026, 3, 10, 12))
+    assert to_timestamp("not a date") is None
+    assert to_timestamp(None) is None
@@ -0,0 +1,37 @@
+"""
+Tests for the health server on the bot's event loop
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from server import HealthServer
+
+
+def make_bot():
+    """Create a bot that is connected to two guilds"""
+    return SimpleNamespace(is_ready=lambda: True, guilds=[object(), object()])
+
+
+async def _get(bot, path):
+    """Request a path from a health server, return (status, body)"""
+    async with TestClient(TestServer(HealthServer(bot, port=0).app)) as client:
+        response = await client.get(path)
+        return response.status, await response.text()
+
+
+def test_health_check():
+    assert asyncio.run(_get(make_bot(), "/health")) == (200, "OK")
+
+
+def test_api_status_reads_the_bot_directly():
+    status, body = asyncio.run(_get(make_bot(), "/api-status"))
+    assert status == 200
+    assert '"bot_ready": true' in body and '"guilds": 2' in body
+
+
+def test_unbelievaboat_check_needs_ids():
+    status, body = asyncio.run(_get(make_bot(), "/check-unbelievaboat"))
+    assert status == 400
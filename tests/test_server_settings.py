@@ -0,0 +1,103 @@
+"""
+Tests for the server settings cache and the debounced settings writer
+"""
+
+import asyncio
+import json
+
+import pytest
+
+import config
+import server_settings
+
+GUILD_ID = "111"
+
+
+@pytest.fixture
+def settings_file(tmp_path, monkeypatch):
+    path = tmp_path / "server_settings.json"
+    monkeypatch.setattr(server_settings, "SETTINGS_FILE", str(path))
+    monkeypatch.setattr(server_settings, "SAVE_DELAY", 0.01)
+    monkeypatch.setattr(config, "SERVER_SETTINGS", {})
+
+    # Start with no pending changes, and leave none behind for the exit hook
+    monkeypatch.setattr(server_settings, "_changed_guilds", set())
+    monkeypatch.setattr(server_settings, "_dirty", False)
+    monkeypatch.setattr(server_settings, "_first_change", None)
+    monkeypatch.setattr(server_settings, "_save_timer", None)
+    server_settings._invalidate(None)
+    yield path
+    server_settings._invalidate(None)
+
+
+def count_writes(monkeypatch):
+    """Record the guilds changed in each settings write"""
+    writes = []
+    write_settings = server_settings._write_settings
+
+    def recording_write(settings, changed_guilds):
+        writes.append(set(changed_guilds))
+        return write_settings(settings, changed_guilds)
+
+    monkeypatch.setattr(server_settings, "_write_settings", recording_write)
+    return writes
+
+
+def test_burst_of_changes_is_written_once(settings_file, monkeypatch):
+    writes = count_writes(monkeypatch)
+
+    async def run():
+        server_settings.set_max_loan_amount(GUILD_ID, 5000)
+        server_settings.set_max_repayment_days(GUILD_ID, 30)
+        server_settings.set_captain_role("222", "333")
+        assert not settings_file.exists()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert writes == [{GUILD_ID, "222"}]
+    on_disk = json.loads(settings_file.read_text())
+    assert on_disk[GUILD_ID] == {"max_loan_amount": 5000, "max_repayment_days": 30}
+
+
+def test_flush_writes_pending_changes_right_away(settings_file, monkeypatch):
+    monkeypatch.setattr(server_settings, "SAVE_DELAY", 60)
+
+    async def run():
+        server_settings.set_installment_enabled(GUILD_ID, False)
+        await server_settings.flush_settings()
+
+    asyncio.run(run())
+    assert json.loads(settings_file.read_text())[GUILD_ID] == {"installment_enabled": False}
+
+
+def test_settings_objects_are_cached_typed_and_immutable(settings_file):
+    settings = server_settings.get_settings(GUILD_ID)
+    assert server_settings.get_settings(int(GUILD_ID)) is settings
+    assert settings.max_repayment_days == server_settings.DEFAULT_MAX_REPAYMENT_DAYS
+
+    with pytest.raises(AttributeError):
+        settings.max_loan_amount = 1
+
+    config.SERVER_SETTINGS[GUILD_ID] = {"approval_roles": ["333", "oops"]}
+    server_settings._notify_settings_changed(GUILD_ID)
+    changed = server_settings.get_settings(GUILD_ID)
+    assert changed.version != settings.version
+    assert changed.approval_role_ids == frozenset({333})
+
+
+def test_edited_file_is_reloaded_except_unsaved_guilds(settings_file, monkeypatch):
+    monkeypatch.setattr(server_settings, "SAVE_DELAY", 60)
+    settings_file.write_text(json.dumps({GUILD_ID: {"max_loan_amount": 100}, "222": {"max_loan_amount": 100}}))
+    server_settings.load_settings()
+
+    async def run():
+        # Guild 222 has a change of its own that is not saved yet
+        server_settings.set_max_loan_amount("222", 300)
+        settings_file.write_text(json.dumps({GUILD_ID: {"max_loan_amount": 2000}, "222": {"max_loan_amount": 2000}}))
+        changed = await server_settings.reload_if_changed()
+        server_settings._save_timer.cancel()
+        return changed
+
+    assert asyncio.run(run()) == 1
+    assert server_settings.get_max_loan_amount(GUILD_ID) == 2000
+    assert server_settings.get_max_loan_amount("222") == 300
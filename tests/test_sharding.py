@@ -0,0 +1,37 @@
+"""
+Tests for the shard-aware loan backups
+"""
+
+import sharding
+from sharding import load_shard_backups, save_shard_backup, shard_id_for_guild
+
+# Guild IDs on shard 0 and shard 1 of 2
+GUILD_A = str(0 << 22)
+GUILD_B = str(1 << 22)
+
+
+def test_guilds_map_to_shards_like_discord():
+    assert shard_id_for_guild(GUILD_A, 2) == 0
+    assert shard_id_for_guild(GUILD_B, 2) == 1
+    assert shard_id_for_guild(GUILD_B, None) == 0
+
+
+def test_shard_backups_round_trip_and_repartition(tmp_path, monkeypatch):
+    monkeypatch.setattr(sharding, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(sharding, "GLOBAL_BACKUP_FILE", str(tmp_path / "database.global.json"))
+
+    database = {
+        "loans": [{"id": "1001", "guild_id": GUILD_A}, {"id": "1002", "guild_id": GUILD_B}],
+        "history": [],
+        "loan_requests": [],
+        "credit_scores": {"42": 110}
+    }
+    save_shard_backup(database, 0, 2, include_global=True)
+    save_shard_backup(database, 1, 2)
+
+    merged = load_shard_backups()
+    assert sorted(loan["id"] for loan in merged["loans"]) == ["1001", "1002"]
+    assert merged["credit_scores"] == {"42": 110}
+
+    # A process running only shard 1 keeps only that shard's guilds
+    assert [loan["id"] for loan in load_shard_backups(shard_ids=[1], shard_count=2)["loans"]] == ["1002"]
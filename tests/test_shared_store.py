@@ -0,0 +1,147 @@
+"""
+Tests for the loan transactions of the shared store
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import shared_store
+from loan_index import get_loan_index
+from shared_store import SharedStore, abort_loan_transaction, encode_record, loan_transaction
+
+GUILD_ID = "1"
+
+
+def make_loan(**fields):
+    """Create an active loan"""
+    loan = {
+        "id": "1001",
+        "guild_id": GUILD_ID,
+        "user_id": "42",
+        "amount": 1000,
+        "total_repayment": 1100,
+        "status": "active",
+        "due_date": "2026-03-10T12:00:00"
+    }
+    loan.update(fields)
+    return loan
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = SharedStore(str(tmp_path / "store.db"))
+    monkeypatch.setattr(shared_store, "_store", store)
+    return store
+
+
+@pytest.fixture
+def bot(store):
+    loan = make_loan()
+    store.apply_changes(upserts=[("loans", loan)])
+    bot = SimpleNamespace(loan_database={"loans": [loan], "loan_requests": [], "history": [], "credit_scores": {}})
+    get_loan_index(bot)
+    return bot
+
+
+def test_changes_are_stored_on_success(bot, store):
+    async def run():
+        async with loan_transaction(bot, GUILD_ID, "1001"):
+            bot.loan_database["loans"][0]["note"] = "checked"
+
+    asyncio.run(run())
+    assert store.get_record("loans", GUILD_ID, "1001")["note"] == "checked"
+
+
+def test_failed_transaction_is_rolled_back(bot, store):
+    loan = bot.loan_database["loans"][0]
+    stored_before = encode_record(store.get_record("loans", GUILD_ID, "1001"))
+
+    async def run():
+        async with loan_transaction(bot, GUILD_ID, "1001"):
+            loan["status"] = "repaid"
+            bot.loan_database["loans"].remove(loan)
+            bot.loan_database["history"].append(dict(loan))
+            bot.loan_database["credit_scores"]["42"] = 110
+            raise RuntimeError("payment failed")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run())
+
+    # Nothing was written, and memory is back to the snapshot
+    assert encode_record(store.get_record("loans", GUILD_ID, "1001")) == stored_before
+    assert bot.loan_database["loans"] == [make_loan()]
+    assert bot.loan_database["loans"][0] is loan
+    assert bot.loan_database["history"] == []
+    assert bot.loan_database["credit_scores"]["42"] == 100
+    assert get_loan_index(bot).get_loan("1001") is loan
+
+
+def test_aborted_transaction_is_rolled_back(bot, store):
+    loan = bot.loan_database["loans"][0]
+
+    async def run():
+        async with loan_transaction(bot, GUILD_ID, "1001"):
+            try:
+                loan["amount_repaid"] = 500
+                raise RuntimeError("payment failed")
+            except RuntimeError:
+                # The handler replies with the error itself and returns normally
+                abort_loan_transaction()
+
+    asyncio.run(run())
+    assert "amount_repaid" not in store.get_record("loans", GUILD_ID, "1001")
+    assert "amount_repaid" not in loan
+
+
+def test_refresh_picks_up_changes_that_keep_the_status(bot, store):
+    first_payment = {"date": "2026-03-02T12:00:00", "amount": 100}
+    loan = bot.loan_database["loans"][0]
+    loan.update(status="active_partial", amount_repaid=100, payments=[first_payment])
+
+    # Another process takes a second installment: the status stays active_partial
+    paid = dict(loan, amount_repaid=300, payments=[first_payment, {"date": "2026-03-03T12:00:00", "amount": 200}])
+    store.apply_changes(
+        upserts=[("loans", paid)],
+        stat_deltas={(GUILD_ID, "42"): {"current_debt": 800}},
+        daily_deltas={(GUILD_ID, "2026-03-03"): {"amount_repaid": 200}}
+    )
+
+    async def run():
+        async with loan_transaction(bot, GUILD_ID, "1001"):
+            pass
+
+    asyncio.run(run())
+    assert loan["amount_repaid"] == 300
+    assert bot.loan_stats.get_user(GUILD_ID, "42")["current_debt"] == 800
+    assert bot.loan_stats.days[GUILD_ID]["2026-03-03"] == {"amount_repaid": 200}
+
+
+def test_unit_of_work_deletes_repaid_loan_from_store(bot, store):
+    from unit_of_work import UnitOfWork
+
+    loan = bot.loan_database["loans"][0]
+    uow = UnitOfWork(bot)
+    uow.update("loans", loan, {"status": "repaid", "repayment_date": "2026-03-08T12:00:00"})
+    uow.append("history", uow.staged(loan))
+    uow.remove("loans", loan)
+    asyncio.run(uow.commit())
+
+    assert store.get_record("loans", GUILD_ID, "1001") is None
+    assert store.get_history_record(GUILD_ID, "1001")["status"] == "repaid"
+    assert store.load_database()["loans"] == []
+
+
+def test_refresh_drops_loan_repaid_by_another_process(bot, store):
+    repaid = make_loan(status="repaid", repayment_date="2026-03-08T12:00:00")
+    store.apply_changes(deletes=[("loans", repaid)], history=[repaid])
+
+    async def run():
+        async with loan_transaction(bot, GUILD_ID, "1001"):
+            pass
+
+    asyncio.run(run())
+    assert bot.loan_database["loans"] == []
+    assert bot.loan_database["history"] == [repaid]
+    assert get_loan_index(bot).get_loan("1001") is None
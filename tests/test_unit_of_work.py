@@ -0,0 +1,141 @@
+"""
+Tests for the unit of work
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import shared_store
+from loan_index import get_loan_index
+from loan_stats import get_loan_stats
+from shared_store import SharedStore, loan_transaction
+from unit_of_work import UnitOfWork
+
+GUILD_ID = "1"
+USER_ID = "42"
+
+
+def make_loan(**fields):
+    """Create an active loan"""
+    loan = {
+        "id": "1001",
+        "guild_id": GUILD_ID,
+        "user_id": USER_ID,
+        "amount": 1000,
+        "interest": 100,
+        "total_repayment": 1100,
+        "status": "active",
+        "approved_date": "2026-03-01T12:00:00",
+        "due_date": "2026-03-10T12:00:00"
+    }
+    loan.update(fields)
+    return loan
+
+
+def make_bot(*loans):
+    """Create a bot with a loan database holding some loans"""
+    bot = SimpleNamespace(loan_database={
+        "loans": list(loans),
+        "loan_requests": [],
+        "history": [],
+        "credit_scores": {}
+    })
+    get_loan_index(bot)
+    get_loan_stats(bot)
+    return bot
+
+
+def repay(uow, loan):
+    """Stage repaying a loan, as /repay does"""
+    uow.update("loans", loan, {"status": "repaid", "repayment_date": "2026-03-08T12:00:00"})
+    uow.append("history", uow.staged(loan))
+    uow.remove("loans", loan)
+    uow.adjust_credit(USER_ID, 10)
+
+
+def test_nothing_changes_before_commit():
+    loan = make_loan()
+    bot = make_bot(loan)
+    uow = UnitOfWork(bot)
+    repay(uow, loan)
+
+    assert loan["status"] == "active"
+    assert uow.staged(loan)["status"] == "repaid"
+    assert uow.credit_score(USER_ID) == 110
+    assert bot.loan_database["credit_scores"] == {}
+
+
+def test_commit_applies_everything():
+    loan = make_loan()
+    bot = make_bot(loan)
+    uow = UnitOfWork(bot)
+    repay(uow, loan)
+
+    assert asyncio.run(uow.commit()) == {USER_ID: 110}
+    assert loan["status"] == "repaid"
+    assert bot.loan_database["loans"] == []
+    assert [record["status"] for record in bot.loan_database["history"]] == ["repaid"]
+    assert get_loan_index(bot).get_loan("1001") is None
+
+    stats = get_loan_stats(bot)
+    assert stats.get_user(GUILD_ID, USER_ID)["loans_repaid"] == 1
+    assert stats.get_user(GUILD_ID, USER_ID)["current_debt"] == 0
+    assert stats.verify(bot.loan_database) == []
+    assert stats.verify_days(bot.loan_database) == []
+
+
+def test_failed_store_write_leaves_memory_untouched(monkeypatch):
+    loan = make_loan()
+    bot = make_bot(loan)
+
+    async def fail(**changes):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(shared_store, "persist", fail)
+    uow = UnitOfWork(bot)
+    repay(uow, loan)
+
+    with pytest.raises(OSError):
+        asyncio.run(uow.commit())
+    assert loan["status"] == "active"
+    assert bot.loan_database["loans"] == [loan]
+    assert bot.loan_database["history"] == []
+    assert get_loan_stats(bot).get_user(GUILD_ID, USER_ID)["current_debt"] == 1100
+
+
+def test_rollback_and_double_commit():
+    loan = make_loan()
+    bot = make_bot(loan)
+    uow = UnitOfWork(bot)
+    repay(uow, loan)
+    uow.rollback()
+
+    assert not uow.has_changes()
+    assert asyncio.run(uow.commit()) == {}
+    assert loan["status"] == "active"
+    with pytest.raises(RuntimeError):
+        asyncio.run(uow.commit())
+
+
+def test_commit_in_a_loan_transaction_is_stored_once(tmp_path, monkeypatch):
+    store = SharedStore(str(tmp_path / "store.db"))
+    monkeypatch.setattr(shared_store, "_store", store)
+    loan = make_loan()
+    store.apply_changes(upserts=[("loans", loan)])
+    bot = make_bot(loan)
+
+    async def run():
+        async with loan_transaction(bot, GUILD_ID, "1001"):
+            uow = UnitOfWork(bot)
+            repay(uow, loan)
+            await uow.commit()
+
+    asyncio.run(run())
+
+    # The transaction was rebased after the commit, so it did not write the changes again
+    database = store.load_database()
+    assert len(database["history"]) == 1
+    assert database["credit_scores"] == {USER_ID: 110}
+    assert database["user_stats"][GUILD_ID][USER_ID]["loans_repaid"] == 1
@@ -5,6 +5,7 @@ import asyncio
 import logging
 import json
 import os
+import metrics
 from typing import Optional, Dict, Any, Union
 
 logger = logging.getLogger("discord")
@@ -65,13 +66,17 @@ class UnbelievaBoatAPI:
                 self.session = aiohttp.ClientSession(
                     connector=connector,
                     timeout=timeout,
-                    headers=self.headers  # Apply headers to all requests by default
+                    headers=self.headers,  # Apply headers to all requests by default
+                    trace_configs=[metrics.create_api_trace_config()]  # Request latency for /metrics
                 )
                 logger.info(f"Created new aiohttp session with {self.max_connections} max connections")
             except Exception as e:
                 logger.error(f"Error creating aiohttp session: {e}")
                 # Fallback to a simple session if the configured one fails
-                self.session = aiohttp.ClientSession(headers=self.headers)
+                self.session = aiohttp.ClientSession(
+                    headers=self.headers,
+                    trace_configs=[metrics.create_api_trace_config()]
+                )
                 logger.info("Created fallback aiohttp session after error")
         return self.session
 
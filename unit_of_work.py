@@ -0,0 +1,213 @@
+"""
+Unit of Work
+
+This module provides a small unit-of-work API for loan mutations. Commands
+stage their changes (field updates, appends and removals, credit score
+changes) while they talk to UnbelievaBoat, and commit them only once the
+remote call has succeeded. A commit writes to the shared store first (when
+multi-process mode is enabled) and then applies everything to the in-memory
+database without awaiting, so other commands never see half of a change. A
+unit of work that is dropped or rolled back leaves the database untouched.
+"""
+
+import logging
+
+from loan_index import ACTIVE_STATUSES, get_loan_index
+from loan_stats import compute_daily_deltas, compute_deltas, get_loan_stats
+import shared_store
+
+logger = logging.getLogger("discord")
+
+# Collections whose records are keyed by loan ID (stored and indexed)
+KEYED_COLLECTIONS = ("loans", "loan_requests")
+
+
+class UnitOfWork:
+    def __init__(self, bot):
+        """
+        Start an empty unit of work
+        :param bot: The bot instance (for its loan database and index)
+        """
+        self.bot = bot
+        self._updates = {}   # id(record) -> (collection, record, staged fields)
+        self._appends = []   # (collection, record)
+        self._removes = []   # (collection, record)
+        self._credit = {}    # user_id -> staged credit score change
+        self.committed = False
+
+    def update(self, collection, record, fields):
+        """
+        Stage field changes on a record
+        :param collection: Collection the record belongs to, e.g. "loans"
+        :param record: The record dict
+        :param fields: Dict of field names to new values
+        """
+        entry = self._updates.get(id(record))
+        if entry is None:
+            self._updates[id(record)] = (collection, record, dict(fields))
+        else:
+            entry[2].update(fields)
+
+    def staged(self, record):
+        """
+        Get a copy of a record with its staged changes applied
+        :param record: The record dict
+        :return: New dict
+        """
+        view = dict(record)
+        entry = self._updates.get(id(record))
+        if entry is not None:
+            view.update(entry[2])
+        return view
+
+    def append(self, collection, record):
+        """Stage appending a record to a collection (e.g. a loan to history)"""
+        self._appends.append((collection, record))
+
+    def remove(self, collection, record):
+        """
+        Stage removing a record from a collection (in memory and in the
+        shared store, e.g. a repaid loan once it is appended to history)
+        """
+        self._removes.append((collection, record))
+
+    def adjust_credit(self, user_id, delta):
+        """Stage a credit score change"""
+        user_id = str(user_id)
+        self._credit[user_id] = self._credit.get(user_id, 0) + delta
+
+    def credit_score(self, user_id):
+        """Get a user's credit score with the staged change applied"""
+        user_id = str(user_id)
+        score = self.bot.loan_database.get("credit_scores", {}).get(user_id, 100)
+        return score + self._credit.get(user_id, 0)
+
+    def has_changes(self):
+        """Check if anything is staged"""
+        return bool(self._updates or self._appends or self._removes or self._credit)
+
+    def rollback(self):
+        """Drop all staged changes"""
+        self._updates.clear()
+        self._appends.clear()
+        self._removes.clear()
+        self._credit.clear()
+
+    async def commit(self):
+        """
+        Write the staged changes to the shared store (if enabled), then apply
+        them to the in-memory database and loan index
+        :return: Dict of user ID to new credit score for the changed users
+        """
+        if self.committed:
+            raise RuntimeError("Unit of work was already committed")
+        self.committed = True
+
+        if not self.has_changes():
+            return {}
+
+        changes = self._collect_changes()
+
+        # Nothing in memory changes if the store write fails
+        new_scores = await shared_store.persist(**changes)
+
+        self._apply(new_scores, changes["stat_deltas"], changes["daily_deltas"])
+        shared_store.rebase_loan_transaction(self.bot)
+
+        scores = self.bot.loan_database["credit_scores"] if self._credit else {}
+        result = {user_id: scores.get(user_id, 100) for user_id in self._credit}
+        self.rollback()
+        return result
+
+    def _collect_changes(self):
+        """Turn the staged changes into shared store writes"""
+        upserts = []
+        deletes = []
+        history = []
+        removed = {id(record) for collection, record in self._removes}
+
+        for collection, record, fields in self._updates.values():
+            if collection in KEYED_COLLECTIONS and id(record) not in removed:
+                upserts.append((collection, self.staged(record)))
+
+        for collection, record in self._appends:
+            if collection in KEYED_COLLECTIONS:
+                upserts.append((collection, self.staged(record)))
+            elif collection == "history":
+                history.append(self.staged(record))
+
+        for collection, record in self._removes:
+            if collection in KEYED_COLLECTIONS:
+                deletes.append((collection, record))
+
+        stat_changes = self._collect_stat_changes()
+
+        return {
+            "upserts": upserts,
+            "deletes": deletes,
+            "history": history,
+            "credit_deltas": dict(self._credit),
+            "stat_deltas": compute_deltas(stat_changes),
+            "daily_deltas": compute_daily_deltas(stat_changes)
+        }
+
+    def _collect_stat_changes(self):
+        """List the staged changes as (collection, before, after) for the loan statistics"""
+        removed = {id(record) for collection, record in self._removes}
+        changes = []
+
+        for collection, record, fields in self._updates.values():
+            if collection == "loans":
+                changes.append(("loans", record, None if id(record) in removed else self.staged(record)))
+
+        for collection, record in self._removes:
+            if id(record) not in self._updates:
+                changes.append((collection, record, None))
+
+        for collection, record in self._appends:
+            changes.append((collection, None, self.staged(record)))
+
+        return changes
+
+    def _apply(self, new_scores, stat_deltas, daily_deltas):
+        """Apply the staged changes in memory (no awaits, so it is atomic on the event loop)"""
+        loan_database = self.bot.loan_database
+        loan_index = get_loan_index(self.bot)
+
+        for collection, record, fields in self._updates.values():
+            record.update(fields)
+
+            # Closed loans and processed requests leave the index
+            if collection == "loans" and record.get("status") not in ACTIVE_STATUSES:
+                loan_index.remove_loan(record)
+            elif collection == "loan_requests" and record.get("status") != "pending":
+                loan_index.remove_request(record)
+
+        for collection, record in self._appends:
+            loan_database.setdefault(collection, []).append(record)
+            if collection == "loans":
+                loan_index.add_loan(record)
+            elif collection == "loan_requests":
+                loan_index.add_request(record)
+
+        for collection, record in self._removes:
+            records = loan_database.get(collection, [])
+            for i in range(len(records) - 1, -1, -1):
+                if records[i] is record:
+                    del records[i]
+                    break
+
+            if collection == "loans":
+                loan_index.remove_loan(record)
+            elif collection == "loan_requests":
+                loan_index.remove_request(record)
+
+        get_loan_stats(self.bot).apply(stat_deltas, daily_deltas)
+
+        # Stored scores win, since other processes may have changed them too
+        credit_scores = loan_database.setdefault("credit_scores", {})
+        for user_id, delta in self._credit.items():
+            if user_id in new_scores:
+                credit_scores[user_id] = new_scores[user_id]
+            else:
+                credit_scores[user_id] = credit_scores.get(user_id, 100) + delta